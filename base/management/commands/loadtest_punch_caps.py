@@ -0,0 +1,216 @@
+"""
+Load test for daily punch saves under the weekly cap (projects.views._record_daily_punch).
+
+Two scenarios run against the configured database with throw-away allocation
+rows (user_ldap "loadtest.*@feas.invalid", removed afterwards unless --keep):
+
+ - contention: every thread punches random days of week 1 of ONE allocation, so
+   all saves compete for the same weekly_allocations row. The stored punches
+   must never exceed the cap and must equal user_punch_week_totals.
+ - throughput: every thread punches its OWN allocation. Saves do not wait on
+   each other, so throughput should scale with threads rather than collapse
+   to the single-row rate: the command fails unless its saves/s is at least
+   --min-speedup times the contention rate and its p95 latency is at most
+   --max-p95-ms.
+
+Each thread uses its own DB connection: MySQL max_connections must exceed --threads.
+
+Usage:  python manage.py loadtest_punch_caps [--threads 200] [--punches 10] [--cap 40]
+            [--min-speedup 2] [--max-p95-ms 2000] [--keep]
+"""
+
+import random
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from projects.punch_totals import PunchRejected, TOTALS_TABLE
+from projects.views import _record_daily_punch, get_billing_period_for_date
+
+USER_PREFIX = "loadtest."
+USER_DOMAIN = "@feas.invalid"
+
+
+class Command(BaseCommand):
+    help = "Concurrency load test for the weekly punch cap (contention and throughput scenarios)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=200, help="Concurrent punchers (default 200).")
+        parser.add_argument("--punches", type=int, default=10, help="Punch saves per thread (default 10).")
+        parser.add_argument("--cap", type=int, default=40, help="Weekly allocation hours (default 40).")
+        parser.add_argument("--min-speedup", type=float, default=2.0,
+                            help="Required throughput/contention saves-per-second ratio (default 2; 0 disables).")
+        parser.add_argument("--max-p95-ms", type=float, default=2000.0,
+                            help="Maximum p95 save latency of the throughput scenario (default 2000; 0 disables).")
+        parser.add_argument("--seed", type=int, default=None, help="Random seed.")
+        parser.add_argument("--keep", action="store_true", help="Keep the load-test rows afterwards.")
+
+    def handle(self, *args, **opts):
+        threads, punches, cap = opts["threads"], opts["punches"], Decimal(opts["cap"])
+        if threads < 1 or punches < 1 or cap <= 0:
+            raise CommandError("--threads, --punches and --cap must be positive")
+        rng = random.Random(opts["seed"])
+
+        billing_start, _billing_end = get_billing_period_for_date(date.today())
+        week_days = [billing_start + timedelta(days=i) for i in range(7)]
+
+        self._cleanup()
+        failures = []
+        try:
+            shared = self._create_allocations(billing_start, cap, 1, "contention")[0]
+            contention = self._run(threads, punches,
+                                   lambda i: (shared[1], shared[0]), week_days, rng)
+            self._report("contention (1 allocation week)", threads, punches, contention)
+            if contention["errors"]:
+                failures.append(f"{contention['errors']} save(s) failed with database errors (deadlock/timeout?)")
+            failures += self._verify([shared[0]], cap)
+
+            own = self._create_allocations(billing_start, cap, threads, "throughput")
+            stats = self._run(threads, punches,
+                              lambda i: (own[i][1], own[i][0]), week_days, rng)
+            self._report(f"throughput ({threads} allocation weeks)", threads, punches, stats)
+            if stats["errors"]:
+                failures.append(f"{stats['errors']} save(s) failed with database errors (deadlock/timeout?)")
+            failures += self._verify([aid for aid, _user in own], cap)
+            failures += self._check_throughput(threads, punches, contention, stats,
+                                               opts["min_speedup"], opts["max_p95_ms"])
+        finally:
+            if not opts["keep"]:
+                self._cleanup()
+
+        if failures:
+            for msg in failures[:20]:
+                self.stderr.write(msg)
+            raise CommandError(f"{len(failures)} cap/total/throughput violation(s)")
+        self.stdout.write(self.style.SUCCESS(
+            "Weekly caps held, totals match the stored punches and throughput scaled."))
+
+    # ---------- fixtures ----------
+    def _create_allocations(self, billing_start, cap, count, label):
+        """[(allocation_id, user_ldap)] with a week-1 allocation of `cap` hours each."""
+        out = []
+        with connection.cursor() as cur:
+            for i in range(count):
+                user = f"{USER_PREFIX}{label}.{i}{USER_DOMAIN}"
+                cur.execute("""
+                    INSERT INTO monthly_allocation_entries (project_id, iom_id, month_start, user_ldap, total_hours)
+                    VALUES (NULL, NULL, %s, %s, %s)
+                """, [billing_start, user, cap])
+                cur.execute("SELECT LAST_INSERT_ID()")
+                allocation_id = cur.fetchone()[0]
+                cur.execute("""
+                    INSERT INTO weekly_allocations (allocation_id, week_number, percent, hours, status)
+                    VALUES (%s, 1, 100.00, %s, 'PENDING')
+                """, [allocation_id, cap])
+                out.append((allocation_id, user))
+        return out
+
+    def _cleanup(self):
+        like = USER_PREFIX + "%" + USER_DOMAIN
+        with connection.cursor() as cur:
+            cur.execute("SELECT id FROM monthly_allocation_entries WHERE user_ldap LIKE %s", [like])
+            ids = [r[0] for r in cur.fetchall()]
+            cur.execute("DELETE FROM user_punches WHERE user_ldap LIKE %s", [like])
+            if ids:
+                in_sql = ",".join(["%s"] * len(ids))
+                cur.execute(f"DELETE FROM {TOTALS_TABLE} WHERE allocation_id IN ({in_sql})", ids)
+                cur.execute(f"DELETE FROM weekly_allocations WHERE allocation_id IN ({in_sql})", ids)
+                cur.execute(f"DELETE FROM monthly_allocation_entries WHERE id IN ({in_sql})", ids)
+
+    # ---------- run / verify ----------
+    def _run(self, threads, punches, target, week_days, rng):
+        plans = [[(rng.choice(week_days), Decimal(rng.randint(1, 8))) for _ in range(punches)]
+                 for _ in range(threads)]
+        barrier = threading.Barrier(threads)
+        lock = threading.Lock()
+        stats = {"ok": 0, "rejected": 0, "errors": 0, "latencies": []}
+
+        def worker(i):
+            user, allocation_id = target(i)
+            ok = rejected = errors = 0
+            latencies = []
+            try:
+                barrier.wait()
+                for punch_date, hours in plans[i]:
+                    t0 = time.perf_counter()
+                    try:
+                        _record_daily_punch(user, allocation_id, punch_date, hours)
+                        ok += 1
+                    except PunchRejected:
+                        rejected += 1
+                    except Exception:
+                        errors += 1
+                    latencies.append(time.perf_counter() - t0)
+            finally:
+                connection.close()
+                with lock:
+                    stats["ok"] += ok
+                    stats["rejected"] += rejected
+                    stats["errors"] += errors
+                    stats["latencies"].extend(latencies)
+
+        workers = [threading.Thread(target=worker, args=(i,), name=f"punch-{i}") for i in range(threads)]
+        started = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        stats["elapsed"] = time.perf_counter() - started
+        return stats
+
+    @staticmethod
+    def _rate(threads, punches, stats):
+        return (threads * punches) / stats["elapsed"] if stats["elapsed"] else 0.0
+
+    @staticmethod
+    def _p95_ms(stats):
+        lat = sorted(stats["latencies"]) or [0.0]
+        return lat[min(len(lat) - 1, int(len(lat) * 0.95))] * 1000
+
+    def _check_throughput(self, threads, punches, contention, stats, min_speedup, max_p95_ms):
+        """Failures when independent allocation weeks do not save faster than one shared week."""
+        failures = []
+        base, rate = self._rate(threads, punches, contention), self._rate(threads, punches, stats)
+        if min_speedup and rate < base * min_speedup:
+            failures.append(f"throughput {rate:.0f} saves/s is below {min_speedup:g}x "
+                            f"the contention rate {base:.0f} saves/s")
+        p95 = self._p95_ms(stats)
+        if max_p95_ms and p95 > max_p95_ms:
+            failures.append(f"throughput p95 {p95:.1f}ms exceeds --max-p95-ms {max_p95_ms:g}")
+        return failures
+
+    def _report(self, title, threads, punches, stats):
+        lat = sorted(stats["latencies"]) or [0.0]
+        p50 = lat[len(lat) // 2] * 1000
+        p95 = self._p95_ms(stats)
+        rate = self._rate(threads, punches, stats)
+        self.stdout.write(
+            f"{title}: {threads} threads x {punches} saves in {stats['elapsed']:.2f}s "
+            f"({rate:.0f} saves/s), ok={stats['ok']} rejected={stats['rejected']} errors={stats['errors']}, "
+            f"p50={p50:.1f}ms p95={p95:.1f}ms"
+        )
+
+    def _verify(self, allocation_ids, cap):
+        in_sql = ",".join(["%s"] * len(allocation_ids))
+        with connection.cursor() as cur:
+            cur.execute(f"""
+                SELECT a.id, COALESCE(SUM(up.actual_hours), 0), COALESCE(MAX(t.punched_hours), 0)
+                FROM monthly_allocation_entries a
+                LEFT JOIN user_punches up ON up.allocation_id = a.id AND up.week_number = 1
+                LEFT JOIN {TOTALS_TABLE} t ON t.allocation_id = a.id AND t.week_number = 1
+                WHERE a.id IN ({in_sql})
+                GROUP BY a.id
+            """, allocation_ids)
+            rows = cur.fetchall()
+        failures = []
+        for allocation_id, punched, total in rows:
+            punched, total = Decimal(str(punched)), Decimal(str(total))
+            if punched > cap:
+                failures.append(f"allocation {allocation_id}: {punched} punched hours exceed cap {cap}")
+            if punched != total:
+                failures.append(f"allocation {allocation_id}: punches sum {punched} != weekly total {total}")
+        return failures
@@ -0,0 +1,40 @@
+"""
+Rebuild user_capacity_ledger and iom_month_consumption from
+monthly_allocation_entries and re-read each period's max_hours / holidays. Both
+are normally maintained incrementally by allocation writes; use this after
+manual data fixes or bulk loads.
+
+Usage:  python manage.py rebuild_capacity_ledger [--period YYYY-MM-DD]
+"""
+
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from projects.capacity import rebuild_capacity_ledger, rebuild_iom_consumption
+
+
+class Command(BaseCommand):
+    help = "Recompute the capacity ledger and IOM consumption from monthly allocations."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--period",
+            help="Billing start date (YYYY-MM-DD) to rebuild; all periods when omitted.",
+        )
+
+    def handle(self, *args, **opts):
+        period = None
+        if opts.get("period"):
+            try:
+                period = datetime.datetime.strptime(opts["period"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("--period must be YYYY-MM-DD")
+
+        with transaction.atomic():
+            with connection.cursor() as cur:
+                rows = rebuild_capacity_ledger(cur, period)
+                iom_rows = rebuild_iom_consumption(cur, period)
+        self.stdout.write(self.style.SUCCESS(f"Capacity ledger rebuilt: {rows} (user, period) rows."))
+        self.stdout.write(self.style.SUCCESS(f"IOM consumption rebuilt: {iom_rows} (IOM, month) rows."))
@@ -0,0 +1,37 @@
+"""
+Rebuild user_punch_week_totals from user_punches. The totals are normally
+maintained incrementally by punch writes; use this after manual data fixes or
+bulk loads of punches.
+
+Usage:  python manage.py rebuild_punch_week_totals [--month-start YYYY-MM-DD]
+"""
+
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from projects.punch_totals import rebuild_punch_week_totals
+
+
+class Command(BaseCommand):
+    help = "Recompute weekly punch totals per allocation from user_punches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--month-start",
+            help="Billing start date (YYYY-MM-DD); only allocations of that month are rebuilt.",
+        )
+
+    def handle(self, *args, **opts):
+        month_start = None
+        if opts.get("month_start"):
+            try:
+                month_start = datetime.datetime.strptime(opts["month_start"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("--month-start must be YYYY-MM-DD")
+
+        with transaction.atomic():
+            with connection.cursor() as cur:
+                rows = rebuild_punch_week_totals(cur, month_start)
+        self.stdout.write(self.style.SUCCESS(f"Punch week totals rebuilt: {rows} (allocation, week) rows."))
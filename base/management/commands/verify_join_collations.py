@@ -0,0 +1,166 @@
+"""
+Verify that the hot string joins used by the views compare columns of the same
+charset/collation and can use an index on the joined side.
+
+For every join below the command:
+ - compares the collations of both join columns (information_schema.COLUMNS);
+ - runs EXPLAIN on the query shape used by the views;
+ - fails when the joined table is read with a full scan (type=ALL) while the
+   join columns' collations differ, i.e. a scan caused by implicit conversion.
+
+Full scans with matching collations (e.g. on near-empty tables, where the
+optimizer prefers a scan) are reported but do not fail the check.
+
+Usage:  python manage.py verify_join_collations [--strict]
+"""
+
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from feas_project.db_migrations import target_collation
+
+
+# (description, SQL as issued by the views, params, [(left col, right col, alias of joined table)])
+HOT_JOINS = [
+    (
+        "team_allocations: monthly_allocation_entries -> users by email",
+        """
+        SELECT mae.id, u.username, u.email
+        FROM monthly_allocation_entries mae
+        LEFT JOIN users u ON u.email = mae.user_ldap
+        WHERE mae.month_start = %s
+        """,
+        ["month_start"],
+        [(("monthly_allocation_entries", "user_ldap"), ("users", "email"), "u")],
+    ),
+    (
+        "team/my allocations: monthly_allocation_entries -> prism_wbs by iom_id",
+        """
+        SELECT mae.id, pw.department
+        FROM monthly_allocation_entries mae
+        LEFT JOIN prism_wbs pw ON mae.iom_id = pw.iom_id
+        WHERE mae.user_ldap = %s AND mae.month_start = %s
+        """,
+        ["user", "month_start"],
+        [(("monthly_allocation_entries", "iom_id"), ("prism_wbs", "iom_id"), "pw")],
+    ),
+    (
+        "punch exports: user_punches -> allocations -> prism_wbs",
+        """
+        SELECT up.punch_date, pw.iom_id
+        FROM user_punches up
+        LEFT JOIN monthly_allocation_entries mae ON mae.id = up.allocation_id
+        LEFT JOIN prism_wbs pw ON mae.iom_id = pw.iom_id
+        WHERE up.user_ldap = %s AND up.punch_date BETWEEN %s AND %s
+        """,
+        ["user", "month_start", "month_end"],
+        [(("monthly_allocation_entries", "iom_id"), ("prism_wbs", "iom_id"), "pw")],
+    ),
+    (
+        "team view: monthly_allocation_entries -> ldap_directory by email",
+        """
+        SELECT mae.id, ld.cn
+        FROM monthly_allocation_entries mae
+        LEFT JOIN ldap_directory ld ON ld.email = mae.user_ldap
+        WHERE mae.month_start = %s
+        """,
+        ["month_start"],
+        [(("monthly_allocation_entries", "user_ldap"), ("ldap_directory", "email"), "ld")],
+    ),
+    (
+        "employee directory: ldap_directory -> users by username",
+        """
+        SELECT ld.id, ld.username
+        FROM ldap_directory ld
+        JOIN users u ON (u.username = ld.username)
+        WHERE ld.cn LIKE %s
+        """,
+        ["like"],
+        [(("ldap_directory", "username"), ("users", "username"), "u")],
+    ),
+]
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the hot string joins and fail on collation-induced full scans."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--strict", action="store_true",
+            help="Also fail on any collation mismatch between join columns, scan or not.",
+        )
+
+    def _column_collations(self, cur):
+        cur.execute("""
+            SELECT TABLE_NAME, COLUMN_NAME, CHARACTER_SET_NAME, COLLATION_NAME
+            FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND COLLATION_NAME IS NOT NULL
+        """)
+        return {(t.lower(), c.lower()): (cs, coll) for t, c, cs, coll in cur.fetchall()}
+
+    def _explain(self, cur, sql, params):
+        cur.execute("EXPLAIN " + sql, params)
+        cols = [c[0].lower() for c in cur.description]
+        return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+    def handle(self, *args, **opts):
+        today = datetime.date.today()
+        sample = {
+            "month_start": today.replace(day=1),
+            "month_end": today,
+            "user": "verify@example.com",
+            "like": "%verify%",
+        }
+        failures = []
+        mismatches = []
+        target = target_collation()
+
+        with connection.cursor() as cur:
+            collations = self._column_collations(cur)
+            for title, sql, param_keys, joins in HOT_JOINS:
+                self.stdout.write(f"- {title}")
+                try:
+                    plan = self._explain(cur, sql, [sample[k] for k in param_keys])
+                except Exception as e:
+                    self.stdout.write(self.style.WARNING(f"    EXPLAIN failed (table missing?): {e}"))
+                    continue
+                by_alias = {str(r.get("table")): r for r in plan}
+                for (lt, lc), (rt, rc), alias in joins:
+                    left = collations.get((lt, lc))
+                    right = collations.get((rt, rc))
+                    row = by_alias.get(alias, {})
+                    access = row.get("type")
+                    key = row.get("key")
+                    mismatch = bool(left and right and left[1] != right[1])
+                    detail = (f"{lt}.{lc} [{left[1] if left else '?'}] = {rt}.{rc} [{right[1] if right else '?'}]; "
+                              f"{alias}: type={access} key={key}")
+                    if mismatch:
+                        mismatches.append(detail)
+                    if mismatch and access == "ALL":
+                        failures.append(f"{title}: {detail}")
+                        self.stdout.write(self.style.ERROR(f"    FULL SCAN (collation mismatch) {detail}"))
+                    elif mismatch:
+                        self.stdout.write(self.style.WARNING(f"    collation mismatch {detail}"))
+                    elif access == "ALL":
+                        self.stdout.write(f"    full scan, collations match (check indexes/statistics) {detail}")
+                    else:
+                        self.stdout.write(self.style.SUCCESS(f"    ok {detail}"))
+
+            off_target = sorted({f"{t}.{c} ({coll})" for (t, c), (_cs, coll) in collations.items() if coll != target})
+            if off_target:
+                self.stdout.write(self.style.WARNING(
+                    f"{len(off_target)} string columns are not {target}; "
+                    f"pending schema migrations will convert them: {', '.join(off_target[:20])}"))
+
+        if failures:
+            raise CommandError(f"{len(failures)} hot join(s) full-scan because of a collation mismatch:\n  "
+                               + "\n  ".join(failures))
+        if opts["strict"] and mismatches:
+            raise CommandError(f"{len(mismatches)} join column collation mismatch(es):\n  " + "\n  ".join(mismatches))
+        if mismatches:
+            self.stdout.write(self.style.WARNING(
+                f"No collation-induced full scans, but {len(mismatches)} join(s) compare different collations."))
+        else:
+            self.stdout.write(self.style.SUCCESS("All hot joins compare matching collations."))
@@ -6,6 +6,10 @@ from datetime import date
 from calendar import month_name
 from django.db import connection
 
+from projects.capacity import billing_start_for, get_capacity, period_available_hours, user_key
+from projects.ownership import ROLE_CREATOR, owned_subquery, session_owner_keys
+from projects.wbs_monthly import monthly_series
+
 # ---------------------------------------------------------------------
 #  Utility helpers
 # ---------------------------------------------------------------------
@@ -82,20 +86,17 @@ def dashboard_view(request):
 def compute_user_stats(user_ldap, month_iso):
     """Compute individual utilization for a given month."""
     year, mon = map(int, month_iso.split("-"))
-    sql = """
-        SELECT SUM(total_hours) AS total
-        FROM monthly_allocation_entries
-        WHERE user_ldap = %s
-          AND DATE_FORMAT(month_start, '%%Y-%%m') = %s
-    """
-    rows = dict_fetchall(sql, (user_ldap, f"{year}-{mon:02d}"))
-    total = float(rows[0]["total"] or 0)
-    max_hours = 183.75  # or from monthly_hours_limit
+    # capacity ledger: cross-project hours and the period's max_hours minus holidays
+    with connection.cursor() as cur:
+        billing_start = billing_start_for(cur, year, mon)
+        cap = get_capacity(cur, [user_ldap], billing_start).get(user_key(user_ldap))
+    total = cap["allocated"] if cap else 0.0
+    max_hours = cap["available"] if cap else 0.0
     util = round((total / max_hours * 100) if max_hours else 0, 1)
     return {
         "this_month_hours": total,
         "utilization_percent": util,
-        "remaining_hours": round(max(max_hours - total, 0), 2),
+        "remaining_hours": cap["remaining"] if cap else 0.0,
     }
 
 def list_user_allocations(user_ldap):
@@ -187,7 +188,8 @@ def compute_manager_totals(reportees, year):
 
     This function calculates the total hours allocated to all direct reportees of a manager
     for a given year. It also computes the billing ratio, which is the percentage of total
-    allocated hours compared to the maximum possible hours (183.75 per reportee). The result
+    allocated hours compared to the maximum possible hours (the current billing period's
+    max_hours minus holidays, per reportee). The result
     includes the total allocation, billing ratio, and a placeholder for open allocations.
 
     Args:
@@ -201,7 +203,7 @@ def compute_manager_totals(reportees, year):
             - open_allocations (int): Placeholder for open allocations (currently always 0).
 
     SQL Query Details:
-        - Sums total_hours from monthly_allocation_entries for all reportees in the given year.
+        - Sums allocated_hours from user_capacity_ledger for all reportees in the given year.
 
     Example:
         totals = compute_manager_totals(reportees, 2024)
@@ -215,16 +217,22 @@ def compute_manager_totals(reportees, year):
         return {"team_alloc": 0, "billing_ratio": "0%", "open_allocations": 0}
 
     udns = [r["user_ldap"] for r in reportees if r.get("user_ldap")]
-    placeholders = ",".join(["%s"] * len(udns))
+    keys = sorted({user_key(u) for u in udns if user_key(u)})
+    if not keys:
+        return {"team_alloc": 0, "billing_ratio": "0%", "open_allocations": 0}
+    placeholders = ",".join(["%s"] * len(keys))
     sql = f"""
-        SELECT SUM(total_hours) AS total_alloc
-        FROM monthly_allocation_entries
-        WHERE user_ldap IN ({placeholders})
-          AND YEAR(month_start) = %s
+        SELECT SUM(allocated_hours) AS total_alloc
+        FROM user_capacity_ledger
+        WHERE user_key IN ({placeholders})
+          AND period_start >= %s AND period_start < %s
     """
-    rows = dict_fetchall(sql, udns + [year])
+    rows = dict_fetchall(sql, keys + [date(int(year), 1, 1), date(int(year) + 1, 1, 1)])
     total_alloc = float(rows[0]["total_alloc"] or 0)
-    br = round((total_alloc / (len(udns) * 183.75) * 100) if udns else 0, 1)
+    today = date.today()
+    with connection.cursor() as cur:
+        per_person = period_available_hours(cur, billing_start_for(cur, today.year, today.month))
+    br = round((total_alloc / (len(keys) * per_person) * 100) if per_person else 0, 1)
     return {
         "team_alloc": total_alloc,
         "billing_ratio": f"{br}%",
@@ -232,92 +240,10 @@ def compute_manager_totals(reportees, year):
     }
 
 
-# ---------------------------------------------------------------------
-#  PDL helper: resolve creators
-# ---------------------------------------------------------------------
-def resolve_possible_creators_from_session(request):
-    """
-    Return a list of possible strings that might match prism_wbs.creator for the current logged-in user.
-
-    This function generates a list of possible creator identifiers based on the user's session and profile.
-    It considers the user's common name (cn), username, display name, and related LDAP directory entries.
-    The output is used to match records in the database where the creator field may have different formats.
-
-    Args:
-        request (HttpRequest): The Django request object containing session and user info.
-
-    Returns:
-        List[str]: A list of possible creator strings for the current user.
-    """
-    possible = []  # List to collect possible creator strings
-
-    cn = request.session.get('cn')  # Get common name from session
-    if cn:
-        cn = str(cn).strip()  # Ensure it's a string and strip whitespace
-        possible.append(cn)  # Add original CN
-        parts = cn.split()  # Split CN into parts
-        if len(parts) >= 2:
-            first = parts[0]
-            rest = parts[1:]
-            reversed_form = " ".join(rest + [first])  # Reverse order
-            if reversed_form not in possible:
-                possible.append(reversed_form)  # Add reversed CN if not present
-        cap = " ".join([p.capitalize() for p in cn.split()])  # Capitalize each part
-        if cap not in possible:
-            possible.append(cap)  # Add capitalized CN
-
-    username = request.session.get('ldap_username') or getattr(request.user, 'ldap_username', None)  # Get username from session or user object
-    if username:
-        username = str(username).strip()
-        if username not in possible:
-            possible.append(username)  # Add username
-        if '@' in username:
-            local = username.split('@')[0]  # Get local part before @
-            if '.' in local:
-                candidate = " ".join([p.capitalize() for p in local.split('.')])  # Capitalize dot-separated parts
-                if candidate not in possible:
-                    possible.append(candidate)  # Add candidate
-            else:
-                candidate = local.capitalize()
-                if candidate not in possible:
-                    possible.append(candidate)  # Add capitalized local part
-
-    try:
-        display = request.user.get_full_name()  # Try to get user's display name
-    except Exception:
-        display = None
-    if display:
-        display = display.strip()
-        if display and display not in possible:
-            possible.append(display)  # Add display name if not present
-
-    try:
-        if username:
-            # Query LDAP directory for matching CN, username, or mail
-            rows = dict_fetchall(
-                "SELECT cn, username, mail FROM ldap_directory WHERE username=%s OR mail=%s LIMIT 5",
-                (username, username)
-            )
-            for r in rows:
-                if r.get('cn') and r['cn'] not in possible:
-                    possible.append(r['cn'])  # Add CN from LDAP
-                if r.get('mail') and r['mail'] not in possible:
-                    possible.append(r['mail'])  # Add mail from LDAP
-                if r.get('username') and r['username'] not in possible:
-                    possible.append(r['username'])  # Add username from LDAP
-    except Exception:
-        pass  # Ignore errors in LDAP lookup
-
-    out = []  # Final output list, deduplicated
-    for p in possible:
-        if p and p not in out:
-            out.append(p)  # Add unique, non-empty values
-
-    return out  # Return list of possible creator strings
-
-
 # ---------------------------------------------------------------------
 #  PDL totals and helpers (original functions retained)
+#  Creator visibility goes through project_ownership (projects/ownership.py),
+#  which already holds every creator spelling that maps to the session user.
 # ---------------------------------------------------------------------
 def compute_pdl_totals(year, request):
     """
@@ -325,19 +251,19 @@ def compute_pdl_totals(year, request):
     The original implementation also computed cost; we keep returning the same keys
     but the template will only render hours (we intentionally do not display cost).
     """
-    creator_candidates = resolve_possible_creators_from_session(request)
-    if not creator_candidates:
+    owner_keys = session_owner_keys(request.session)
+    if not owner_keys:
         return {"ytd_hours": 0, "ytd_cost": 0.0, "month_cost": 0.0, "month_estimate": 0.0}
 
-    placeholders = ",".join(["%s"] * len(creator_candidates))
+    owned_sql, owned_params = owned_subquery(owner_keys, "creator", roles=[ROLE_CREATOR])
     sql = f"""
         SELECT
-          COALESCE(SUM(CAST(total_hours AS DECIMAL(18,2))),0) AS total_hours,
-          COALESCE(SUM(CAST(total_hour_costs_local AS DECIMAL(18,2))),0) AS total_cost_local
+          COALESCE(SUM(total_hours),0) AS total_hours,
+          COALESCE(SUM(total_hour_costs_local),0) AS total_cost_local
         FROM prism_master_wor
-        WHERE year=%s AND creator IN ({placeholders})
+        WHERE year=%s AND creator IN ({owned_sql})
     """
-    params = [str(year)] + creator_candidates
+    params = [str(year)] + owned_params
     rows = dict_fetchall(sql, params)
     if not rows:
         return {"ytd_hours": 0, "ytd_cost": 0.0, "month_cost": 0.0, "month_estimate": 0.0}
@@ -354,7 +280,8 @@ def compute_pdl_totals(year, request):
 # ---------------------------------------------------------------------
 #  NEW: PDL hours series (monthly consumed vs estimated/allotted)
 #  Endpoint: returns JSON { labels: [...], consumed: [...], estimated: [...] }
-#  Uses prism_master_wor per-month columns (jan..dec) for consumed and total_hours for estimated.
+#  Uses prism_master_wor per-month columns (jan..dec) for consumed and prism_wbs_monthly
+#  planned hours for estimated (total_hours spread evenly when no monthly plan exists).
 #  Assumption: prism_master_wor contains the monthly columns jan..dec and total_hours.
 # ---------------------------------------------------------------------
 
@@ -363,32 +290,39 @@ def pdl_hours_series(request, year):
     Returns monthly series (consumed & estimated) for the logged-in user's created IOMs.
     Query param: ?year=YYYY (path param is also accepted by your urls if configured)
     """
-    creator_candidates = resolve_possible_creators_from_session(request)
+    owner_keys = session_owner_keys(request.session)
     labels = [m.capitalize() for m in ["jan","feb","mar","apr","may","jun","jul","aug","sep","oct","nov","dec"]]
     consumed = [0.0]*12
     estimated = [0.0]*12
 
-    if not creator_candidates:
+    if not owner_keys:
         return JsonResponse({"labels": labels, "consumed": consumed, "estimated": estimated})
 
-    placeholders = ",".join(["%s"] * len(creator_candidates))
+    owned_sql, owned_params = owned_subquery(owner_keys, "creator", roles=[ROLE_CREATOR])
     # select monthly columns if present
     select_cols = ", ".join([f"COALESCE({c},0) as {c}" for c in ["jan","feb","mar","apr","may","jun","jul","aug","sep","oct","nov","dec"]])
-    sql = f"SELECT {select_cols}, CAST(total_hours AS DECIMAL(18,2)) AS total_hours FROM prism_master_wor WHERE year=%s AND creator IN ({placeholders})"
-    params = [str(year)] + creator_candidates
+    sql = f"SELECT {select_cols}, total_hours FROM prism_master_wor WHERE year=%s AND creator IN ({owned_sql})"
+    params = [str(year)] + owned_params
     rows = dict_fetchall(sql, params)
 
+    # planned hours per month of the user's IOMs: one GROUP BY over prism_wbs_monthly
+    owned_ioms_sql, owned_ioms_params = owned_subquery(owner_keys, "iom_id", roles=[ROLE_CREATOR])
+    with connection.cursor() as cur:
+        planned, _fte = monthly_series(cur, year, owned_ioms_sql, owned_ioms_params)
+
+    total_spread = 0.0
     if rows:
         # accumulate consumed months
         for r in rows:
             for i, c in enumerate(["jan","feb","mar","apr","may","jun","jul","aug","sep","oct","nov","dec"]):
                 consumed[i] += float(r.get(c) or 0.0)
-            total_hours = float(r.get('total_hours') or 0.0)
-            # if per-month estimate not present, distribute total_hours evenly across 12 months
-            if total_hours:
-                per_month = total_hours / 12.0
-                for i in range(12):
-                    estimated[i] += per_month
+            total_spread += float(r.get('total_hours') or 0.0)
+
+    if any(planned):
+        estimated = planned
+    elif total_spread:
+        # no per-month plan imported: distribute total_hours evenly across 12 months
+        estimated = [total_spread / 12.0] * 12
 
     # return floats (JSON friendly)
     consumed = [round(x, 2) for x in consumed]
@@ -412,13 +346,14 @@ def pdl_program_breakdown(request):
     month = request.GET.get('month')  # numeric '1'..'12' or None
     dept = request.GET.get('dept')
 
-    creator_candidates = resolve_possible_creators_from_session(request)
-    if not creator_candidates:
+    owner_keys = session_owner_keys(request.session)
+    if not owner_keys:
         return JsonResponse({"items": []})
 
-    placeholders = ",".join(["%s"] * len(creator_candidates))
+    owned_creators_sql, owned_params = owned_subquery(owner_keys, "creator", roles=[ROLE_CREATOR])
+    owned_ioms_sql, _ = owned_subquery(owner_keys, "iom_id", roles=[ROLE_CREATOR])
 
-    params = [str(year)] + creator_candidates
+    params = [str(year)] + owned_params
     # If month provided we try to sum that single month column from prism_master_wor (safer route)
     if month:
         try:
@@ -432,7 +367,7 @@ def pdl_program_breakdown(request):
                        COALESCE(SUM(COALESCE(pm.{month_col},0)),0) AS consumed,
                        0 AS allotted
                 FROM prism_master_wor pm
-                WHERE pm.year=%s AND pm.creator IN ({placeholders})
+                WHERE pm.year=%s AND pm.creator IN ({owned_creators_sql})
             """
             if dept:
                 sql += " AND pm.department = %s"
@@ -451,7 +386,7 @@ def pdl_program_breakdown(request):
                    COALESCE(SUM(COALESCE(wb.allotted_hours,0)),0) AS allotted,
                    COALESCE(SUM(COALESCE(wb.consumed_hours,0)),0) AS consumed
             FROM prism_wbs wb
-            WHERE wb.year=%s AND wb.creator IN ({placeholders})
+            WHERE wb.year=%s AND wb.iom_id IN ({owned_ioms_sql})
         """
         if dept:
             sql += " AND wb.department = %s"
@@ -469,14 +404,14 @@ def pdl_program_breakdown(request):
 # ---------------------------------------------------------------------
 def pdl_dept_summary(request, year):
     """Department summary restricted to logged-in user's created IOMs."""
-    creator_cn = request.session.get("cn") or request.session['ldap_username'] or ""
-    sql = """
+    owned_sql, owned_params = owned_subquery(session_owner_keys(request.session), "iom_id", roles=[ROLE_CREATOR])
+    sql = f"""
         SELECT department, SUM(total_hours) AS hours
         FROM prism_wbs
-        WHERE year = %s AND creator = %s
+        WHERE year = %s AND iom_id IN ({owned_sql})
         GROUP BY department
     """
-    rows = dict_fetchall(sql, (str(year), creator_cn))
+    rows = dict_fetchall(sql, [str(year)] + owned_params)
     labels = [r["department"] or "Unknown" for r in rows]
     values = [float(r["hours"] or 0) for r in rows]
     return JsonResponse({"labels": labels, "data": values})
@@ -10,6 +10,8 @@ Behavior:
  - Seeds 'roles' lookup table.
  - Stores a one-time init flag in `system_settings` (configurable via settings.DB_INIT_DONE_TABLE).
  - Safe to call multiple times; real work runs only on the first call.
+ - Afterwards (first call or not) applies pending versioned migrations from
+   feas_project/db_migrations.py, so later schema changes reach existing databases.
 """
 
 import os
@@ -20,6 +22,8 @@ from typing import Dict, Tuple
 import mysql.connector
 from mysql.connector import errorcode, Error
 
+from feas_project.db_migrations import MigrationRunner
+
 try:
     import django
     from django.conf import settings
@@ -543,11 +547,12 @@ class DatabaseInitializer:
             self._execute_statements(conn, [self.ddl_statements[0]])
             if self._is_already_initialized(conn):
                 print("FEAS: Database already initialized. Skipping.")
-                return True
-            self._execute_statements(conn, list(self.ddl_statements[1:]))
-            self._seed_roles(conn)
-            self._set_initialized_flag(conn)
-            print("FEAS: Database initialization completed successfully.")
+            else:
+                self._execute_statements(conn, list(self.ddl_statements[1:]))
+                self._seed_roles(conn)
+                self._set_initialized_flag(conn)
+                print("FEAS: Database initialization completed successfully.")
+            MigrationRunner(conn).migrate()
             return True
         except mysql.connector.Error:
             print("FEAS: Database initialization failed due to MySQL error.")
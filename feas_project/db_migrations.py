@@ -0,0 +1,642 @@
+"""
+feas_project/db_migrations.py
+
+Versioned schema migrations for FEAS using mysql.connector (same style as db_initializer).
+
+Behavior:
+ - Applied versions are recorded in `schema_version` (one row per migration).
+ - `MIGRATIONS` is an ordered list; only versions newer than the highest applied
+   one run, each exactly once, in order.
+ - Every operation is idempotent on its own (checked against information_schema),
+   so a migration interrupted half-way can simply be re-run.
+ - Index and column changes use online DDL (ALGORITHM=INPLACE/INSTANT, LOCK=NONE)
+   and fall back to the server's default algorithm when that is not supported.
+ - A MySQL named lock serialises concurrent runners (e.g. two logins at once).
+
+Run standalone:  DJANGO_SETTINGS_MODULE=feas_project.settings python -m feas_project.db_migrations
+"""
+
+import os
+import sys
+import time
+import traceback
+from typing import Callable, List, NamedTuple, Sequence, Tuple
+
+import mysql.connector
+
+SCHEMA_VERSION_TABLE = "schema_version"
+DEFAULT_TARGET_COLLATION = "utf8mb4_0900_ai_ci"
+MIGRATION_LOCK_NAME = "feas_schema_migrations"
+MIGRATION_LOCK_TIMEOUT = 60
+
+# MySQL error numbers for "ALGORITHM=... / LOCK=... is not supported"
+ONLINE_DDL_UNSUPPORTED = {1845, 1846, 4092}
+
+
+# ---------- Operations ----------
+class Op(NamedTuple):
+    kind: str
+    args: Tuple
+
+
+def create_table(table: str, ddl: str) -> Op:
+    """CREATE TABLE (ddl should use IF NOT EXISTS; skipped when the table exists)."""
+    return Op("create_table", (table, ddl))
+
+
+def add_column(table: str, column: str, definition: str) -> Op:
+    """ALTER TABLE ... ADD COLUMN, skipped when the column already exists."""
+    return Op("add_column", (table, column, definition))
+
+
+def add_index(table: str, name: str, columns: Sequence[str], unique: bool = False) -> Op:
+    """ALTER TABLE ... ADD [UNIQUE] INDEX, skipped when an index with that name exists."""
+    return Op("add_index", (table, name, tuple(columns), unique))
+
+
+def drop_index(table: str, name: str) -> Op:
+    """ALTER TABLE ... DROP INDEX, skipped when the index does not exist."""
+    return Op("drop_index", (table, name))
+
+
+def run_sql(sql: str, params: Sequence = ()) -> Op:
+    """Arbitrary statement; must be idempotent by itself (e.g. INSERT IGNORE / ON DUPLICATE KEY)."""
+    return Op("sql", (sql, tuple(params)))
+
+
+def run_python(func: Callable) -> Op:
+    """func(conn, cursor) for steps that need inspection first; must be idempotent."""
+    return Op("python", (func,))
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    operations: List[Op]
+
+
+# ---------- Migration helpers ----------
+def _unique_key_columns(cursor, table: str) -> List[Tuple[str, ...]]:
+    """Column tuples of every UNIQUE index on `table` (PRIMARY excluded)."""
+    cursor.execute("""
+        SELECT INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+          AND NON_UNIQUE = 0 AND INDEX_NAME <> 'PRIMARY'
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """, (table,))
+    keys = {}
+    for index_name, column_name in cursor.fetchall():
+        keys.setdefault(index_name, []).append(str(column_name).lower())
+    return [tuple(cols) for cols in keys.values()]
+
+
+def _ensure_punch_unique_key(conn, cursor):
+    """
+    save_my_alloc_daily upserts on (user_ldap, allocation_id, punch_date); a
+    user_punches table created by hand may lack that key.
+    """
+    if ("user_ldap", "allocation_id", "punch_date") in _unique_key_columns(cursor, "user_punches"):
+        return
+    cursor.execute("""
+        ALTER TABLE `user_punches`
+        ADD UNIQUE KEY `uq_punch_user_alloc_date` (`user_ldap`, `allocation_id`, `punch_date`)
+    """)
+
+
+def target_collation() -> str:
+    """Collation every FEAS table and string column is normalised to (settings.DB_TARGET_COLLATION)."""
+    try:
+        from django.conf import settings
+        return getattr(settings, "DB_TARGET_COLLATION", DEFAULT_TARGET_COLLATION)
+    except Exception:
+        return DEFAULT_TARGET_COLLATION
+
+
+def _harmonize_collations(conn, cursor):
+    """
+    Convert every base table whose default collation, or any of whose string
+    columns, differs from target_collation(). Join columns then compare without
+    implicit conversion and can use their indexes. CONVERT TO rebuilds the table
+    (no online algorithm exists for it), so already-matching tables are skipped.
+    Foreign key checks are suspended so both sides of a string FK
+    (e.g. monthly_allocation_entries.iom_id -> prism_wbs.iom_id) can be converted.
+    """
+    collation = target_collation()
+    charset = collation.split("_", 1)[0]
+    cursor.execute("""
+        SELECT t.TABLE_NAME
+        FROM information_schema.TABLES t
+        WHERE t.TABLE_SCHEMA = DATABASE() AND t.TABLE_TYPE = 'BASE TABLE'
+          AND (t.TABLE_COLLATION <> %s OR EXISTS (
+                SELECT 1 FROM information_schema.COLUMNS c
+                WHERE c.TABLE_SCHEMA = t.TABLE_SCHEMA AND c.TABLE_NAME = t.TABLE_NAME
+                  AND c.COLLATION_NAME IS NOT NULL AND c.COLLATION_NAME <> %s))
+        ORDER BY t.TABLE_NAME
+    """, (collation, collation))
+    tables = [r[0] for r in cursor.fetchall()]
+    cursor.execute(f"ALTER DATABASE CHARACTER SET {charset} COLLATE {collation}")
+    if not tables:
+        return
+    cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+    try:
+        for table in tables:
+            print(f"  converting {table} to {collation}")
+            cursor.execute(f"ALTER TABLE `{table}` CONVERT TO CHARACTER SET {charset} COLLATE {collation}")
+    finally:
+        cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+
+
+def _table_exists(cursor, table: str) -> bool:
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table,))
+    return bool((cursor.fetchone() or [0])[0])
+
+
+def _dedupe_allocation_entries(conn, cursor):
+    """
+    Collapse duplicate monthly_allocation_entries rows sharing
+    (project_id, iom_id, month_start, user_key) before the unique key is added.
+    The newest row (highest id) is kept, matching save_monthly_allocations'
+    "last payload item wins". Children of the dropped duplicates are moved onto
+    the kept row first (projects.punch_totals.merge_allocation_children: same-day
+    punch hours are summed, the kept row's weeks win) so the FK cascade removes
+    nothing. Derived tables that already exist (capacity ledger, IOM
+    consumption, punch week totals) are rebuilt afterwards.
+    """
+    cursor.execute("""
+        SELECT d.id, MAX(k.id) FROM `monthly_allocation_entries` d
+        JOIN `monthly_allocation_entries` k
+          ON k.project_id = d.project_id AND k.iom_id = d.iom_id
+         AND k.month_start = d.month_start AND k.user_key = d.user_key
+         AND k.id > d.id
+        GROUP BY d.id
+    """)
+    pairs = cursor.fetchall()
+    if not pairs:
+        return
+
+    from projects.punch_totals import merge_allocation_children
+    punches_merged = punches_moved = weeks_moved = 0
+    for dup_id, kept_id in pairs:
+        merged, moved, weeks = merge_allocation_children(cursor, dup_id, kept_id)
+        punches_merged += merged
+        punches_moved += moved
+        weeks_moved += weeks
+
+    ids = [dup_id for dup_id, _kept in pairs]
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        cursor.execute(
+            "DELETE FROM `monthly_allocation_entries` WHERE id IN (" + ",".join(["%s"] * len(chunk)) + ")",
+            chunk,
+        )
+    print(f"  removed {len(ids)} duplicate allocation rows "
+          f"(punches merged {punches_merged}, moved {punches_moved}; weekly rows moved {weeks_moved})")
+
+    if _table_exists(cursor, "user_capacity_ledger"):
+        from projects.capacity import rebuild_capacity_ledger
+        rebuild_capacity_ledger(cursor)
+    if _table_exists(cursor, "iom_month_consumption"):
+        from projects.capacity import rebuild_iom_consumption
+        rebuild_iom_consumption(cursor)
+    if _table_exists(cursor, "user_punch_week_totals"):
+        from projects.punch_totals import rebuild_punch_week_totals
+        rebuild_punch_week_totals(cursor)
+
+
+def _build_capacity_ledger(conn, cursor):
+    """Backfill user_capacity_ledger from existing monthly_allocation_entries."""
+    from projects.capacity import rebuild_capacity_ledger
+    print(f"  capacity ledger rows built: {rebuild_capacity_ledger(cursor)}")
+
+
+def _build_project_ownership(conn, cursor):
+    """Populate project_ownership from prism_wbs creators and project PDLs."""
+    from projects.ownership import rebuild_project_ownership
+    print(f"  ownership rows built: {rebuild_project_ownership(cursor)}")
+
+
+def _build_wbs_monthly(conn, cursor):
+    """Backfill prism_wbs_monthly from the wide prism_wbs month columns."""
+    from projects.wbs_monthly import refresh_wbs_monthly
+    print(f"  prism_wbs_monthly rows built: {refresh_wbs_monthly(cursor)}")
+
+
+def _build_iom_consumption(conn, cursor):
+    """Backfill iom_month_consumption from existing monthly_allocation_entries."""
+    from projects.capacity import rebuild_iom_consumption
+    print(f"  IOM consumption rows built: {rebuild_iom_consumption(cursor)}")
+
+
+def _backfill_legacy_allocations(conn, cursor):
+    """
+    Copy legacy allocations/allocation_items rows into monthly_allocation_entries
+    (iom_id NULL, coe/domain carried over, legacy_item_id = allocation_items.id).
+    Items whose user already has canonical rows for that project and month are
+    skipped so hours are not counted twice; uq_mae_legacy_item makes reruns no-ops.
+    The capacity ledger is rebuilt afterwards to include the copied hours.
+    """
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ('allocations', 'allocation_items')
+    """)
+    if (cursor.fetchone() or [0])[0] < 2:
+        return
+    cursor.execute("""
+        INSERT IGNORE INTO `monthly_allocation_entries`
+            (project_id, iom_id, month_start, user_ldap, total_hours, coe_id, domain_id, legacy_item_id)
+        SELECT ai.project_id, NULL, a.month_start, TRIM(ai.user_ldap), ai.total_hours,
+               ai.coe_id, ai.domain_id, ai.id
+        FROM `allocation_items` ai
+        JOIN `allocations` a ON a.id = ai.allocation_id
+        WHERE TRIM(ai.user_ldap) <> ''
+          AND NOT EXISTS (
+              SELECT 1 FROM `monthly_allocation_entries` m
+              WHERE m.project_id = ai.project_id AND m.month_start = a.month_start
+                AND m.user_key = LOWER(TRIM(ai.user_ldap))
+          )
+    """)
+    print(f"  legacy allocation items copied: {cursor.rowcount}")
+    if cursor.rowcount:
+        from projects.capacity import rebuild_capacity_ledger
+        rebuild_capacity_ledger(cursor)
+
+
+def _build_punch_week_totals(conn, cursor):
+    """Backfill user_punch_week_totals from existing user_punches."""
+    from projects.punch_totals import rebuild_punch_week_totals
+    print(f"  punch week total rows built: {rebuild_punch_week_totals(cursor)}")
+
+# ---------- Migrations (append only; never renumber) ----------
+MIGRATIONS: List[Migration] = [
+    Migration(1, "create user_punches", [
+        create_table("user_punches", """
+            CREATE TABLE IF NOT EXISTS `user_punches` (
+              `id` BIGINT NOT NULL AUTO_INCREMENT,
+              `user_ldap` VARCHAR(255) NOT NULL,
+              `allocation_id` BIGINT NOT NULL,
+              `punch_date` DATE NOT NULL,
+              `week_number` TINYINT NULL,
+              `actual_hours` DECIMAL(6,2) NOT NULL DEFAULT 0.00,
+              `wbs` VARCHAR(255) NULL,
+              `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+              `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+              PRIMARY KEY (`id`),
+              UNIQUE KEY `uq_punch_user_alloc_date` (`user_ldap`, `allocation_id`, `punch_date`),
+              KEY `idx_punch_alloc_date` (`allocation_id`, `punch_date`),
+              CONSTRAINT `fk_punch_allocation`
+                FOREIGN KEY (`allocation_id`) REFERENCES `monthly_allocation_entries` (`id`)
+                ON DELETE CASCADE
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+        """),
+        run_python(_ensure_punch_unique_key),
+    ]),
+    Migration(2, "performance index pack", [
+        # my_allocations / dashboard compute_user_stats, compute_manager_totals, list_user_allocations
+        add_index("monthly_allocation_entries", "idx_mae_user_month", ["user_ldap", "month_start"]),
+        # my_allocations daily map, punch exports (user + billing window range)
+        add_index("user_punches", "idx_punch_user_date", ["user_ldap", "punch_date"]),
+        # get_applicable_ioms, _get_user_projects_for_allocations, dashboard pdl_* (creator + year)
+        add_index("prism_wbs", "idx_prism_wbs_creator_year", ["creator", "year"]),
+        # project_list / edit_project joins on project_id (the importer's copy of prism_wbs has no FK index)
+        add_index("prism_wbs", "idx_prism_wbs_project", ["project_id"]),
+        # _get_local_ldap_entry, _ensure_user_from_ldap, directory search
+        add_index("ldap_directory", "idx_ldap_email", ["email"]),
+        add_index("ldap_directory", "idx_ldap_cn", ["cn"]),
+        # dashboard get_reportees_for_manager
+        add_index("ldap_directory", "idx_ldap_manager_dn", ["manager_dn"]),
+    ]),
+    Migration(3, "harmonize charset/collation across tables", [
+        run_python(_harmonize_collations),
+        # team_allocations joins users ON u.email = mae.user_ldap
+        add_index("users", "idx_users_email", ["email"]),
+    ]),
+    Migration(4, "monthly_allocation_entries natural key for diff-based saves", [
+        # normalised user key: user_ldap is free text from the allocation grid
+        add_column("monthly_allocation_entries", "user_key",
+                   "VARCHAR(255) GENERATED ALWAYS AS (LOWER(TRIM(`user_ldap`))) STORED"),
+        add_column("monthly_allocation_entries", "updated_at",
+                   "TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+        run_python(_dedupe_allocation_entries),
+        # save_monthly_allocations upserts on this key instead of delete-and-reinsert
+        add_index("monthly_allocation_entries", "uq_mae_proj_iom_month_user",
+                  ["project_id", "iom_id", "month_start", "user_key"], unique=True),
+    ]),
+    Migration(5, "cross-project capacity ledger", [
+        create_table("user_capacity_ledger", """
+            CREATE TABLE IF NOT EXISTS `user_capacity_ledger` (
+              `user_key` VARCHAR(255) NOT NULL,
+              `period_start` DATE NOT NULL,
+              `period_end` DATE NOT NULL,
+              `allocated_hours` DECIMAL(10,2) NOT NULL DEFAULT 0.00,
+              `max_hours` DECIMAL(7,2) NOT NULL DEFAULT 183.75,
+              `holiday_hours` DECIMAL(7,2) NOT NULL DEFAULT 0.00,
+              `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+              PRIMARY KEY (`user_key`, `period_start`),
+              KEY `idx_capacity_period` (`period_start`, `period_end`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+        """),
+        run_python(_build_capacity_ledger),
+    ]),
+    Migration(6, "project/IOM ownership index", [
+        create_table("project_ownership", """
+            CREATE TABLE IF NOT EXISTS `project_ownership` (
+              `id` BIGINT NOT NULL AUTO_INCREMENT,
+              `user_key` VARCHAR(255) NOT NULL,
+              `project_id` BIGINT NOT NULL DEFAULT 0,
+              `iom_id` VARCHAR(255) NOT NULL DEFAULT '',
+              `role` VARCHAR(16) NOT NULL,
+              `creator` VARCHAR(255) NULL,
+              `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+              PRIMARY KEY (`id`),
+              UNIQUE KEY `uq_ownership` (`user_key`, `role`, `project_id`, `iom_id`),
+              KEY `idx_ownership_project` (`project_id`),
+              KEY `idx_ownership_iom` (`iom_id`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+        """),
+        run_python(_build_project_ownership),
+    ]),
+    Migration(7, "long-format prism_wbs monthly hours/FTE", [
+        create_table("prism_wbs_monthly", """
+            CREATE TABLE IF NOT EXISTS `prism_wbs_monthly` (
+              `iom_id` VARCHAR(255) NOT NULL,
+              `year` SMALLINT UNSIGNED NOT NULL,
+              `month` TINYINT UNSIGNED NOT NULL,
+              `hours` DECIMAL(10,2) NOT NULL DEFAULT 0.00,
+              `fte` DECIMAL(8,4) NOT NULL DEFAULT 0.0000,
+              `planned` TINYINT(1) AS (`hours` > 0 OR `fte` > 0) STORED,
+              PRIMARY KEY (`iom_id`, `year`, `month`),
+              KEY `idx_wbs_monthly_period` (`year`, `month`, `planned`, `iom_id`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+        """),
+        run_python(_build_wbs_monthly),
+    ]),
+    Migration(8, "IOM consumption aggregate", [
+        create_table("iom_month_consumption", """
+            CREATE TABLE IF NOT EXISTS `iom_month_consumption` (
+              `iom_id` VARCHAR(255) NOT NULL,
+              `month_start` DATE NOT NULL,
+              `allocated_hours` DECIMAL(12,2) NOT NULL DEFAULT 0.00,
+              `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+              PRIMARY KEY (`iom_id`, `month_start`),
+              KEY `idx_iom_consumption_month` (`month_start`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+        """),
+        run_python(_build_iom_consumption),
+    ]),
+    Migration(9, "monthly_allocations reads only monthly_allocation_entries", [
+        add_column("monthly_allocation_entries", "coe_id", "BIGINT NULL"),
+        add_column("monthly_allocation_entries", "domain_id", "BIGINT NULL"),
+        add_column("monthly_allocation_entries", "legacy_item_id", "BIGINT NULL"),
+        add_index("monthly_allocation_entries", "uq_mae_legacy_item", ["legacy_item_id"], unique=True),
+        # monthly_allocations page read (present on fresh installs; created on older ones)
+        add_index("monthly_allocation_entries", "idx_proj_month", ["project_id", "month_start"]),
+        run_python(_backfill_legacy_allocations),
+    ]),
+    Migration(10, "background export jobs", [
+        create_table("export_jobs", """
+            CREATE TABLE IF NOT EXISTS `export_jobs` (
+              `id` BIGINT NOT NULL AUTO_INCREMENT,
+              `job_key` CHAR(64) NOT NULL,
+              `export_type` VARCHAR(32) NOT NULL,
+              `requested_by` VARCHAR(255) NOT NULL,
+              `params` TEXT NULL,
+              `status` VARCHAR(16) NOT NULL DEFAULT 'PENDING',
+              `filename` VARCHAR(255) NULL,
+              `content_type` VARCHAR(128) NULL,
+              `artifact_path` VARCHAR(1024) NULL,
+              `size_bytes` BIGINT NULL,
+              `error` TEXT NULL,
+              `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+              `started_at` DATETIME NULL,
+              `finished_at` DATETIME NULL,
+              `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+              PRIMARY KEY (`id`),
+              KEY `idx_export_jobs_key` (`job_key`, `status`),
+              KEY `idx_export_jobs_user` (`requested_by`, `id`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+        """),
+    ]),
+    Migration(11, "bulk export: prism_wbs.updated_at and updated_at indexes", [
+        add_column("prism_wbs", "updated_at",
+                   "TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+        # updated_since filters of the bulk export API
+        add_index("prism_wbs", "idx_prism_wbs_updated", ["updated_at"]),
+        add_index("monthly_allocation_entries", "idx_mae_updated", ["updated_at"]),
+        add_index("weekly_allocations", "idx_weekly_updated", ["updated_at"]),
+        add_index("user_punches", "idx_punch_updated", ["updated_at"]),
+        # date-range filter on the punches dataset
+        add_index("user_punches", "idx_punch_date", ["punch_date"]),
+    ]),
+    Migration(12, "user_punches.user_key for single-query identity lookups", [
+        add_column("user_punches", "user_key",
+                   "VARCHAR(255) GENERATED ALWAYS AS (LOWER(TRIM(`user_ldap`))) STORED"),
+        add_index("user_punches", "idx_punch_userkey_date", ["user_key", "punch_date"]),
+    ]),
+    Migration(13, "weekly punch totals", [
+        create_table("user_punch_week_totals", """
+            CREATE TABLE IF NOT EXISTS `user_punch_week_totals` (
+              `allocation_id` BIGINT NOT NULL,
+              `week_number` TINYINT NOT NULL,
+              `punched_hours` DECIMAL(10,2) NOT NULL DEFAULT 0.00,
+              `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+              PRIMARY KEY (`allocation_id`, `week_number`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+        """),
+        run_python(_build_punch_week_totals),
+    ]),
+    Migration(14, "shared reference-data version counter", [
+        # projects/refdata.py: bumped on every coes/domains/projects/project_coes write,
+        # read by every worker process to invalidate its snapshot
+        create_table("refdata_version", """
+            CREATE TABLE IF NOT EXISTS `refdata_version` (
+              `id` TINYINT NOT NULL,
+              `version` BIGINT NOT NULL DEFAULT 0,
+              `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+              PRIMARY KEY (`id`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+        """),
+        run_sql("INSERT IGNORE INTO `refdata_version` (id, version) VALUES (1, 0)"),
+    ]),
+]
+
+
+# ---------- Runner ----------
+class MigrationRunner:
+    """Applies pending MIGRATIONS on an open mysql.connector connection."""
+
+    def __init__(self, conn, migrations: List[Migration] = None):
+        self.conn = conn
+        self.migrations = sorted(migrations or MIGRATIONS, key=lambda m: m.version)
+
+    # --- information_schema helpers ---
+    def _scalar(self, cursor, sql, params=()):
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def table_exists(self, cursor, table: str) -> bool:
+        return bool(self._scalar(cursor, """
+            SELECT COUNT(*) FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        """, (table,)))
+
+    def column_exists(self, cursor, table: str, column: str) -> bool:
+        return bool(self._scalar(cursor, """
+            SELECT COUNT(*) FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        """, (table, column)))
+
+    def index_exists(self, cursor, table: str, name: str) -> bool:
+        return bool(self._scalar(cursor, """
+            SELECT COUNT(*) FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        """, (table, name)))
+
+    # --- DDL ---
+    def _alter_online(self, cursor, base_sql: str, algorithms: Sequence[str]):
+        """Try `base_sql` with each online algorithm in turn, then without any clause."""
+        for clause in algorithms:
+            try:
+                cursor.execute(f"{base_sql}, {clause}")
+                return
+            except mysql.connector.Error as e:
+                if e.errno not in ONLINE_DDL_UNSUPPORTED:
+                    raise
+                print(f"  online DDL ({clause}) not supported here, retrying")
+        cursor.execute(base_sql)
+
+    def _apply_op(self, cursor, op: Op):
+        if op.kind == "create_table":
+            table, ddl = op.args
+            if self.table_exists(cursor, table):
+                print(f"  table {table} exists, skipping")
+                return
+            print(f"  creating table {table}")
+            cursor.execute(ddl)
+        elif op.kind == "add_column":
+            table, column, definition = op.args
+            if not self.table_exists(cursor, table):
+                print(f"  table {table} missing, skipping column {column}")
+                return
+            if self.column_exists(cursor, table, column):
+                print(f"  column {table}.{column} exists, skipping")
+                return
+            print(f"  adding column {table}.{column}")
+            self._alter_online(cursor, f"ALTER TABLE `{table}` ADD COLUMN `{column}` {definition}",
+                               ["ALGORITHM=INSTANT", "ALGORITHM=INPLACE, LOCK=NONE"])
+        elif op.kind == "add_index":
+            table, name, columns, unique = op.args
+            if not self.table_exists(cursor, table):
+                print(f"  table {table} missing, skipping index {name}")
+                return
+            if self.index_exists(cursor, table, name):
+                print(f"  index {table}.{name} exists, skipping")
+                return
+            cols = ", ".join(f"`{c}`" for c in columns)
+            kind = "UNIQUE INDEX" if unique else "INDEX"
+            print(f"  adding {kind.lower()} {table}.{name} ({', '.join(columns)})")
+            self._alter_online(cursor, f"ALTER TABLE `{table}` ADD {kind} `{name}` ({cols})",
+                               ["ALGORITHM=INPLACE, LOCK=NONE"])
+        elif op.kind == "drop_index":
+            table, name = op.args
+            if not self.table_exists(cursor, table) or not self.index_exists(cursor, table, name):
+                print(f"  index {table}.{name} absent, skipping")
+                return
+            print(f"  dropping index {table}.{name}")
+            self._alter_online(cursor, f"ALTER TABLE `{table}` DROP INDEX `{name}`",
+                               ["ALGORITHM=INPLACE, LOCK=NONE"])
+        elif op.kind == "sql":
+            sql, params = op.args
+            print(f"  executing: {sql.strip().splitlines()[0][:120]} ...")
+            cursor.execute(sql, params)
+        elif op.kind == "python":
+            (func,) = op.args
+            print(f"  running {func.__name__}")
+            func(self.conn, cursor)
+        else:
+            raise ValueError(f"Unknown migration operation: {op.kind}")
+
+    # --- bookkeeping ---
+    def ensure_version_table(self, cursor):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS `{SCHEMA_VERSION_TABLE}` (
+              `version` INT NOT NULL PRIMARY KEY,
+              `description` VARCHAR(255) NOT NULL,
+              `applied_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+              `duration_ms` INT NULL
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+        """)
+
+    def current_version(self, cursor) -> int:
+        return int(self._scalar(cursor, f"SELECT COALESCE(MAX(version), 0) FROM `{SCHEMA_VERSION_TABLE}`") or 0)
+
+    def pending(self, cursor) -> List[Migration]:
+        current = self.current_version(cursor)
+        return [m for m in self.migrations if m.version > current]
+
+    def migrate(self) -> int:
+        """Apply all pending migrations; returns how many were applied."""
+        cursor = self.conn.cursor(buffered=True)
+        applied = 0
+        try:
+            got = self._scalar(cursor, "SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK_NAME, MIGRATION_LOCK_TIMEOUT))
+            if got != 1:
+                print("FEAS: another process is applying migrations; skipping.")
+                return 0
+            try:
+                self.ensure_version_table(cursor)
+                for m in self.pending(cursor):
+                    print(f"FEAS: applying migration {m.version}: {m.description}")
+                    t0 = time.monotonic()
+                    for op in m.operations:
+                        self._apply_op(cursor, op)
+                    self.conn.commit()
+                    cursor.execute(
+                        f"INSERT INTO `{SCHEMA_VERSION_TABLE}` (version, description, duration_ms) VALUES (%s, %s, %s)",
+                        (m.version, m.description, int((time.monotonic() - t0) * 1000)),
+                    )
+                    self.conn.commit()
+                    applied += 1
+                print(f"FEAS: schema at version {self.current_version(cursor)}.")
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK_NAME,))
+                cursor.fetchall()
+            return applied
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+
+def apply_migrations(db_config=None) -> bool:
+    """Connect with the initializer's settings and apply pending migrations."""
+    from feas_project.db_initializer import DatabaseInitializer
+
+    initializer = DatabaseInitializer(db_config=db_config) if db_config else DatabaseInitializer()
+    conn = None
+    try:
+        conn = initializer.connect()
+        MigrationRunner(conn).migrate()
+        return True
+    except Exception:
+        print("FEAS: applying migrations failed.")
+        traceback.print_exc()
+        return False
+    finally:
+        if conn:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+if __name__ == "__main__":
+    if "DJANGO_SETTINGS_MODULE" not in os.environ:
+        print("Please set DJANGO_SETTINGS_MODULE to your settings module, e.g:")
+        print("  export DJANGO_SETTINGS_MODULE=feas_project.settings")
+        sys.exit(2)
+    sys.exit(0 if apply_migrations() else 1)
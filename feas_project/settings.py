@@ -98,14 +98,69 @@ DATABASES = {
         "PASSWORD": os.getenv("MYSQL_PASSWORD", "root"),
         "HOST": os.getenv("MYSQL_HOST", "127.0.0.1"),
         "PORT": os.getenv("MYSQL_PORT", "3306"),
-        "OPTIONS": {"init_command": "SET sql_mode='STRICT_TRANS_TABLES'"},
+        "OPTIONS": {
+            "init_command": "SET sql_mode='STRICT_TRANS_TABLES'",
+        },
     }
 }
 
+# Collation every table/string column is normalised to by the schema migrations
+DB_TARGET_COLLATION = os.getenv("DB_TARGET_COLLATION", "utf8mb4_0900_ai_ci")
+
 # Optional: overrideable name for the init table used by initializer
 DB_INIT_DONE_TABLE = os.getenv("DB_INIT_DONE_TABLE", "system_settings")
 # (You can also set it directly: DB_INIT_DONE_TABLE = "system_settings")
 
+# Master import bulk-load engine: "insert" (default) uses batched INSERTs; "auto" tries
+# LOAD DATA LOCAL INFILE on a dedicated connection (client side limited to the temp
+# directory; the server must also allow local_infile=ON) and falls back to batched INSERTs.
+MASTER_IMPORT_LOAD_ENGINE = os.getenv("MASTER_IMPORT_LOAD_ENGINE", "insert")
+# Worker threads (each with its own DB connection) for the prism_wbs upsert phase
+MASTER_IMPORT_WBS_WORKERS = int(os.getenv("MASTER_IMPORT_WBS_WORKERS", "4"))
+
+# Max age (seconds) of the in-process COE/domain/project reference-data snapshot.
+# Writes bump the refdata_version row, which every process checks before reusing
+# its snapshot; the TTL only bounds staleness if that table is unavailable.
+REFDATA_CACHE_TTL = int(os.getenv("REFDATA_CACHE_TTL", "300"))
+
+# Background exports (projects/exports.py): artifact store, worker threads per process,
+# and how long finished files are kept before they are rebuilt on demand.
+EXPORT_ARTIFACT_DIR = os.getenv("EXPORT_ARTIFACT_DIR", os.path.join(BASE_DIR, "export_artifacts"))
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_ARTIFACT_MAX_AGE_DAYS = float(os.getenv("EXPORT_ARTIFACT_MAX_AGE_DAYS", "7"))
+# PENDING/RUNNING export jobs older than this are treated as lost (FAILED) and rebuilt
+EXPORT_JOB_STALE_SECONDS = int(os.getenv("EXPORT_JOB_STALE_SECONDS", "1800"))
+# seconds an export request waits for another request creating the same job
+EXPORT_JOB_LOCK_TIMEOUT = int(os.getenv("EXPORT_JOB_LOCK_TIMEOUT", "10"))
+
+# PDF rendering process pool (projects/pdf_render.py)
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2"))
+PDF_RENDER_START_METHOD = os.getenv("PDF_RENDER_START_METHOD", "spawn")
+PDF_RENDER_PREWARM = os.getenv("PDF_RENDER_PREWARM", "1") == "1"
+PDF_RENDER_MAX_INFLIGHT = int(os.getenv("PDF_RENDER_MAX_INFLIGHT", "8"))   # queued + running renders
+PDF_RENDER_QUEUE_TIMEOUT = float(os.getenv("PDF_RENDER_QUEUE_TIMEOUT", "30"))
+PDF_RENDER_TIMEOUT = float(os.getenv("PDF_RENDER_TIMEOUT", "60"))
+PDF_RENDER_MAX_ROWS = int(os.getenv("PDF_RENDER_MAX_ROWS", "20000"))
+PDF_RENDER_MAX_BYTES = int(os.getenv("PDF_RENDER_MAX_BYTES", str(20 * 1024 * 1024)))
+
+# Bulk CSV/JSON-lines export API (projects/bulk_export.py): bearer token for
+# non-session clients (disabled when empty) and rows per keyset page.
+BULK_EXPORT_TOKEN = os.getenv("BULK_EXPORT_TOKEN", "")
+BULK_EXPORT_PAGE_SIZE = int(os.getenv("BULK_EXPORT_PAGE_SIZE", "5000"))
+# session roles allowed to call the bulk export API without the token
+BULK_EXPORT_SESSION_ROLES = [r.strip().upper() for r in os.getenv("BULK_EXPORT_SESSION_ROLES", "ADMIN,PDL").split(",")
+                             if r.strip()]
+
+# Team allocation view: JSON page size and how long a user's LDAP reportee list
+# is kept in the session (seconds).
+TEAM_API_PAGE_SIZE = int(os.getenv("TEAM_API_PAGE_SIZE", "50"))
+TEAM_REPORTEES_CACHE_TTL = int(os.getenv("TEAM_REPORTEES_CACHE_TTL", "900"))
+
+# users provisioning: ldap_directory rows per upsert during the LDAP sync, and how
+# long _ensure_user_from_ldap caches identifier -> users.id (seconds).
+USERS_PROVISION_CHUNK = int(os.getenv("USERS_PROVISION_CHUNK", "500"))
+USER_ID_CACHE_TTL = int(os.getenv("USER_ID_CACHE_TTL", "3600"))
+
 # sample additions in feas_project/settings.py
 
 # LDAP server settings (used by check_credentials)
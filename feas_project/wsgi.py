@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'feas_project.settings')
 
 application = get_wsgi_application()
+
+# start the PDF render workers before the first export needs them
+from django.conf import settings  # noqa: E402
+
+if getattr(settings, "PDF_RENDER_PREWARM", False):
+    from projects.pdf_render import warm_pool  # noqa: E402
+    warm_pool()
@@ -0,0 +1,142 @@
+"""
+projects/bulk_export.py
+
+Bulk row export for BI consumers (see views.bulk_export).
+
+Each dataset is one base table read in primary-key order with keyset
+pagination (`WHERE t.id > last_id ORDER BY t.id LIMIT page`), so every page is
+an index range read and the response never holds more than one page. Filters:
+
+    start / end      inclusive date range on the dataset's date column (end is
+                     applied as `< end + 1 day`, so DATETIME columns keep the whole end day)
+    project_id       monthly_allocation_entries.project_id (joined where needed)
+    updated_since    updated_at >= value
+    after_id         resume after a previously received id
+
+Rows are encoded as CSV (header first) or JSON lines and optionally gzip-compressed
+incrementally, so memory use does not depend on the number of rows.
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.db import connection
+
+DEFAULT_PAGE_SIZE = 5000
+
+# name -> (FROM clause, columns, date column, project column)
+DATASETS = {
+    "allocations": (
+        "monthly_allocation_entries t",
+        ["t.id", "t.project_id", "t.iom_id", "t.month_start", "t.user_ldap", "t.coe_id", "t.domain_id",
+         "t.total_hours", "t.created_at", "t.updated_at"],
+        "t.month_start",
+        "t.project_id",
+    ),
+    "weekly_allocations": (
+        "weekly_allocations t LEFT JOIN monthly_allocation_entries mae ON mae.id = t.allocation_id",
+        ["t.id", "t.allocation_id", "mae.project_id", "mae.iom_id", "mae.month_start", "mae.user_ldap",
+         "t.week_number", "t.hours", "t.percent", "t.status", "t.created_at", "t.updated_at"],
+        "mae.month_start",
+        "mae.project_id",
+    ),
+    "punches": (
+        "user_punches t LEFT JOIN monthly_allocation_entries mae ON mae.id = t.allocation_id",
+        ["t.id", "t.user_ldap", "t.allocation_id", "mae.project_id", "mae.iom_id", "t.punch_date",
+         "t.week_number", "t.actual_hours", "t.wbs", "t.created_at", "t.updated_at"],
+        "t.punch_date",
+        "mae.project_id",
+    ),
+    "wbs": (
+        "prism_wbs t",
+        ["t.id", "t.iom_id", "t.status", "t.project_id", "t.bg_code", "t.year", "t.creator", "t.date_created",
+         "t.buyer_wbs_cc", "t.seller_wbs_cc", "t.site", "t.`function`", "t.department",
+         "t.total_hours", "t.total_fte", "t.created_at", "t.updated_at"],
+        "t.date_created",
+        "t.project_id",
+    ),
+}
+
+
+def column_names(dataset):
+    return [c.split(".", 1)[1].strip("`") for c in DATASETS[dataset][1]]
+
+
+def iter_rows(dataset, start=None, end=None, project_id=None, updated_since=None, after_id=0,
+              page_size=DEFAULT_PAGE_SIZE):
+    """Yield tuples in id order, one keyset page per query."""
+    from_sql, columns, date_col, project_col = DATASETS[dataset]
+    where, params = ["t.id > %s"], []
+    if start:
+        where.append(f"{date_col} >= %s")
+        params.append(start)
+    if end:
+        where.append(f"{date_col} < %s")
+        params.append(end + timedelta(days=1))
+    if project_id:
+        where.append(f"{project_col} = %s")
+        params.append(project_id)
+    if updated_since:
+        where.append("t.updated_at >= %s")
+        params.append(updated_since)
+    sql = f"SELECT {', '.join(columns)} FROM {from_sql} WHERE {' AND '.join(where)} ORDER BY t.id LIMIT %s"
+
+    last_id = int(after_id or 0)
+    while True:
+        with connection.cursor() as cur:
+            cur.execute(sql, [last_id] + params + [page_size])
+            page = cur.fetchall()
+        for row in page:
+            yield row
+        if len(page) < page_size:
+            return
+        last_id = page[-1][0]
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_csv(columns, rows, batch=500):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    n = 0
+    for row in rows:
+        writer.writerow([_plain(v) for v in row])
+        n += 1
+        if n % batch == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def encode_jsonl(columns, rows, batch=500):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({c: _plain(v) for c, v in zip(columns, row)}, default=str))
+        if len(lines) >= batch:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def gzip_stream(chunks, level=6):
+    """Compress an iterable of byte chunks into a gzip stream as it is consumed."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
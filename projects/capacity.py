@@ -0,0 +1,295 @@
+"""
+projects/capacity.py
+
+Allocation aggregates maintained alongside monthly_allocation_entries:
+the cross-project capacity ledger (per user) and IOM consumption (per IOM).
+
+`user_capacity_ledger` holds one row per (user_key, period_start) where
+period_start is the canonical billing start used as monthly_allocation_entries.month_start:
+
+    allocated_hours  SUM(total_hours) over every project/IOM for that user and period
+    max_hours        monthly_hours_limit.max_hours for the period (HOURS_AVAILABLE_PER_MONTH fallback)
+    holiday_hours    weekday holidays inside the period * HOURS_PER_HOLIDAY
+
+available = max_hours - holiday_hours, remaining = available - allocated_hours.
+
+The ledger is maintained incrementally: every allocation write passes per-user
+hour deltas to `apply_allocation_deltas` inside its own transaction. Limits are
+refreshed when holidays or monthly hours change. `rebuild_capacity_ledger`
+recomputes everything from monthly_allocation_entries (migration backfill and
+`manage.py rebuild_capacity_ledger`).
+
+`iom_month_consumption` holds SUM(total_hours) per (iom_id, month_start) over all
+projects, maintained from the same allocation diff by `apply_iom_deltas`, so IOM
+listings can show planned vs allocated vs remaining hours with one join.
+
+All helpers take an open cursor (Django or mysql.connector; both use %s params)
+so they join the caller's transaction.
+"""
+
+import logging
+from datetime import date, timedelta
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+LEDGER_TABLE = "user_capacity_ledger"
+CONSUMPTION_TABLE = "iom_month_consumption"
+DEFAULT_HOURS_PER_MONTH = 183.75
+DEFAULT_HOURS_PER_HOLIDAY = 8.75
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return float(getattr(settings, name, default))
+    except Exception:
+        return float(default)
+
+
+def hours_per_month():
+    return _setting("HOURS_AVAILABLE_PER_MONTH", DEFAULT_HOURS_PER_MONTH)
+
+
+def hours_per_holiday():
+    return _setting("HOURS_PER_HOLIDAY", DEFAULT_HOURS_PER_HOLIDAY)
+
+
+def user_key(user_ldap):
+    """Same normalisation as the generated monthly_allocation_entries.user_key column."""
+    return (user_ldap or "").strip().lower()
+
+
+# Matches a ledger row (alias l) to its monthly_hours_limit row: an explicit
+# billing start first, else the calendar month when no start_date is configured.
+_LIMIT_JOIN = """
+    LEFT JOIN monthly_hours_limit m
+      ON (m.start_date = l.period_start)
+      OR (m.start_date IS NULL AND m.year = YEAR(l.period_start) AND m.month = MONTH(l.period_start))
+"""
+
+
+def billing_start_for(cur, year, month):
+    """Canonical billing start for (year, month): monthly_hours_limit.start_date or the 1st."""
+    cur.execute("SELECT start_date FROM monthly_hours_limit WHERE year = %s AND month = %s LIMIT 1",
+                [int(year), int(month)])
+    row = cur.fetchone()
+    return row[0] if row and row[0] else date(int(year), int(month), 1)
+
+
+def period_limits(cur, period_start):
+    """
+    (period_end, max_hours, holiday_hours) for the billing period starting at period_start.
+    Falls back to the calendar month and HOURS_AVAILABLE_PER_MONTH when
+    monthly_hours_limit has no row for it.
+    """
+    cur.execute("""
+        SELECT end_date, max_hours
+        FROM monthly_hours_limit
+        WHERE start_date = %s
+           OR (start_date IS NULL AND year = %s AND month = %s)
+        ORDER BY start_date IS NULL
+        LIMIT 1
+    """, [period_start, period_start.year, period_start.month])
+    row = cur.fetchone()
+    period_end = row[0] if row and row[0] else None
+    max_hours = float(row[1]) if row and row[1] is not None else hours_per_month()
+    if period_end is None:
+        next_first = (period_start.replace(day=28) + timedelta(days=4)).replace(day=1)
+        period_end = next_first - timedelta(days=1)
+
+    cur.execute("""
+        SELECT COUNT(*) FROM holidays
+        WHERE holiday_date BETWEEN %s AND %s AND WEEKDAY(holiday_date) < 5
+    """, [period_start, period_end])
+    holidays = int((cur.fetchone() or [0])[0] or 0)
+    return period_end, round(max_hours, 2), round(holidays * hours_per_holiday(), 2)
+
+
+def allocation_deltas(diff):
+    """
+    Per-user hour deltas ({user_key: Decimal}) from a save_monthly_allocations diff
+    (inserts add, updates and adopted legacy rows add the difference, deletes and
+    retired legacy rows subtract). Zero deltas are dropped.
+    """
+    deltas = {}
+    for _iom_id, user_ldap, hours in diff.get("inserts", []):
+        k = user_key(user_ldap)
+        deltas[k] = deltas.get(k, Decimal("0")) + Decimal(hours)
+    for _row_id, _iom_id, user_ldap, old, new in diff.get("updates", []) + diff.get("adopts", []):
+        k = user_key(user_ldap)
+        deltas[k] = deltas.get(k, Decimal("0")) + Decimal(new) - Decimal(old)
+    for _row_id, _iom_id, key, old in diff.get("deletes", []):
+        k = user_key(key)
+        deltas[k] = deltas.get(k, Decimal("0")) - Decimal(old)
+    for _row_id, _into_id, key, old in diff.get("retires", []):
+        k = user_key(key)
+        deltas[k] = deltas.get(k, Decimal("0")) - Decimal(old)
+    return {k: v for k, v in deltas.items() if k and v}
+
+
+def apply_allocation_deltas(cur, period_start, deltas):
+    """
+    Add per-user hour deltas to the ledger for one period with a single
+    multi-row upsert. Run it in the same transaction as the allocation write.
+    """
+    if not deltas:
+        return 0
+    period_end, max_hours, holiday_hours = period_limits(cur, period_start)
+    params = []
+    for key, delta in deltas.items():
+        params.extend([key, period_start, period_end, delta, max_hours, holiday_hours])
+    cur.execute(
+        f"INSERT INTO {LEDGER_TABLE} (user_key, period_start, period_end, allocated_hours, max_hours, holiday_hours) VALUES "
+        + ",".join(["(%s, %s, %s, %s, %s, %s)"] * len(deltas))
+        + """
+        ON DUPLICATE KEY UPDATE
+          allocated_hours = GREATEST(0, allocated_hours + VALUES(allocated_hours)),
+          period_end = VALUES(period_end),
+          max_hours = VALUES(max_hours),
+          holiday_hours = VALUES(holiday_hours)
+        """,
+        params,
+    )
+    return len(deltas)
+
+
+def refresh_capacity_limits(cur, covering_date=None):
+    """
+    Re-read max_hours / period_end / holiday_hours for ledger rows, e.g. after a
+    holiday is added or monthly hours are saved. With covering_date only the
+    periods containing that date are touched.
+    """
+    where, params = "", [hours_per_month(), hours_per_holiday()]
+    if covering_date:
+        where = "WHERE %s BETWEEN l.period_start AND l.period_end"
+        params.append(covering_date)
+    cur.execute(f"""
+        UPDATE {LEDGER_TABLE} l
+        {_LIMIT_JOIN}
+        SET l.max_hours = COALESCE(m.max_hours, %s),
+            l.period_end = COALESCE(m.end_date, l.period_end),
+            l.holiday_hours = %s * (
+                SELECT COUNT(*) FROM holidays h
+                WHERE h.holiday_date BETWEEN l.period_start AND COALESCE(m.end_date, l.period_end)
+                  AND WEEKDAY(h.holiday_date) < 5)
+        {where}
+    """, params)
+    return cur.rowcount
+
+
+def rebuild_capacity_ledger(cur, period_start=None):
+    """
+    Recompute allocated_hours from monthly_allocation_entries (optionally for one
+    period), drop rows with no allocations left, then refresh limits.
+    period_end starts as the calendar month end and is corrected by the refresh.
+    """
+    where, params = "", []
+    if period_start:
+        where, params = "WHERE mae.month_start = %s", [period_start]
+    cur.execute(f"DELETE FROM {LEDGER_TABLE}" + (" WHERE period_start = %s" if period_start else ""), params)
+    cur.execute(f"""
+        INSERT INTO {LEDGER_TABLE} (user_key, period_start, period_end, allocated_hours, max_hours, holiday_hours)
+        SELECT mae.user_key, mae.month_start, LAST_DAY(mae.month_start), SUM(mae.total_hours), %s, 0
+        FROM monthly_allocation_entries mae
+        {where}
+        GROUP BY mae.user_key, mae.month_start
+    """, [hours_per_month()] + params)
+    rebuilt = cur.rowcount
+    refresh_capacity_limits(cur)
+    return rebuilt
+
+
+def get_capacity(cur, user_ldaps, period_start):
+    """
+    Bulk capacity for many users in one period (one indexed query on the ledger
+    primary key). Returns {user_key: {"allocated", "max_hours", "holiday_hours",
+    "available", "remaining"}}; users with no allocations get the period's full capacity.
+    """
+    keys = sorted({user_key(u) for u in user_ldaps if user_key(u)})
+    result = {}
+    if not keys:
+        return result
+    placeholders = ",".join(["%s"] * len(keys))
+    cur.execute(f"""
+        SELECT user_key, allocated_hours, max_hours, holiday_hours
+        FROM {LEDGER_TABLE}
+        WHERE period_start = %s AND user_key IN ({placeholders})
+    """, [period_start] + keys)
+    for key, allocated, max_hours, holiday_hours in cur.fetchall():
+        result[key] = _capacity_entry(allocated, max_hours, holiday_hours)
+
+    missing = [k for k in keys if k not in result]
+    if missing:
+        _end, max_hours, holiday_hours = period_limits(cur, period_start)
+        for k in missing:
+            result[k] = _capacity_entry(0, max_hours, holiday_hours)
+    return result
+
+
+def _capacity_entry(allocated, max_hours, holiday_hours):
+    allocated = round(float(allocated or 0), 2)
+    available = round(max(0.0, float(max_hours or 0) - float(holiday_hours or 0)), 2)
+    return {
+        "allocated": allocated,
+        "max_hours": round(float(max_hours or 0), 2),
+        "holiday_hours": round(float(holiday_hours or 0), 2),
+        "available": available,
+        "remaining": round(max(0.0, available - allocated), 2),
+    }
+
+
+def period_available_hours(cur, period_start):
+    """max_hours - holiday_hours for one billing period."""
+    _end, max_hours, holiday_hours = period_limits(cur, period_start)
+    return round(max(0.0, max_hours - holiday_hours), 2)
+
+
+
+# ---------- IOM consumption ----------
+def iom_allocation_deltas(diff):
+    """Per-IOM hour deltas ({iom_id: Decimal}) from a save_monthly_allocations diff."""
+    deltas = {}
+    for iom_id, _user_ldap, hours in diff.get("inserts", []):
+        deltas[iom_id] = deltas.get(iom_id, Decimal("0")) + Decimal(hours)
+    for _row_id, iom_id, _user_ldap, old, new in diff.get("updates", []):
+        deltas[iom_id] = deltas.get(iom_id, Decimal("0")) + Decimal(new) - Decimal(old)
+    for _row_id, iom_id, _key, old in diff.get("deletes", []):
+        deltas[iom_id] = deltas.get(iom_id, Decimal("0")) - Decimal(old)
+    # adopted legacy rows had no IOM: their new hours are all new to the IOM
+    for _row_id, iom_id, _user_ldap, _old, new in diff.get("adopts", []):
+        deltas[iom_id] = deltas.get(iom_id, Decimal("0")) + Decimal(new)
+    return {k: v for k, v in deltas.items() if k and v}
+
+
+def apply_iom_deltas(cur, month_start, deltas):
+    """Add per-IOM hour deltas for one billing month with a single multi-row upsert."""
+    if not deltas:
+        return 0
+    params = []
+    for iom_id, delta in deltas.items():
+        params.extend([iom_id, month_start, delta])
+    cur.execute(
+        f"INSERT INTO {CONSUMPTION_TABLE} (iom_id, month_start, allocated_hours) VALUES "
+        + ",".join(["(%s, %s, %s)"] * len(deltas))
+        + " ON DUPLICATE KEY UPDATE allocated_hours = GREATEST(0, allocated_hours + VALUES(allocated_hours))",
+        params,
+    )
+    return len(deltas)
+
+
+def rebuild_iom_consumption(cur, month_start=None):
+    """Recompute iom_month_consumption from monthly_allocation_entries (optionally one month)."""
+    where, params = "WHERE mae.iom_id IS NOT NULL", []
+    if month_start:
+        where += " AND mae.month_start = %s"
+        params = [month_start]
+    cur.execute(f"DELETE FROM {CONSUMPTION_TABLE}" + (" WHERE month_start = %s" if month_start else ""), params)
+    cur.execute(f"""
+        INSERT INTO {CONSUMPTION_TABLE} (iom_id, month_start, allocated_hours)
+        SELECT mae.iom_id, mae.month_start, SUM(mae.total_hours)
+        FROM monthly_allocation_entries mae
+        {where}
+        GROUP BY mae.iom_id, mae.month_start
+    """, params)
+    return cur.rowcount
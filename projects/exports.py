@@ -0,0 +1,277 @@
+"""
+projects/exports.py
+
+Background export jobs with a local artifact store.
+
+An export is identified by (export_type, requested_by, period, data_version):
+data_version is a hash of a cheap aggregate over the rows the export reads
+(row count, MAX(updated_at), hour totals), computed by the type's `version`
+callable. The sha256 of that tuple is the job_key and the artifact file name,
+so a repeated request for unchanged data finds the finished file and is served
+without rendering, and concurrent identical requests share one PENDING/RUNNING job
+(the check and the insert run under a GET_LOCK named after the job_key).
+
+Jobs live in `export_jobs` (same shape and lifecycle as ldap_sync_jobs:
+PENDING -> RUNNING -> COMPLETED/FAILED) and run on a small module-level thread
+pool (EXPORT_WORKERS) so month-end bursts queue instead of pinning request
+workers. Artifacts are written to EXPORT_ARTIFACT_DIR via a temp file and
+os.replace, and pruned after EXPORT_ARTIFACT_MAX_AGE_DAYS. The queue is in
+memory, so a PENDING/RUNNING job whose process died would block its job_key
+forever: jobs not started/finished within EXPORT_JOB_STALE_SECONDS are marked
+FAILED and the next request creates a fresh job.
+
+Export types are registered by the views that own the builders:
+
+    register("punches_pdf", build=..., version=..., extension="pdf", content_type=...)
+
+build(params) -> (filename, bytes); version(cur, params) -> any JSON-serialisable value.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+JOBS_TABLE = "export_jobs"
+STATUS_PENDING = "PENDING"
+STATUS_RUNNING = "RUNNING"
+STATUS_COMPLETED = "COMPLETED"
+STATUS_FAILED = "FAILED"
+
+_REGISTRY = {}
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def register(export_type, build, version, extension, content_type):
+    _REGISTRY[export_type] = {
+        "build": build,
+        "version": version,
+        "extension": extension,
+        "content_type": content_type,
+    }
+
+
+def artifact_dir():
+    path = getattr(settings, "EXPORT_ARTIFACT_DIR", None) or os.path.join(settings.BASE_DIR, "export_artifacts")
+    os.makedirs(path, exist_ok=True)
+    return str(path)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = int(getattr(settings, "EXPORT_WORKERS", 2))
+            _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="feas-export")
+        return _executor
+
+
+def job_key(export_type, requested_by, period, data_version):
+    raw = json.dumps([export_type, (requested_by or "").strip().lower(), str(period), data_version],
+                     sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _artifact_path(key, extension):
+    return os.path.join(artifact_dir(), f"{key}.{extension}")
+
+
+def _job_row(cur, where, params):
+    cur.execute(f"""
+        SELECT id, job_key, export_type, requested_by, status, filename, content_type,
+               artifact_path, size_bytes, error, created_at, started_at, finished_at
+        FROM {JOBS_TABLE}
+        WHERE {where}
+        ORDER BY id DESC
+        LIMIT 1
+    """, params)
+    row = cur.fetchone()
+    if not row:
+        return None
+    cols = [c[0] for c in cur.description]
+    return dict(zip(cols, row))
+
+
+def get_job(job_id):
+    with connection.cursor() as cur:
+        return _job_row(cur, "id = %s", [job_id])
+
+
+def _update_job(job_id, **kwargs):
+    allowed = ("status", "filename", "artifact_path", "size_bytes", "error", "started_at", "finished_at")
+    set_parts, params = [], []
+    for k, v in kwargs.items():
+        if k in allowed:
+            set_parts.append(f"`{k}` = %s")
+            params.append(v)
+    if not set_parts:
+        return
+    params.append(job_id)
+    with connection.cursor() as cur:
+        cur.execute(f"UPDATE {JOBS_TABLE} SET {', '.join(set_parts)}, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                    params)
+
+
+def _spec(export_type):
+    spec = _REGISTRY.get(export_type)
+    if spec is None:
+        raise ValueError(f"unknown export type: {export_type}")
+    return spec
+
+
+def _fail_stale_jobs(cur, key):
+    """Mark PENDING/RUNNING jobs for `key` older than EXPORT_JOB_STALE_SECONDS as FAILED."""
+    stale_seconds = int(getattr(settings, "EXPORT_JOB_STALE_SECONDS", 1800))
+    cur.execute(f"""
+        UPDATE {JOBS_TABLE}
+        SET status = %s, error = %s, finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE job_key = %s AND status IN (%s, %s)
+          AND COALESCE(started_at, created_at) < NOW() - INTERVAL %s SECOND
+    """, [STATUS_FAILED, f"stale: not finished within {stale_seconds}s (worker lost?)",
+          key, STATUS_PENDING, STATUS_RUNNING, stale_seconds])
+    if cur.rowcount:
+        logger.warning("marked %d stale export job(s) for %s FAILED", cur.rowcount, key)
+
+
+@contextmanager
+def _job_key_lock(cur, key):
+    """
+    MySQL named lock (GET_LOCK, per connection) on one job_key, held around the
+    check-then-create in enqueue so identical concurrent requests share one job.
+    """
+    name = f"feas:export:{key[:48]}"  # lock names are limited to 64 characters
+    cur.execute("SELECT GET_LOCK(%s, %s)", [name, int(getattr(settings, "EXPORT_JOB_LOCK_TIMEOUT", 10))])
+    row = cur.fetchone()
+    if not row or row[0] != 1:
+        raise RuntimeError("export job is being created by another request, try again")
+    try:
+        yield
+    finally:
+        cur.execute("SELECT RELEASE_LOCK(%s)", [name])
+        cur.fetchone()
+
+
+def _current_key(cur, export_type, requested_by, period, params):
+    data_version = _spec(export_type)["version"](cur, params)
+    return job_key(export_type, requested_by, period, data_version)
+
+
+def _usable_job(cur, key):
+    """Newest PENDING/RUNNING job for `key`, or its COMPLETED job whose artifact still exists."""
+    _fail_stale_jobs(cur, key)
+    job = _job_row(cur, "job_key = %s AND status IN (%s, %s, %s)",
+                   [key, STATUS_PENDING, STATUS_RUNNING, STATUS_COMPLETED])
+    if job and job["status"] == STATUS_COMPLETED and not os.path.exists(job["artifact_path"] or ""):
+        job = None
+    return job
+
+
+def _create_job(cur, key, export_type, requested_by, params):
+    cur.execute(f"""
+        INSERT INTO {JOBS_TABLE} (job_key, export_type, requested_by, params, status, content_type)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, [key, export_type, requested_by, json.dumps(params, default=str), STATUS_PENDING,
+          _spec(export_type)["content_type"]])
+    cur.execute("SELECT LAST_INSERT_ID()")
+    return cur.fetchone()[0]
+
+
+def enqueue(export_type, requested_by, period, params):
+    """
+    Return the job for this export, creating and scheduling one only when no
+    finished artifact or in-flight job exists for the current data version.
+    """
+    with connection.cursor() as cur:
+        key = _current_key(cur, export_type, requested_by, period, params)
+        with _job_key_lock(cur, key):
+            job = _usable_job(cur, key)
+            if job:
+                return job
+            job_id = _create_job(cur, key, export_type, requested_by, params)
+
+    # autocommit: the job row is visible to the worker's own connection
+    _get_executor().submit(_run_job, job_id, export_type, key, params)
+    return get_job(job_id)
+
+
+def _execute(job_id, export_type, key, params):
+    spec = _REGISTRY[export_type]
+    try:
+        _update_job(job_id, status=STATUS_RUNNING, started_at=datetime.now())
+        filename, content = spec["build"](params)
+        path = _artifact_path(key, spec["extension"])
+        fd, tmp = tempfile.mkstemp(dir=artifact_dir(), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(content)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        _update_job(job_id, status=STATUS_COMPLETED, filename=filename, artifact_path=path,
+                    size_bytes=len(content), finished_at=datetime.now())
+        prune_artifacts()
+    except Exception as exc:
+        logger.exception("export job %s (%s) failed", job_id, export_type)
+        try:
+            _update_job(job_id, status=STATUS_FAILED, error=f"{exc}\n{traceback.format_exc()}"[:4000],
+                        finished_at=datetime.now())
+        except Exception:
+            logger.exception("could not mark export job %s FAILED", job_id)
+
+
+def _run_job(job_id, export_type, key, params):
+    """Worker-thread entry point: runs the job on the thread's own DB connection."""
+    try:
+        _execute(job_id, export_type, key, params)
+    finally:
+        connection.close()
+
+
+def prune_artifacts(max_age_days=None):
+    """Delete artifact files older than EXPORT_ARTIFACT_MAX_AGE_DAYS; their jobs fall back to a rebuild."""
+    if max_age_days is None:
+        max_age_days = float(getattr(settings, "EXPORT_ARTIFACT_MAX_AGE_DAYS", 7))
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    root = artifact_dir()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+def job_payload(job, status_url, download_url):
+    """JSON-safe view of a job row for the status endpoint."""
+    ready = job["status"] == STATUS_COMPLETED and os.path.exists(job.get("artifact_path") or "")
+    return {
+        "id": job["id"],
+        "type": job["export_type"],
+        "status": job["status"],
+        "filename": job.get("filename"),
+        "size_bytes": job.get("size_bytes"),
+        "error": (job.get("error") or "").split("\n", 1)[0] or None,
+        "created_at": job["created_at"].isoformat() if job.get("created_at") else None,
+        "finished_at": job["finished_at"].isoformat() if job.get("finished_at") else None,
+        "status_url": status_url,
+        "download_url": download_url if ready else None,
+    }
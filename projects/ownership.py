@@ -0,0 +1,165 @@
+"""
+projects/ownership.py
+
+Normalized project/IOM ownership used for visibility checks.
+
+`project_ownership` maps a user key to what that user owns:
+
+    user_key    lower-cased, trimmed identity string (ldap username, email or CN)
+    project_id  projects.id (0 when the IOM is not linked to a project yet)
+    iom_id      prism_wbs.iom_id ('' for project-level rows)
+    role        CREATOR (prism_wbs.creator) or PDL (projects.pdl_user_id)
+    creator     the creator string exactly as stored in prism_wbs, so tables keyed by
+                creator name (prism_master_wor) can be matched by equality
+
+PRISM stores creators as "FirstName ... LASTNAME" while LDAP/session CNs are
+"LASTNAME FirstName ...". Both spellings, plus the ldap_directory username and
+email the CN resolves to, are written at build time, so at request time the
+session's ldap_username and cn are looked up with a plain indexed IN on user_key.
+
+The table is rebuilt after the master import (all rows) and whenever a project
+is created or edited (that project's rows).
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+OWNERSHIP_TABLE = "project_ownership"
+ROLE_CREATOR = "CREATOR"
+ROLE_PDL = "PDL"
+INSERT_BATCH = 500
+
+
+def owner_key(value):
+    return " ".join(str(value or "").split()).lower()
+
+
+def creator_to_cn(creator):
+    """"Sant Anurag DEO" -> "DEO Sant Anurag" (PRISM creator order to LDAP CN order)."""
+    parts = str(creator or "").split()
+    if len(parts) >= 2:
+        return " ".join(parts[-1:] + parts[:-1])
+    return " ".join(parts)
+
+
+def session_owner_keys(session):
+    """Keys for the logged-in user: ldap_username and cn as stored in the session."""
+    keys = []
+    for value in (session.get("ldap_username"), session.get("cn")):
+        k = owner_key(value)
+        if k and k not in keys:
+            keys.append(k)
+    return keys
+
+
+def owned_subquery(keys, column="project_id", roles=None):
+    """
+    ("SELECT <column> FROM project_ownership WHERE user_key IN (...) [AND role IN (...)]", params)
+    for use as `<col> IN (<subquery>)`; column is one of project_id, iom_id, creator.
+    With no keys the subquery matches nothing.
+    """
+    if column not in ("project_id", "iom_id", "creator"):
+        raise ValueError(f"unsupported ownership column: {column}")
+    if not keys:
+        return f"SELECT {column} FROM {OWNERSHIP_TABLE} WHERE 1=0", []
+    sql = f"SELECT {column} FROM {OWNERSHIP_TABLE} WHERE user_key IN ({','.join(['%s'] * len(keys))})"
+    params = list(keys)
+    if roles:
+        sql += f" AND role IN ({','.join(['%s'] * len(roles))})"
+        params.extend(roles)
+    return sql, params
+
+
+def _resolve_cns(cur, cns):
+    """{lower(cn): {username, email, ...}} from ldap_directory for the given CNs (idx_ldap_cn)."""
+    resolved = {}
+    cns = sorted({c for c in cns if c})
+    for i in range(0, len(cns), INSERT_BATCH):
+        chunk = cns[i:i + INSERT_BATCH]
+        cur.execute(
+            f"SELECT cn, username, email FROM ldap_directory WHERE cn IN ({','.join(['%s'] * len(chunk))})",
+            chunk,
+        )
+        for cn, username, email in cur.fetchall():
+            bucket = resolved.setdefault(owner_key(cn), set())
+            for v in (username, email):
+                if owner_key(v):
+                    bucket.add(owner_key(v))
+    return resolved
+
+
+def _creator_rows(cur, project_ids):
+    where, params = "", []
+    if project_ids is not None:
+        where = f"WHERE project_id IN ({','.join(['%s'] * len(project_ids))})"
+        params = list(project_ids)
+    cur.execute(f"""
+        SELECT DISTINCT creator, COALESCE(project_id, 0), iom_id
+        FROM prism_wbs
+        {where}
+    """, params)
+    wbs = [(c, pid, iom) for c, pid, iom in cur.fetchall() if owner_key(c) and iom]
+
+    cn_forms = {creator_to_cn(c) for c, _pid, _iom in wbs} | {" ".join(str(c).split()) for c, _pid, _iom in wbs}
+    resolved = _resolve_cns(cur, cn_forms)
+
+    rows = []
+    for creator, pid, iom in wbs:
+        keys = {owner_key(creator), owner_key(creator_to_cn(creator))}
+        keys |= resolved.get(owner_key(creator_to_cn(creator)), set())
+        keys |= resolved.get(owner_key(creator), set())
+        for k in keys:
+            rows.append((k, int(pid or 0), iom, ROLE_CREATOR, creator))
+    return rows
+
+
+def _pdl_rows(cur, project_ids):
+    where, params = "WHERE p.pdl_user_id IS NOT NULL", []
+    if project_ids is not None:
+        where += f" AND p.id IN ({','.join(['%s'] * len(project_ids))})"
+        params = list(project_ids)
+    # pdl_user_id holds the PDL's email/username (older rows: a users.id)
+    cur.execute(f"""
+        SELECT p.id, p.pdl_user_id, u.username, u.email
+        FROM projects p
+        LEFT JOIN users u ON u.id = p.pdl_user_id
+        {where}
+    """, params)
+    rows = []
+    for pid, pdl, username, email in cur.fetchall():
+        keys = {owner_key(username), owner_key(email)}
+        if not str(pdl).strip().isdigit():
+            keys.add(owner_key(pdl))
+        for k in keys:
+            if k:
+                rows.append((k, int(pid), "", ROLE_PDL, None))
+    return rows
+
+
+def rebuild_project_ownership(cur, project_ids=None):
+    """
+    Rebuild ownership rows for the given projects (all rows when None) inside the
+    caller's transaction. Returns the number of rows written.
+    """
+    if project_ids is not None:
+        project_ids = sorted({int(p) for p in project_ids if p})
+        if not project_ids:
+            return 0
+        cur.execute(
+            f"DELETE FROM {OWNERSHIP_TABLE} WHERE project_id IN ({','.join(['%s'] * len(project_ids))})",
+            project_ids,
+        )
+    else:
+        cur.execute(f"DELETE FROM {OWNERSHIP_TABLE}")
+
+    rows = _creator_rows(cur, project_ids) + _pdl_rows(cur, project_ids)
+    for i in range(0, len(rows), INSERT_BATCH):
+        chunk = rows[i:i + INSERT_BATCH]
+        params = [v for r in chunk for v in r]
+        cur.execute(
+            f"INSERT IGNORE INTO {OWNERSHIP_TABLE} (user_key, project_id, iom_id, role, creator) VALUES "
+            + ",".join(["(%s, %s, %s, %s, %s)"] * len(chunk)),
+            params,
+        )
+    return len(rows)
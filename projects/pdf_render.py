@@ -0,0 +1,219 @@
+"""
+projects/pdf_render.py
+
+Process-pool PDF rendering for the punch reports.
+
+pisa.CreatePDF is CPU-bound pure Python and holds the GIL, so rendering it in a
+request (or export) thread stalls every other thread of that worker. Renders
+are sent to a bounded ProcessPoolExecutor instead:
+
+ - PDF_RENDER_WORKERS processes, started with PDF_RENDER_START_METHOD ("spawn"
+   by default: no inherited DB connections or locks). Each worker runs
+   django.setup(), imports xhtml2pdf and parses projects/punches_pdf.html once
+   in its initializer, so a render is template.render + CreatePDF only.
+ - `warm_pool()` starts every worker up front (feas_project/wsgi.py calls it
+   when PDF_RENDER_PREWARM is on), so the first export does not pay for
+   interpreter start-up and imports.
+ - At most PDF_RENDER_MAX_INFLIGHT renders are queued or running; callers wait
+   up to PDF_RENDER_QUEUE_TIMEOUT seconds for a slot and then get PdfRenderBusy.
+ - A render longer than PDF_RENDER_TIMEOUT raises PdfRenderTimeout. Input rows
+   beyond PDF_RENDER_MAX_ROWS and output above PDF_RENDER_MAX_BYTES are refused.
+   A running task cannot be cancelled, so on a timeout the pool's worker
+   processes are terminated (renders sharing that pool fail with
+   PdfRenderError) and the slot is released; the pool is recreated on the
+   next call.
+
+A broken pool (a worker died) is replaced on the next call.
+"""
+
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PUNCHES_TEMPLATE = "projects/punches_pdf.html"
+
+
+class PdfRenderError(Exception):
+    pass
+
+
+class PdfRenderBusy(PdfRenderError):
+    pass
+
+
+class PdfRenderTimeout(PdfRenderError):
+    pass
+
+
+class PdfRenderTooLarge(PdfRenderError):
+    pass
+
+
+def _setting(name, default, cast=int):
+    try:
+        return cast(getattr(settings, name, default))
+    except (TypeError, ValueError):
+        return cast(default)
+
+
+# ---------- worker process side ----------
+_worker_templates = {}
+
+
+def _init_worker(settings_module, template_names):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    import django
+    django.setup()
+    import xhtml2pdf.pisa  # noqa: F401  (import cost paid once per worker)
+    from django.template.loader import get_template
+    for name in template_names:
+        _worker_templates[name] = get_template(name)
+
+
+def _ping():
+    return os.getpid()
+
+
+def _render_in_worker(template_name, context, max_bytes):
+    from xhtml2pdf import pisa
+    template = _worker_templates.get(template_name)
+    if template is None:
+        from django.template.loader import get_template
+        template = _worker_templates[template_name] = get_template(template_name)
+    html = template.render(context)
+    result = io.BytesIO()
+    status = pisa.CreatePDF(io.BytesIO(html.encode("utf-8")), dest=result)
+    if status.err:
+        raise RuntimeError(f"pisa reported {status.err} error(s)")
+    pdf = result.getvalue()
+    if max_bytes and len(pdf) > max_bytes:
+        raise PdfRenderTooLarge(f"rendered PDF is {len(pdf)} bytes (limit {max_bytes})")
+    return pdf
+
+
+# ---------- request process side ----------
+_pool = None
+_pool_lock = threading.Lock()
+_slots = None
+
+
+def _get_slots():
+    global _slots
+    with _pool_lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(max(1, _setting("PDF_RENDER_MAX_INFLIGHT", 8)))
+        return _slots
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            ctx = multiprocessing.get_context(getattr(settings, "PDF_RENDER_START_METHOD", "spawn"))
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, _setting("PDF_RENDER_WORKERS", 2)),
+                mp_context=ctx,
+                initializer=_init_worker,
+                initargs=(os.environ.get("DJANGO_SETTINGS_MODULE", "feas_project.settings"), (PUNCHES_TEMPLATE,)),
+            )
+        return _pool
+
+
+def _reset_pool(broken, terminate=False):
+    """Drop `broken` as the shared pool; with terminate=True its worker processes are killed first."""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    if terminate:
+        for proc in list((getattr(broken, "_processes", None) or {}).values()):
+            try:
+                proc.terminate()
+            except Exception:
+                logger.exception("pdf_render: terminating worker %s failed", getattr(proc, "pid", "?"))
+    try:
+        broken.shutdown(wait=False, cancel_futures=True)
+    except Exception:
+        logger.exception("pdf_render: shutting down broken pool failed")
+
+
+def _release_once(slots):
+    """A release callable that gives the slot back at most once, whoever calls it first."""
+    lock = threading.Lock()
+    state = {"released": False}
+
+    def release(*_args):
+        with lock:
+            if state["released"]:
+                return
+            state["released"] = True
+        slots.release()
+
+    return release
+
+
+def warm_pool():
+    """Start every worker now (non-blocking); safe to call more than once."""
+    try:
+        pool = _get_pool()
+        for _ in range(max(1, _setting("PDF_RENDER_WORKERS", 2))):
+            pool.submit(_ping)
+    except Exception:
+        logger.exception("pdf_render: warm-up failed")
+
+
+def render_pdf(template_name, context):
+    """
+    Render `template_name` with `context` (picklable values only) to PDF bytes in
+    the pool. Raises PdfRenderBusy / PdfRenderTimeout / PdfRenderTooLarge /
+    PdfRenderError.
+    """
+    max_rows = _setting("PDF_RENDER_MAX_ROWS", 20000)
+    rows = context.get("rows") or []
+    if max_rows and len(rows) > max_rows:
+        raise PdfRenderTooLarge(f"{len(rows)} rows exceed PDF_RENDER_MAX_ROWS={max_rows}")
+
+    slots = _get_slots()
+    if not slots.acquire(timeout=_setting("PDF_RENDER_QUEUE_TIMEOUT", 30, float)):
+        raise PdfRenderBusy("PDF renderer is busy, try again shortly")
+
+    release = _release_once(slots)
+    pool = _get_pool()
+    try:
+        future = pool.submit(_render_in_worker, template_name, context, _setting("PDF_RENDER_MAX_BYTES", 20 * 1024 * 1024))
+    except BrokenProcessPool:
+        release()
+        _reset_pool(pool)
+        raise PdfRenderError("PDF renderer restarted, try again")
+    except Exception:
+        release()
+        raise
+    # the slot is held until the worker is done; a timeout kills the worker and releases it
+    future.add_done_callback(release)
+
+    try:
+        return future.result(timeout=_setting("PDF_RENDER_TIMEOUT", 60, float))
+    except FutureTimeout:
+        logger.warning("pdf_render: %s timed out, recycling the render pool", template_name)
+        _reset_pool(pool, terminate=True)
+        release()
+        raise PdfRenderTimeout("PDF render timed out")
+    except BrokenProcessPool:
+        _reset_pool(pool)
+        raise PdfRenderError("PDF renderer worker died")
+    except PdfRenderError:
+        raise
+    except Exception as exc:
+        raise PdfRenderError(str(exc)) from exc
+
+
+def render_punches_pdf(context):
+    return render_pdf(PUNCHES_TEMPLATE, context)
@@ -0,0 +1,246 @@
+"""
+projects/punch_totals.py
+
+Weekly punch totals maintained alongside user_punches.
+
+`user_punch_week_totals` holds one row per (allocation_id, week_number), where
+week_number is the billing week stored on the punch (1 + days since the billing
+start // 7):
+
+    punched_hours  SUM(user_punches.actual_hours) for that allocation and week
+
+Every punch write passes its hour deltas to `apply_punch_deltas` in the same
+transaction, so the weekly cap check in save_my_alloc_daily and the weekly
+columns of my_allocations are primary-key reads instead of SUMs over the day
+rows. `rebuild_punch_week_totals` recomputes the table from user_punches
+(migration backfill and `manage.py rebuild_punch_week_totals`);
+`refresh_week_totals` does the same for a few allocations after
+`merge_allocation_children` has moved punches between allocation rows.
+Totals are never clamped: a week that goes negative has drifted from
+user_punches and is logged so the rebuild gets run.
+
+Concurrent punches for the same allocation week (several tabs, double submits)
+are serialized by `record_daily_punch`, which locks only that week's
+weekly_allocations row with SELECT ... FOR UPDATE before reading the total;
+punches for other allocation weeks never wait on each other.
+`manage.py loadtest_punch_caps` exercises both cases.
+
+All helpers take an open cursor (Django or mysql.connector; both use %s params)
+so they join the caller's transaction.
+"""
+
+import logging
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+TOTALS_TABLE = "user_punch_week_totals"
+
+
+class PunchRejected(Exception):
+    """The punch would break a rule (no weekly allocation, weekly cap exceeded)."""
+
+
+def apply_punch_deltas(cur, deltas):
+    """
+    Add {(allocation_id, week_number): Decimal} hour deltas with a single
+    multi-row upsert. Zero deltas are skipped. When a delta is negative the
+    touched weeks are re-read and any total below zero is logged as drift.
+    """
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return 0
+    params = []
+    for (allocation_id, week_number), delta in deltas.items():
+        params.extend([allocation_id, week_number, delta])
+    cur.execute(
+        f"INSERT INTO {TOTALS_TABLE} (allocation_id, week_number, punched_hours) VALUES "
+        + ",".join(["(%s, %s, %s)"] * len(deltas))
+        + " ON DUPLICATE KEY UPDATE punched_hours = punched_hours + VALUES(punched_hours)",
+        params,
+    )
+    negative = [k for k, v in deltas.items() if v < 0]
+    if negative:
+        _log_negative_totals(cur, negative)
+    return len(deltas)
+
+
+def _log_negative_totals(cur, keys):
+    """Warn about (allocation_id, week_number) totals that fell below zero."""
+    params = [p for key in keys for p in key]
+    cur.execute(
+        f"SELECT allocation_id, week_number, punched_hours FROM {TOTALS_TABLE}"
+        " WHERE punched_hours < 0 AND (allocation_id, week_number) IN ("
+        + ",".join(["(%s, %s)"] * len(keys)) + ")",
+        params,
+    )
+    for allocation_id, week_number, hours in cur.fetchall():
+        logger.warning(
+            "user_punch_week_totals drifted: allocation %s week %s is %s hours; "
+            "run manage.py rebuild_punch_week_totals",
+            allocation_id, week_number, hours,
+        )
+
+
+def week_total(cur, allocation_id, week_number, for_update=False):
+    """Punched hours for one (allocation, week); optionally locks the row."""
+    cur.execute(
+        f"SELECT punched_hours FROM {TOTALS_TABLE} WHERE allocation_id = %s AND week_number = %s"
+        + (" FOR UPDATE" if for_update else ""),
+        [allocation_id, week_number],
+    )
+    row = cur.fetchone()
+    return Decimal(str(row[0])) if row and row[0] is not None else Decimal("0.00")
+
+
+def week_totals(cur, allocation_ids):
+    """{allocation_id: {week_number: Decimal}} for the given allocations."""
+    out = {}
+    if not allocation_ids:
+        return out
+    cur.execute(
+        f"SELECT allocation_id, week_number, punched_hours FROM {TOTALS_TABLE} WHERE allocation_id IN ("
+        + ",".join(["%s"] * len(allocation_ids)) + ")",
+        list(allocation_ids),
+    )
+    for allocation_id, week_number, hours in cur.fetchall():
+        out.setdefault(allocation_id, {})[int(week_number)] = Decimal(str(hours or "0.00"))
+    return out
+
+
+def rebuild_punch_week_totals(cur, month_start=None):
+    """
+    Recompute the totals from user_punches, optionally only for allocations of
+    one billing month (monthly_allocation_entries.month_start).
+    """
+    where, params = "WHERE up.allocation_id IS NOT NULL AND up.week_number IS NOT NULL", []
+    if month_start:
+        scope = "SELECT id FROM monthly_allocation_entries WHERE month_start = %s"
+        cur.execute(f"DELETE FROM {TOTALS_TABLE} WHERE allocation_id IN ({scope})", [month_start])
+        where += f" AND up.allocation_id IN ({scope})"
+        params = [month_start]
+    else:
+        cur.execute(f"DELETE FROM {TOTALS_TABLE}")
+    cur.execute(f"""
+        INSERT INTO {TOTALS_TABLE} (allocation_id, week_number, punched_hours)
+        SELECT up.allocation_id, up.week_number, SUM(up.actual_hours)
+        FROM user_punches up
+        {where}
+        GROUP BY up.allocation_id, up.week_number
+    """, params)
+    return cur.rowcount
+
+
+def refresh_week_totals(cur, allocation_ids):
+    """Recompute the totals of the given allocations from user_punches."""
+    allocation_ids = list(allocation_ids)
+    if not allocation_ids:
+        return 0
+    in_sql = ",".join(["%s"] * len(allocation_ids))
+    cur.execute(f"DELETE FROM {TOTALS_TABLE} WHERE allocation_id IN ({in_sql})", allocation_ids)
+    cur.execute(f"""
+        INSERT INTO {TOTALS_TABLE} (allocation_id, week_number, punched_hours)
+        SELECT up.allocation_id, up.week_number, SUM(up.actual_hours)
+        FROM user_punches up
+        WHERE up.allocation_id IN ({in_sql}) AND up.week_number IS NOT NULL
+        GROUP BY up.allocation_id, up.week_number
+    """, allocation_ids)
+    return cur.rowcount
+
+
+def merge_allocation_children(cur, from_id, into_id):
+    """
+    Move the user_punches and weekly_allocations of allocation `from_id` onto
+    `into_id` before `from_id` is deleted (its FK children would cascade):
+     - a day punched on both rows is summed into `into_id`'s punch
+       (uq_punch_user_alloc_date), other punches are re-pointed;
+     - `into_id`'s own weeks win (uq_week_alloc), missing weeks are re-pointed.
+    Totals are not touched; call refresh_week_totals for `into_id` afterwards.
+    Returns (punches_merged, punches_moved, weeks_moved).
+    """
+    cur.execute("""
+        UPDATE user_punches kp
+        JOIN user_punches p
+          ON p.allocation_id = %s AND p.user_ldap = kp.user_ldap AND p.punch_date = kp.punch_date
+        SET kp.actual_hours = kp.actual_hours + p.actual_hours
+        WHERE kp.allocation_id = %s
+    """, [from_id, into_id])
+    merged = cur.rowcount
+    cur.execute("""
+        DELETE p FROM user_punches p
+        JOIN user_punches kp
+          ON kp.allocation_id = %s AND kp.user_ldap = p.user_ldap AND kp.punch_date = p.punch_date
+        WHERE p.allocation_id = %s
+    """, [into_id, from_id])
+    cur.execute("UPDATE user_punches SET allocation_id = %s WHERE allocation_id = %s", [into_id, from_id])
+    moved = cur.rowcount
+    cur.execute("""
+        UPDATE weekly_allocations w
+        LEFT JOIN weekly_allocations kw
+          ON kw.allocation_id = %s AND kw.week_number = w.week_number
+        SET w.allocation_id = %s
+        WHERE w.allocation_id = %s AND kw.allocation_id IS NULL
+    """, [into_id, into_id, from_id])
+    return merged, moved, cur.rowcount
+
+
+def punch_deltas(allocation_id, week_number, actual_hours, existing=None):
+    """
+    {(allocation_id, week_number): Decimal} total deltas for upserting one day's
+    punch. `existing` is the stored punch as (actual_hours, week_number) or None;
+    its hours leave its old week, so a punch moved to another week is subtracted
+    there and added to the new one. Zero deltas are dropped.
+    """
+    deltas = {(allocation_id, week_number): Decimal(str(actual_hours))}
+    if existing:
+        old_hours = Decimal(str(existing[0] or "0.00"))
+        old_week = int(existing[1] or week_number)
+        deltas[(allocation_id, old_week)] = deltas.get((allocation_id, old_week), Decimal("0.00")) - old_hours
+    return {k: v for k, v in deltas.items() if v}
+
+
+def record_daily_punch(cur, user_ldap, allocation_id, punch_date, week_number, actual_hours, wbs=None):
+    """
+    Upsert one day's punch and move its hours into the weekly total. Must run
+    inside a transaction: the allocation week's weekly_allocations row is locked
+    first, so the cap check and the write are atomic per (allocation, week).
+    Raises PunchRejected; returns the new weekly total.
+    """
+    cur.execute("""
+        SELECT hours FROM weekly_allocations
+        WHERE allocation_id = %s AND week_number = %s
+        FOR UPDATE
+    """, [allocation_id, week_number])
+    rec = cur.fetchone()
+    if not rec:
+        raise PunchRejected("No weekly allocation found")
+    alloc_hours = Decimal(str(rec[0] or "0.00"))
+
+    # locking reads: see the latest committed rows, not the transaction snapshot
+    cur.execute("""
+        SELECT actual_hours, week_number FROM user_punches
+        WHERE user_ldap = %s AND allocation_id = %s AND punch_date = %s
+        FOR UPDATE
+    """, [user_ldap, allocation_id, punch_date])
+    existing = cur.fetchone()
+    old_hours = Decimal(str(existing[0] or "0.00")) if existing else Decimal("0.00")
+    old_week = int(existing[1] or week_number) if existing else week_number
+
+    week_sum = week_total(cur, allocation_id, week_number, for_update=True)
+    total_after = week_sum - (old_hours if old_week == week_number else Decimal("0.00")) + actual_hours
+    if total_after > alloc_hours:
+        raise PunchRejected(f"Exceeds weekly allocation {alloc_hours:.2f}")
+
+    cur.execute("""
+        INSERT INTO user_punches
+        (user_ldap, allocation_id, punch_date, week_number, actual_hours, wbs, updated_at)
+        VALUES (%s,%s,%s,%s,%s,%s,CURRENT_TIMESTAMP)
+        ON DUPLICATE KEY UPDATE
+          week_number=VALUES(week_number),
+          actual_hours=VALUES(actual_hours),
+          wbs=VALUES(wbs),
+          updated_at=CURRENT_TIMESTAMP
+    """, [user_ldap, allocation_id, punch_date, week_number, str(actual_hours), wbs])
+
+    apply_punch_deltas(cur, punch_deltas(allocation_id, week_number, actual_hours, existing))
+    return total_after
@@ -0,0 +1,141 @@
+"""
+projects/refdata.py
+
+Process-local cache of reference data that changes a few times a month:
+COEs, domains (grouped by COE), projects (id, name) and project_coes counts.
+
+The cache is one immutable snapshot (tuples of read-only mappings) tagged with
+the version it was built for. The current version is a counter in the one-row
+`refdata_version` table (migration 14), so every worker process sees it; every
+write to coes / domains / projects / project_coes calls `bump_refdata_version()`
+after its commit, and the next read in any process rebuilds the snapshot with
+one connection and four queries. Reads in between cost one primary-key lookup.
+
+Snapshots also expire after REFDATA_CACHE_TTL seconds, which bounds staleness
+when the version table cannot be read (migrations not applied yet).
+
+Rows are MappingProxyType objects: templates read them like dicts, JSON
+endpoints must copy them with `dict(row)` first.
+"""
+
+import logging
+import threading
+import time
+from types import MappingProxyType
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+VERSION_TABLE = "refdata_version"
+DEFAULT_CACHE_TTL = 300
+
+_lock = threading.Lock()
+_snapshot = None  # (version, built_at, data)
+
+
+def _ttl():
+    try:
+        return float(getattr(settings, "REFDATA_CACHE_TTL", DEFAULT_CACHE_TTL))
+    except (TypeError, ValueError):
+        return float(DEFAULT_CACHE_TTL)
+
+
+def current_version():
+    """The shared version counter, or None when it cannot be read (the TTL applies alone)."""
+    try:
+        with connection.cursor() as cur:
+            cur.execute(f"SELECT version FROM {VERSION_TABLE} WHERE id = 1")
+            row = cur.fetchone()
+    except Exception:
+        logger.exception("current_version: %s unavailable", VERSION_TABLE)
+        return None
+    return int(row[0]) if row else 0
+
+
+def bump_refdata_version():
+    """Invalidate every snapshot built so far, in every process. Call after the write has committed."""
+    global _snapshot
+    try:
+        with connection.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO {VERSION_TABLE} (id, version) VALUES (1, 1)
+                ON DUPLICATE KEY UPDATE version = version + 1
+            """)
+    except Exception:
+        logger.exception("bump_refdata_version: %s unavailable", VERSION_TABLE)
+    with _lock:
+        _snapshot = None
+
+
+def _row(cols, values):
+    return MappingProxyType(dict(zip(cols, values)))
+
+
+def _load():
+    with connection.cursor() as cur:
+        cur.execute("SELECT id, name FROM coes ORDER BY name")
+        coes = tuple(_row(("id", "name"), r) for r in cur.fetchall())
+
+        cur.execute("SELECT id, name, coe_id FROM domains ORDER BY name")
+        domains = tuple(_row(("id", "name", "coe_id"), r) for r in cur.fetchall())
+
+        cur.execute("SELECT id, name FROM projects ORDER BY created_at DESC, id DESC")
+        projects = tuple(_row(("id", "name"), r) for r in cur.fetchall())
+
+        cur.execute("SELECT project_id, COUNT(*) FROM project_coes GROUP BY project_id")
+        coe_counts = {int(pid): int(cnt) for pid, cnt in cur.fetchall()}
+
+    by_coe = {}
+    for d in domains:
+        by_coe.setdefault(d["coe_id"], []).append(MappingProxyType({"id": d["id"], "name": d["name"]}))
+
+    return MappingProxyType({
+        "coes": coes,
+        "domains": domains,
+        "domains_by_coe": MappingProxyType({k: tuple(v) for k, v in by_coe.items()}),
+        "projects": projects,
+        "project_coe_counts": MappingProxyType(coe_counts),
+    })
+
+
+def _data():
+    global _snapshot
+    version = current_version()
+    snap = _snapshot
+    if snap and snap[0] == version and time.monotonic() - snap[1] < _ttl():
+        return snap[2]
+    with _lock:
+        snap = _snapshot
+        if snap and snap[0] == version and time.monotonic() - snap[1] < _ttl():
+            return snap[2]
+        data = _load()
+        _snapshot = (version, time.monotonic(), data)
+        return data
+
+
+def get_coes():
+    """((id, name), ...) ordered by name."""
+    return _data()["coes"]
+
+
+def get_domains():
+    """((id, name, coe_id), ...) ordered by name."""
+    return _data()["domains"]
+
+
+def get_domains_by_coe():
+    """{coe_id: ((id, name), ...)}"""
+    return _data()["domains_by_coe"]
+
+
+def get_projects(limit=None):
+    """((id, name), ...) newest first."""
+    projects = _data()["projects"]
+    return projects[:limit] if limit else projects
+
+
+def get_project_coe_counts():
+    """{project_id: number of mapped COEs}"""
+    return _data()["project_coe_counts"]
@@ -1,3 +1,187 @@
-from django.test import TestCase
+from datetime import date
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from .capacity import allocation_deltas, iom_allocation_deltas
+from .punch_totals import PunchRejected, apply_punch_deltas, punch_deltas, record_daily_punch
+from .views import _diff_allocation_entries, _ensure_user_from_ldap, _save_allocation_diff
+
+
+D = Decimal
+
+
+class FakeCursor:
+    """Records executed SQL and hands out queued fetchone()/fetchall() results."""
+
+    def __init__(self, fetchone_results=(), fetchall_results=()):
+        self.executed = []
+        self._results = list(fetchone_results)
+        self._all_results = list(fetchall_results)
+
+    def execute(self, sql, params=None):
+        self.executed.append((" ".join(sql.split()), list(params or [])))
+
+    def fetchone(self):
+        return self._results.pop(0) if self._results else None
+
+    def fetchall(self):
+        return self._all_results.pop(0) if self._all_results else []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class DiffAllocationEntriesTests(SimpleTestCase):
+    def test_classifies_inserts_updates_deletes(self):
+        existing = [(1, "IOM1", "a@x.com", "10.00"), (2, "IOM1", "b@x.com", "5.00"), (3, "IOM1", "c@x.com", "7.00")]
+        items = [
+            {"iom_id": "IOM1", "user_ldap": "a@x.com", "total_hours": 10},
+            {"iom_id": "IOM1", "user_ldap": "b@x.com", "total_hours": 8},
+            {"iom_id": "IOM1", "user_ldap": "d@x.com", "total_hours": 4},
+        ]
+        diff = _diff_allocation_entries(existing, items)
+        self.assertEqual(diff["inserts"], [("IOM1", "d@x.com", D("4.00"))])
+        self.assertEqual(diff["updates"], [(2, "IOM1", "b@x.com", D("5.00"), D("8.00"))])
+        self.assertEqual(diff["deletes"], [(3, "IOM1", "c@x.com", D("7.00"))])
+        self.assertEqual(diff["adopts"], [])
+        self.assertEqual(diff["retires"], [])
+
+    def test_duplicate_payload_items_keep_the_last_value(self):
+        items = [
+            {"iom_id": "IOM1", "user_ldap": "A@x.com", "total_hours": 3},
+            {"iom_id": "IOM1", "user_ldap": " a@x.com ", "total_hours": 6},
+        ]
+        diff = _diff_allocation_entries([(1, "IOM1", "a@x.com", "3.00")], items)
+        self.assertEqual(diff["inserts"], [])
+        self.assertEqual(diff["updates"], [(1, "IOM1", "a@x.com", D("3.00"), D("6.00"))])
+        self.assertEqual(diff["deletes"], [])
+
+    def test_items_without_iom_or_user_are_ignored(self):
+        items = [{"iom_id": "", "user_ldap": "a@x.com", "total_hours": 1},
+                 {"iom_id": "IOM1", "user_ldap": "  ", "total_hours": 1}]
+        diff = _diff_allocation_entries([], items)
+        self.assertEqual((diff["inserts"], diff["updates"], diff["deletes"]), ([], [], []))
+
+    def test_legacy_rows_are_adopted_then_retired(self):
+        items = [
+            {"iom_id": "IOM1", "user_ldap": "a@x.com", "total_hours": 80},
+            {"iom_id": "IOM2", "user_ldap": "a@x.com", "total_hours": 10},
+        ]
+        legacy = [(11, "a@x.com", "50.00"), (12, "a@x.com", "30.00"), (13, "other@x.com", "9.00")]
+        diff = _diff_allocation_entries([], items, legacy)
+        self.assertEqual(diff["adopts"], [(11, "IOM1", "a@x.com", D("50.00"), D("80.00"))])
+        self.assertEqual(diff["inserts"], [("IOM2", "a@x.com", D("10.00"))])
+        self.assertEqual(diff["retires"], [(12, 11, "a@x.com", D("30.00"))])
+
+
+class SaveAllocationDiffTests(SimpleTestCase):
+    def test_known_rows_are_updated_by_id_without_an_insert(self):
+        cur = FakeCursor(fetchall_results=[[(1, "IOM1", "a@x.com", "3.00")], [(11, "b@x.com", "5.00")]])
+        items = [{"iom_id": "IOM1", "user_ldap": "a@x.com", "total_hours": 6},
+                 {"iom_id": "IOM1", "user_ldap": "b@x.com", "total_hours": 7}]
+        _save_allocation_diff(cur, 5, date(2025, 1, 1), items)
+        writes = [(sql, params) for sql, params in cur.executed if not sql.startswith("SELECT")]
+        self.assertEqual(len(writes), 1)
+        sql, params = writes[0]
+        self.assertTrue(sql.startswith("UPDATE monthly_allocation_entries SET total_hours = CASE id"))
+        self.assertEqual(params, [1, D("6.00"), 11, D("7.00"), 11, "IOM1", 11, "b@x.com", 1, 11])
+
+
+class AllocationDeltaTests(SimpleTestCase):
+    def test_user_and_iom_deltas_follow_the_diff(self):
+        existing = [(1, "IOM1", "a@x.com", "10.00"), (2, "IOM2", "b@x.com", "5.00")]
+        items = [
+            {"iom_id": "IOM1", "user_ldap": "a@x.com", "total_hours": 12},
+            {"iom_id": "IOM1", "user_ldap": "b@x.com", "total_hours": 2},
+            {"iom_id": "IOM2", "user_ldap": "c@x.com", "total_hours": 0},
+        ]
+        diff = _diff_allocation_entries(existing, items)
+        self.assertEqual(allocation_deltas(diff), {"a@x.com": D("2.00"), "b@x.com": D("-3.00")})
+        self.assertEqual(iom_allocation_deltas(diff), {"IOM1": D("4.00"), "IOM2": D("-5.00")})
+
+    def test_legacy_hours_are_not_counted_twice(self):
+        items = [{"iom_id": "IOM1", "user_ldap": "a@x.com", "total_hours": 80}]
+        diff = _diff_allocation_entries([], items, [(11, "a@x.com", "50.00"), (12, "a@x.com", "30.00")])
+        # 80 legacy hours become 80 IOM hours: the user's total is unchanged
+        self.assertEqual(allocation_deltas(diff), {})
+        self.assertEqual(iom_allocation_deltas(diff), {"IOM1": D("80.00")})
+
+
+class PunchDeltaTests(SimpleTestCase):
+    def test_new_punch_adds_to_its_week(self):
+        self.assertEqual(punch_deltas(7, 2, D("3.50")), {(7, 2): D("3.50")})
+
+    def test_same_week_update_adds_the_difference(self):
+        self.assertEqual(punch_deltas(7, 2, D("5.00"), (D("3.00"), 2)), {(7, 2): D("2.00")})
+
+    def test_unchanged_punch_has_no_delta(self):
+        self.assertEqual(punch_deltas(7, 2, D("3.00"), (D("3.00"), 2)), {})
+
+    def test_week_move_subtracts_from_the_old_week(self):
+        self.assertEqual(punch_deltas(7, 3, D("4.00"), (D("3.00"), 2)), {(7, 3): D("4.00"), (7, 2): D("-3.00")})
+
+    def test_missing_stored_week_counts_as_the_new_week(self):
+        self.assertEqual(punch_deltas(7, 3, D("4.00"), (D("1.00"), None)), {(7, 3): D("3.00")})
+
+
+class ApplyPunchDeltasTests(SimpleTestCase):
+    def test_negative_total_is_logged_not_clamped(self):
+        cur = FakeCursor(fetchall_results=[[(7, 2, D("-1.50"))]])
+        with self.assertLogs("projects.punch_totals", level="WARNING") as logs:
+            apply_punch_deltas(cur, {(7, 2): D("-3.00")})
+        self.assertIn("rebuild_punch_week_totals", logs.output[0])
+
+    def test_positive_deltas_skip_the_drift_check(self):
+        cur = FakeCursor()
+        apply_punch_deltas(cur, {(7, 2): D("3.00")})
+        self.assertEqual(len(cur.executed), 1)
+
+
+class RecordDailyPunchTests(SimpleTestCase):
+    def test_week_move_updates_both_week_totals(self):
+        # weekly_allocations hours, stored punch (hours, week), locked week-3 total
+        cur = FakeCursor([(D("40.00"),), (D("3.00"), 2), (D("10.00"),)])
+        total = record_daily_punch(cur, "a@x.com", 7, date(2025, 1, 15), 3, D("4.00"))
+        self.assertEqual(total, D("14.00"))
+        sql, params = cur.executed[-2]
+        self.assertTrue(sql.startswith("INSERT INTO user_punch_week_totals"))
+        self.assertNotIn("GREATEST", sql)
+        self.assertEqual(params, [7, 3, D("4.00"), 7, 2, D("-3.00")])
+        # the week that lost hours is checked for drift
+        self.assertEqual(cur.executed[-1][1], [7, 2])
+
+    def test_rejects_punch_over_the_weekly_cap(self):
+        cur = FakeCursor([(D("8.00"),), None, (D("6.00"),)])
+        with self.assertRaises(PunchRejected):
+            record_daily_punch(cur, "a@x.com", 7, date(2025, 1, 15), 3, D("4.00"))
+        self.assertFalse(any(sql.startswith("INSERT") for sql, _params in cur.executed))
+
+
+class EnsureUserFromLdapTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _call(self, identifier, cur):
+        with mock.patch("projects.views.connection") as conn:
+            conn.cursor.return_value = cur
+            return _ensure_user_from_ldap(None, identifier)
+
+    def test_bare_name_finds_row_created_from_an_email(self):
+        # users(username='jdoe', ldap_id='jdoe@corp.com') matches on username
+        cur = FakeCursor([(42,)])
+        self.assertEqual(self._call("jdoe", cur), 42)
+        sql, params = cur.executed[0]
+        self.assertIn("ldap_id = %s OR username = %s", sql)
+        self.assertEqual(params, ["jdoe", "jdoe", "jdoe"])
+        self.assertEqual(len(cur.executed), 1)
+
+    def test_insert_colliding_with_another_person_returns_none(self):
+        # email miss; the insert hits username 'jdoe' owned by jdoe@other.com
+        cur = FakeCursor([None, (7,), ("jdoe@other.com", "jdoe@other.com")])
+        self.assertIsNone(self._call("jdoe@corp.com", cur))
@@ -32,13 +32,17 @@ urlpatterns = [
     path("api/projects/", views.api_projects, name="api_projects"),
     path("api/subprojects/", views.api_subprojects, name="api_subprojects"),
     path("team-allocations/", views.team_allocations, name="team_allocations"),
+    path("team-allocations/api/", views.team_allocations_api, name="team_allocations_api"),
     path("team-allocations/save/", views.save_team_allocation, name="save_team_allocation"),
+    path("team-allocations/export/", views.export_team_workbook, name="export_team_workbook"),
+    path("team-allocations/bulk/", views.bulk_update_weekly, name="bulk_update_weekly"),
 
     path("my-allocations/update-status/", views.my_allocations_update_status, name="my_allocations_update_status"),
 
     path('monthly_allocations/', views.monthly_allocations, name='monthly_allocations'),
     path('get_applicable_ioms/', views.get_applicable_ioms, name='get_applicable_ioms'),
     path('get_iom_details/', views.get_iom_details, name='get_iom_details'),
+    path('get_iom_batch/', views.get_iom_batch, name='get_iom_batch'),
     path('allocations_ldap_search/', views.ldap_search, name='allocations_ldap_search'),
     # ensure save_monthly_allocations and save_team_allocation exist and are named accordingly in urls
 
@@ -52,4 +56,8 @@ urlpatterns = [
     path('my-allocations/save-daily/', views.save_my_alloc_daily, name='save_my_alloc_daily'),
     path('my-allocations/export/excel/', views.export_my_punches_excel, name='export_my_punches_excel'),
     path('my-allocations/export/pdf/', views.export_my_punches_pdf, name='export_my_punches_pdf'),
+    path('api/bulk/<str:dataset>/', views.bulk_export, name='bulk_export'),
+    path('exports/start/', views.export_job_start, name='export_job_start'),
+    path('exports/<int:job_id>/status/', views.export_job_status, name='export_job_status'),
+    path('exports/<int:job_id>/download/', views.export_job_download, name='export_job_download'),
 ]
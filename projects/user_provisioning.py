@@ -0,0 +1,88 @@
+"""
+projects/user_provisioning.py
+
+Set-based provisioning of `users` rows from the local `ldap_directory` mirror.
+
+The LDAP full sync (resources.views._full_ldap_sync_worker) calls
+`provision_users_from_directory` once the directory is refreshed: ldap_directory
+is read in id order with keyset pagination (`WHERE id > last_id ORDER BY id
+LIMIT chunk`) and each chunk becomes one multi-row
+INSERT ... ON DUPLICATE KEY UPDATE into users, mapped the same way as
+projects.views._ensure_user_from_ldap creates a row:
+
+    ldap_id   ldap_directory.username (canonical identifier)
+    username  the part before '@' when the directory username is a UPN, else the username
+    email     ldap_directory.email (the UPN when no mail attribute is set)
+
+Existing rows keep their username/ldap_id (both unique); the email of the row
+with the same ldap_id follows the directory (a changed mail attribute replaces
+the stored one, an empty one keeps it). With every directory entry provisioned, request-time lookups are
+single indexed reads that almost never insert.
+
+All helpers take an open cursor (Django or mysql.connector; both use %s params).
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK = 500
+
+
+def _chunk_size():
+    try:
+        from django.conf import settings
+        return max(1, int(getattr(settings, "USERS_PROVISION_CHUNK", DEFAULT_CHUNK)))
+    except Exception:
+        return DEFAULT_CHUNK
+
+
+def user_row_values(identifier, email=None):
+    """(username, ldap_id, email) for a users row created from an LDAP identifier."""
+    identifier = (identifier or "").strip()
+    if "@" in identifier:
+        return identifier.split("@", 1)[0], identifier, (email or identifier)
+    return identifier, identifier, (email or None)
+
+
+def upsert_users(cur, rows):
+    """One multi-row upsert of (username, ldap_id, email) tuples; returns the number sent."""
+    if not rows:
+        return 0
+    params = []
+    for row in rows:
+        params.extend(row)
+    cur.execute(
+        "INSERT INTO users (username, ldap_id, email) VALUES "
+        + ",".join(["(%s, %s, %s)"] * len(rows))
+        # only the row of the same directory identity takes the email; a username
+        # collision with another person's row leaves that row alone
+        + " ON DUPLICATE KEY UPDATE email = IF(ldap_id = VALUES(ldap_id), COALESCE(VALUES(email), email), email)",
+        params,
+    )
+    return len(rows)
+
+
+def provision_users_from_directory(cur, chunk=None):
+    """Provision/refresh users for every ldap_directory entry; returns the entries processed."""
+    chunk = chunk or _chunk_size()
+    last_id, processed = 0, 0
+    while True:
+        cur.execute("""
+            SELECT id, username, email
+            FROM ldap_directory
+            WHERE id > %s
+            ORDER BY id
+            LIMIT %s
+        """, [last_id, chunk])
+        page = cur.fetchall()
+        if not page:
+            break
+        rows = [user_row_values(username, email) for _id, username, email in page if (username or "").strip()]
+        upsert_users(cur, rows)
+        processed += len(page)
+        last_id = page[-1][0]
+        if len(page) < chunk:
+            break
+    logger.info("users provisioned from %d ldap_directory entries", processed)
+    return processed
@@ -17,29 +17,41 @@ allocations with the following main capabilities:
    - Canonical billing periods come from `monthly_hours_limit` (year, month,
      start_date, end_date). If not defined, we fall back to the calendar month.
    - Monthly totals are stored in `monthly_allocation_entries` keyed by:
-       (project_id, iom_id, month_start, user_ldap).
+       (project_id, iom_id, month_start, user_key) — user_key is LOWER(TRIM(user_ldap)).
+     Saves are applied as a diff (insert/update/delete) so untouched rows keep
+     their ids and weekly children.
    - Weekly splits/decisions are stored in `weekly_allocations` keyed by:
        (allocation_id, week_number).
+     `bulk_update_weekly` applies many percent/status cells with one ownership
+     query and one multi-row upsert.
    - Individual day punches/actuals are stored in `user_punches`.
 
 3) Team and personal allocation views
    - `team_allocations`: Manager/PDL view over direct/indirect reportees retrieved
-     from LDAP, current billing window, with weekly summaries.
+     from LDAP, current billing window, with weekly summaries. The page is a shell;
+     rows come from `team_allocations_api` (keyset pages, server-side sort and
+     filters, reportees cached in the session, batched ldap_directory names).
    - `my_allocations`: User’s own allocations, provides equal-split fallback
      when weekly rows are missing, shows punches and holidays across the billing
      period, and supports “Save Week” and daily punching aligned to billing weeks.
 
 4) Exports
    - Excel export for IOM allocations in a given billing window.
-   - PDF/Excel export of a user’s punches for a billing window with robust
-     lookups for LDAP value variants (exact, lowercase, localpart, wildcard).
+   - PDF/Excel export of a user’s punches for a billing window; the session
+     identity is resolved once (via `ldap_directory`, cached in the session) to
+     normalized `user_punches.user_key` values read with one indexed query.
+   - Exports run as background jobs (`export_jobs`, projects/exports.py) whose
+     files are cached per (type, user, period, data version); the pages poll
+     `export_job_status` and download the finished artifact.
 
 5) LDAP handling strategy
    - Prefer local table `ldap_directory` (username, email, cn, title) for lookups.
    - Fallback to live LDAP (via `accounts.ldap_utils`) when needed and when
      session credentials are present (username/password stored in session).
-   - `_ensure_user_from_ldap` ensures there is always a `users` row corresponding
-     to an LDAP identifier (email or sAMAccountName), creating on demand if needed.
+   - `users` rows are provisioned in bulk from `ldap_directory` at the end of
+     each LDAP sync (projects/user_provisioning.py); `_ensure_user_from_ldap`
+     is a cached single-key lookup that creates a row only for identifiers the
+     sync has not seen yet.
 
 6) Security and authorization
    - Edit/project-selection logic ensures users can only edit projects where
@@ -63,14 +75,20 @@ Key Tables (as referenced by SQL in this module)
 - monthly_hours_limit(year, month, start_date, end_date, max_hours)
 - allocations(id, month_start, …) and allocation_items(id, allocation_id,
             project_id, coe_id, domain_id, user_ldap, user_id, total_hours, …)
-  (Some legacy paths use these tables for page assembly.)
+  (Legacy; backfilled into monthly_allocation_entries, no longer read.)
 - monthly_allocation_entries(id, project_id, iom_id, month_start, user_ldap,
-            total_hours, created_at)
+            user_key, coe_id, domain_id, legacy_item_id, total_hours,
+            created_at, updated_at)
+  # unique key on (project_id, iom_id, month_start, user_key); idx (project_id, month_start)
 - weekly_allocations(id, allocation_id, week_number, percent, hours, status,
             created_at, updated_at)  # unique key on (allocation_id, week_number)
 - user_punches(id, user_ldap, allocation_id, punch_date, week_number, actual_hours,
             wbs, updated_at)
+- user_punch_week_totals(allocation_id, week_number, punched_hours)
+            # SUM(actual_hours) per billing week, see projects/punch_totals.py
 - holidays(holiday_date, name)
+- user_capacity_ledger(user_key, period_start, allocated_hours, max_hours,
+            holiday_hours)  # cross-project capacity, see projects/capacity.py
 
 Canonical Billing Period
 ------------------------
@@ -146,9 +164,15 @@ file to the original byte size. Keeping it changes nothing functionally.
 """
 
 # Standard library
+import base64
+import hashlib
+import hmac
 import io
 import json
 import logging
+import os
+import tempfile
+import time
 from datetime import date, datetime, timedelta
 from decimal import Decimal, ROUND_HALF_UP
 from math import ceil
@@ -158,6 +182,7 @@ import mysql.connector
 import openpyxl
 from mysql.connector import Error, IntegrityError
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
 from openpyxl.utils import get_column_letter
 from xhtml2pdf import pisa
@@ -165,14 +190,17 @@ from xhtml2pdf import pisa
 # Django
 from django.conf import settings
 from django.contrib import messages
+from django.core.cache import cache
 from django.contrib.auth.decorators import login_required
 from django.db import connection, transaction
 from django.http import (
+    FileResponse,
     HttpResponse,
     HttpResponseBadRequest,
     HttpResponseForbidden,
     HttpResponseNotAllowed,
     JsonResponse,
+    StreamingHttpResponse,
 )
 from django.shortcuts import redirect, render
 from django.template.loader import render_to_string
@@ -180,6 +208,32 @@ from django.urls import reverse
 from django.utils.http import urlencode
 from django.views.decorators.http import require_GET, require_POST, require_http_methods
 
+from . import bulk_export as bulk_export_data
+from . import exports as export_jobs
+from .capacity import (
+    allocation_deltas, apply_allocation_deltas, apply_iom_deltas, get_capacity, iom_allocation_deltas,
+    period_available_hours,
+)
+from .ownership import ROLE_CREATOR, owned_subquery, rebuild_project_ownership, session_owner_keys
+from .pdf_render import render_punches_pdf
+from .punch_totals import (
+    TOTALS_TABLE,
+    PunchRejected,
+    merge_allocation_children,
+    record_daily_punch,
+    refresh_week_totals,
+    week_totals,
+)
+from .refdata import (
+    bump_refdata_version,
+    get_coes,
+    get_domains,
+    get_domains_by_coe,
+    get_project_coe_counts,
+    get_projects,
+)
+from .user_provisioning import user_row_values
+
 
 PAGE_SIZE = 10
 # -------------------------
@@ -553,67 +607,63 @@ def month_day_to_week_number(d):
     """
     return min(((d.day - 1) // 7) + 1, 4)
 
+USER_ID_CACHE_PREFIX = "feas:user_id:"
+
+
 def _ensure_user_from_ldap(request, samaccountname):
     """
-    Ensure a 'users' row exists for the given LDAP identifier (username or email).
-    Returns the users.id (int) for the row (create if missing).
-
-    Behavior:
-      - If a users row already has ldap_id == samaccountname or username == samaccountname or email == samaccountname -> return it
-      - Else insert a new users row:
-          username = part before '@' if samaccountname looks like an email, else samaccountname
-          ldap_id = samaccountname (store canonical identifier)
-          email = samaccountname if it looks like an email, else NULL
+    Return users.id for an LDAP identifier (username or email).
+
+    Rows are provisioned in bulk by the LDAP sync (projects/user_provisioning.py),
+    so this is normally a cached lookup on indexed keys: email for email-like
+    identifiers, ldap_id or username otherwise (rows created from an email keep
+    the bare name in username). A row is inserted (same mapping as the sync)
+    only for identifiers the sync has not seen yet; when that insert collides
+    with an existing username/ldap_id, the existing row is only used if its
+    ldap_id or email is the identifier (otherwise None: a different person owns
+    that username). Ids are cached for USER_ID_CACHE_TTL seconds.
     """
-    if not samaccountname:
+    key = str(samaccountname or "").strip()
+    if not key:
         return None
+    cache_key = USER_ID_CACHE_PREFIX + hashlib.sha256(key.lower().encode("utf-8")).hexdigest()
+    user_id = cache.get(cache_key)
+    if user_id:
+        return user_id
 
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
+    if "@" in key:
+        lookup_sql, lookup_params = "SELECT id FROM users WHERE email = %s ORDER BY id LIMIT 1", [key]
+    else:
+        lookup_sql = ("SELECT id FROM users WHERE ldap_id = %s OR username = %s "
+                      "ORDER BY (ldap_id = %s) DESC, id LIMIT 1")
+        lookup_params = [key, key, key]
     try:
-        # try to find existing by ldap_id, username or email
-        cur.execute(
-            "SELECT id, ldap_id, username, email FROM users WHERE ldap_id = %s OR username = %s OR email = %s LIMIT 1",
-            (samaccountname, samaccountname, samaccountname)
-        )
-        row = cur.fetchone()
-        if row:
-            return row["id"]
-
-        # Prepare insert values
-        username_val = samaccountname
-        email_val = None
-        if "@" in samaccountname:
-            # username part before @
-            username_val = samaccountname.split("@", 1)[0]
-            email_val = samaccountname
-
-        ins = conn.cursor()
-        try:
-            ins.execute(
-                "INSERT INTO users (username, ldap_id, email, created_at) VALUES (%s, %s, %s, CURRENT_TIMESTAMP)",
-                (username_val, samaccountname, email_val)
-            )
-            conn.commit()
-            new_id = ins.lastrowid
-        finally:
-            try:
-                ins.close()
-            except Exception:
-                pass
-        return new_id
+        with connection.cursor() as cur:
+            cur.execute(lookup_sql, lookup_params)
+            row = cur.fetchone()
+            if row:
+                user_id = row[0]
+            else:
+                # LAST_INSERT_ID(id) hands back the existing row when username/ldap_id already exist
+                cur.execute("""
+                    INSERT INTO users (username, ldap_id, email)
+                    VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)
+                """, list(user_row_values(key)))
+                cur.execute("SELECT LAST_INSERT_ID()")
+                user_id = cur.fetchone()[0]
+                cur.execute("SELECT ldap_id, email FROM users WHERE id = %s", [user_id])
+                ldap_id, email = cur.fetchone() or (None, None)
+                if key.lower() not in ((ldap_id or "").strip().lower(), (email or "").strip().lower()):
+                    logger.warning("_ensure_user_from_ldap: %s collides with users.id=%s (ldap_id=%s, email=%s)",
+                                   key, user_id, ldap_id, email)
+                    return None
     except Exception:
-        logger.exception("Error in _ensure_user_from_ldap for identifier: %s", samaccountname)
+        logger.exception("Error in _ensure_user_from_ldap for identifier: %s", key)
         return None
-    finally:
-        try:
-            cur.close()
-        except Exception:
-            pass
-        try:
-            conn.close()
-        except Exception:
-            pass
+
+    cache.set(cache_key, user_id, int(getattr(settings, "USER_ID_CACHE_TTL", 3600)))
+    return user_id
 
 
 def _get_local_ldap_entry(identifier):
@@ -671,59 +721,32 @@ from django.shortcuts import render
 def project_list(request):
     """
     Return projects visible to the logged-in user:
-      - projects where p.pdl_user_id == ldap_username (email)
-      - OR projects linked (prism_wbs.project_id) where prism_wbs.creator matches converted CN
+      - projects where the user is PDL
+      - OR projects linked (prism_wbs.project_id) to IOMs the user created
+    Both come from project_ownership (see projects/ownership.py).
 
     The view returns projects (as before) for client-side pagination.
     """
-    # Get session values
-    ldap_username = request.session.get("ldap_username")  # expected to be email or identifier
-    cn = request.session.get("cn")  # stored as "LASTNAME FirstName ..." (e.g. "DEO Sant Anurag")
-
-    # convert cn (LastName + FirstName...) to creator format (FirstName ... LastName)
-    creator_name = None
-    try:
-        if cn:
-            parts = str(cn).strip().split()
-            if len(parts) >= 2:
-                # move first token (last name) to the end
-                creator_name = " ".join(parts[1:] + parts[:1])
-            else:
-                creator_name = cn.strip()
-    except Exception:
-        creator_name = None
+    # session ldap_username / cn, resolved through project_ownership (PDL or creator)
+    owner_keys = session_owner_keys(request.session)
 
-    # If neither ldap_username nor creator_name present, return empty list (no projects)
-    if not ldap_username and not creator_name:
+    # If neither ldap_username nor cn present, return empty list (no projects)
+    if not owner_keys:
         return render(request, "projects/project_list.html", {"projects": []})
 
     conn = get_connection()
     cur = conn.cursor(dictionary=True)
     projects = []
     try:
-        # Build a safe SQL that selects projects satisfying either condition.
-        # Use parameter placeholders for both ldap_username and creator_name.
-        # We use LEFT JOIN with prism_wbs and GROUP BY project to avoid duplicates.
-        sql = """
-            SELECT DISTINCT p.id, p.name, p.oem_name, p.description,
+        owned_sql, params = owned_subquery(owner_keys, "project_id")
+        sql = f"""
+            SELECT p.id, p.name, p.oem_name, p.description,
                    p.start_date, p.end_date, p.pdl_user_id, p.pdl_name,
                    p.pm_user_id, p.pm_name, p.created_at
             FROM projects p
-            LEFT JOIN prism_wbs w ON w.project_id = p.id
-            WHERE 1=0
+            WHERE p.id IN ({owned_sql})
+            ORDER BY p.created_at DESC
         """
-        params = []
-
-        if ldap_username:
-            sql += " OR (p.pdl_user_id = %s)"
-            params.append(ldap_username)
-
-        if creator_name:
-            # match prism_wbs.creator exactly to converted creator name
-            sql += " OR (w.creator = %s)"
-            params.append(creator_name)
-
-        sql += " ORDER BY p.created_at DESC"
 
         cur.execute(sql, tuple(params))
         rows = cur.fetchall() or []
@@ -756,13 +779,7 @@ def project_list(request):
     return render(request, "projects/project_list.html", {"projects": projects})
 
 def _get_all_coes():
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
-    try:
-        cur.execute("SELECT id, name FROM coes ORDER BY name")
-        return cur.fetchall()
-    finally:
-        cur.close(); conn.close()
+    return [dict(c) for c in get_coes()]
 
 def _assign_coes_to_project(project_id, coe_ids):
     """
@@ -802,6 +819,7 @@ def _replace_project_coes(project_id, coe_ids):
         conn.commit()
     finally:
         cur.close(); conn.close()
+    bump_refdata_version()
 
 @require_POST
 def delete_project(request, project_id):
@@ -812,6 +830,7 @@ def delete_project(request, project_id):
         conn.commit()
     finally:
         cur.close(); conn.close()
+    bump_refdata_version()
     return redirect(reverse("projects:list"))
 
 @require_POST
@@ -845,6 +864,7 @@ def create_coe(request):
             cur2.execute("INSERT INTO coes (name, leader_user_id, description) VALUES (%s, %s, %s)",
                          (name, leader_user_id, description))
             conn2.commit()
+            bump_refdata_version()
         except IntegrityError as e:
             logger.warning("create_coe IntegrityError: %s", e)
             if request.headers.get("x-requested-with") == "XMLHttpRequest":
@@ -877,6 +897,7 @@ def edit_coe(request, coe_id):
             cur.execute("UPDATE coes SET name=%s, leader_user_id=%s, description=%s WHERE id=%s",
                         (name, leader_user_id, description, coe_id))
             conn.commit()
+            bump_refdata_version()
         except IntegrityError as e:
             logger.warning("edit_coe IntegrityError: %s", e)
             if request.headers.get("x-requested-with") == "XMLHttpRequest":
@@ -925,6 +946,7 @@ def create_domain(request):
             cur2.execute("INSERT INTO domains (coe_id, name, lead_user_id) VALUES (%s, %s, %s)",
                          (coe_id_int if coe_id_int else None, name, lead_user_id))
             conn2.commit()
+            bump_refdata_version()
         except IntegrityError as e:
             logger.warning("create_domain IntegrityError: %s", e)
             if request.headers.get("x-requested-with") == "XMLHttpRequest":
@@ -962,6 +984,7 @@ def edit_domain(request, domain_id):
             cur.execute("UPDATE domains SET coe_id=%s, name=%s, lead_user_id=%s WHERE id=%s",
                         (coe_id_int if coe_id_int else None, name, lead_user_id, domain_id))
             conn.commit()
+            bump_refdata_version()
         except IntegrityError as e:
             logger.warning("edit_domain IntegrityError: %s", e)
             if request.headers.get("x-requested-with") == "XMLHttpRequest":
@@ -1118,13 +1141,7 @@ def ldap_search_server(request):
     return JsonResponse({"results": results})
 
 def _get_all_projects(limit=200):
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
-    try:
-        cur.execute("SELECT id, name FROM projects ORDER BY created_at DESC LIMIT %s", (limit,))
-        return cur.fetchall()
-    finally:
-        cur.close(); conn.close()
+    return [dict(p) for p in get_projects(limit)]
 
 def _get_project_coe_ids(project_id):
     conn = get_connection()
@@ -1149,13 +1166,7 @@ def create_project(request):
             users = _fetch_users()
             coes = _get_all_coes()
             projects = _get_all_projects()
-            conn = get_connection()
-            cur = conn.cursor(dictionary=True)
-            try:
-                cur.execute("SELECT id, name, coe_id FROM domains ORDER BY name")
-                domains = cur.fetchall()
-            finally:
-                cur.close(); conn.close()
+            domains = get_domains()
             return render(request, "projects/create_project.html", {
                 "users": users, "coes": coes, "projects": projects, "domains": domains, "error": "Project name is required."
             })
@@ -1187,10 +1198,12 @@ def create_project(request):
                 "INSERT INTO projects (name, description, start_date, end_date, pdl_user_id) VALUES (%s, %s, %s, %s, %s)",
                 (name, desc or None, start_date, end_date, pdl_user_id)
             )
-            conn.commit()
             project_id = cur.lastrowid
+            rebuild_project_ownership(cur, [project_id])
+            conn.commit()
         finally:
             cur.close(); conn.close()
+        bump_refdata_version()
 
         try:
             int_coe_ids = [int(x) for x in mapped_coe_ids if x]
@@ -1206,13 +1219,7 @@ def create_project(request):
     users = _fetch_users()
     coes = _get_all_coes()
     projects = _get_all_projects()
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
-    try:
-        cur.execute("SELECT id, name, coe_id FROM domains ORDER BY name")
-        domains = cur.fetchall()
-    finally:
-        cur.close(); conn.close()
+    domains = get_domains()
 
     return render(request, "projects/create_project.html", {
         "users": users, "coes": coes, "projects": projects, "domains": domains
@@ -1226,41 +1233,29 @@ def edit_project(request, project_id=None):
         start_date, end_date, description.
       - Uses LDAP helper get_user_entry_by_username(...) to populate CN (pdl_name/pm_name).
     """
-    session_cn = request.session.get("cn", "").strip()  # e.g. "DEO Sant Anurag"
     session_ldap = request.session.get("ldap_username")
     session_pwd = request.session.get("ldap_password")
     creds = (session_ldap, session_pwd) if session_ldap and session_pwd else None
 
-    # helper to turn "DEO Sant Anurag" -> "Sant Anurag DEO"
-    def cn_to_creator(cn: str):
-        if not cn:
-            return ""
-        parts = cn.split()
-        if len(parts) >= 2:
-            # last name is first token, rest are given names
-            return " ".join(parts[1:]) + " " + parts[0]
-        return cn
-
-    # fetch projects where this session user is creator in prism_wbs
+    # fetch projects where this session user is creator in prism_wbs (via project_ownership)
     editable_projects = []
+    owner_keys = session_owner_keys(request.session)
     try:
-        creator_name = cn_to_creator(session_cn)
+        owned_sql, owned_params = owned_subquery(owner_keys, "project_id", roles=[ROLE_CREATOR])
         conn = get_connection()
         cur = conn.cursor(dictionary=True)
         try:
-            # join prism_wbs -> projects to list unique projects where creator matches
-            cur.execute("""
-                SELECT DISTINCT p.id, p.name
-                FROM prism_wbs pw
-                JOIN projects p ON pw.project_id = p.id
-                WHERE TRIM(pw.creator) = %s
+            cur.execute(f"""
+                SELECT p.id, p.name
+                FROM projects p
+                WHERE p.id IN ({owned_sql})
                 ORDER BY p.name
-            """, (creator_name,))
+            """, tuple(owned_params))
             editable_projects = cur.fetchall() or []
         finally:
             cur.close(); conn.close()
     except Exception:
-        logger.exception("Failed to fetch editable projects for creator=%s", creator_name)
+        logger.exception("Failed to fetch editable projects for owner keys=%s", owner_keys)
         editable_projects = []
 
     # POST: save edits
@@ -1402,6 +1397,7 @@ def edit_project(request, project_id=None):
                         description=%s
                     WHERE id=%s
                 """, (oem_name, pdl_user_id_db, pdl_name_val, pm_user_id_db, pm_name_val, start_date, end_date, description, form_project_id))
+                rebuild_project_ownership(cur, [form_project_id])
                 conn.commit()
             finally:
                 cur.close(); conn.close()
@@ -1458,7 +1454,7 @@ def map_coes(request):
         pdl_username = request.POST.get("pdl_username") or None
         pdl_user_id = None
         if pdl_username:
-            pdl_user_id = _ensure_user_from_ldap(request.pdl_username)
+            pdl_user_id = _ensure_user_from_ldap(request, pdl_username)
 
         conn = get_connection()
         cur = conn.cursor()
@@ -1468,10 +1464,12 @@ def map_coes(request):
                 "INSERT INTO projects (name, description, start_date, end_date, pdl_user_id) VALUES (%s, %s, %s, %s, %s)",
                 (name, desc or None, start_date, end_date, pdl_user_id)
             )
-            conn.commit()
             project_id = cur.lastrowid
+            rebuild_project_ownership(cur, [project_id])
+            conn.commit()
         finally:
             cur.close(); conn.close()
+        bump_refdata_version()
 
         if project_id:
             _replace_project_coes(project_id, coe_ids)
@@ -1496,14 +1494,7 @@ def api_coes(request):
 @require_GET
 def api_projects(request):
     projects = _get_all_projects()
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
-    try:
-        cur.execute("SELECT project_id, COUNT(*) as cnt FROM project_coes GROUP BY project_id")
-        rows = cur.fetchall()
-        counts = {r['project_id']: r['cnt'] for r in rows} if rows else {}
-    finally:
-        cur.close(); conn.close()
+    counts = get_project_coe_counts()
     for p in projects:
         p['mapped_coe_count'] = counts.get(p['id'], 0)
     return JsonResponse({"projects": projects})
@@ -1675,6 +1666,164 @@ def get_allocations_for_iom(request):
     return JsonResponse({"ok": True, "saved_items": saved_items, "billing_start": billing_start.strftime("%Y-%m-%d")})
 
 
+def _allocation_user_key(user_ldap):
+    """Normalised user key; mirrors the generated monthly_allocation_entries.user_key column."""
+    return (user_ldap or "").strip().lower()
+
+
+def _hours_decimal(value):
+    try:
+        return Decimal(str(value or 0)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    except Exception:
+        return Decimal("0.00")
+
+
+def _diff_allocation_entries(existing_rows, items, legacy_rows=()):
+    """
+    Compare saved rows against the submitted grid.
+
+    existing_rows: iterable of (id, iom_id, user_key, total_hours) for the IOMs in the payload.
+    items: payload dicts with iom_id, user_ldap, total_hours. Items missing either
+    key are ignored; a repeated (iom, user) pair keeps the last value.
+    legacy_rows: iterable of (id, user_key, total_hours) backfilled legacy rows
+    (iom_id NULL) of the same project and month, in id order.
+
+    Returns {"inserts": [(iom_id, user_ldap, hours)], "updates": [(id, iom_id, user_ldap, old, new)],
+    "deletes": [(id, iom_id, user_key, old)], "adopts": [(legacy_id, iom_id, user_ldap, old, new)],
+    "retires": [(legacy_id, into_id, user_key, old)]}. Every IOM present in the
+    payload is replaced as a whole, so saved users missing from it are deleted.
+    A user's legacy rows are superseded once the grid gives them an IOM row: the
+    first insert adopts a legacy row (same id, so its weekly rows and punches
+    stay) and the user's other legacy rows are retired into their kept row.
+    """
+    desired = {}
+    for it in items:
+        iom_id = it.get("iom_id")
+        user_ldap = (it.get("user_ldap") or "").strip()
+        if not iom_id or not user_ldap:
+            continue
+        desired[(str(iom_id), _allocation_user_key(user_ldap))] = (str(iom_id), user_ldap, _hours_decimal(it.get("total_hours")))
+
+    existing = {}
+    for row_id, iom_id, user_key, total_hours in existing_rows:
+        existing[(str(iom_id), _allocation_user_key(user_key))] = (row_id, _hours_decimal(total_hours))
+
+    inserts, updates, deletes = [], [], []
+    for key, (iom_id, user_ldap, hours) in desired.items():
+        current = existing.get(key)
+        if current is None:
+            inserts.append((iom_id, user_ldap, hours))
+        elif current[1] != hours:
+            updates.append((current[0], iom_id, user_ldap, current[1], hours))
+    for key, (row_id, hours) in existing.items():
+        if key not in desired:
+            deletes.append((row_id, key[0], key[1], hours))
+
+    legacy = {}
+    for row_id, user_key, total_hours in legacy_rows:
+        legacy.setdefault(_allocation_user_key(user_key), []).append((row_id, _hours_decimal(total_hours)))
+    adopts, retires = [], []
+    if legacy:
+        kept_ids = {}
+        for key, (row_id, _hours) in existing.items():
+            if key in desired:
+                kept_ids.setdefault(key[1], row_id)
+        remaining = []
+        for iom_id, user_ldap, hours in inserts:
+            key = _allocation_user_key(user_ldap)
+            if legacy.get(key) and key not in kept_ids:
+                legacy_id, old = legacy[key].pop(0)
+                adopts.append((legacy_id, iom_id, user_ldap, old, hours))
+                kept_ids[key] = legacy_id
+            else:
+                remaining.append((iom_id, user_ldap, hours))
+        inserts = remaining
+        for key, rows in legacy.items():
+            if key in kept_ids:
+                retires.extend((legacy_id, kept_ids[key], key, old) for legacy_id, old in rows)
+    return {"inserts": inserts, "updates": updates, "deletes": deletes, "adopts": adopts, "retires": retires}
+
+
+def _save_allocation_diff(cur, project_id, billing_start, items):
+    """
+    Apply the payload for (project, billing_start) with one multi-row INSERT, one
+    UPDATE by id (CASE id ... per changed row) and one DELETE by id; legacy rows
+    (iom_id NULL) of the payload's users are adopted (same UPDATE) or retired in
+    the same transaction so their hours are not counted twice.
+    Must run inside a transaction; the current rows are locked with FOR UPDATE so
+    concurrent saves serialise per IOM. Returns the diff (see _diff_allocation_entries).
+    """
+    iom_ids = sorted({str(it.get("iom_id")) for it in items if it.get("iom_id")})
+    if not iom_ids:
+        return {"inserts": [], "updates": [], "deletes": [], "adopts": [], "retires": []}
+
+    in_sql, in_params = _sql_in_clause(iom_ids)
+    cur.execute(f"""
+        SELECT id, iom_id, user_key, total_hours
+        FROM monthly_allocation_entries
+        WHERE project_id=%s AND month_start=%s AND iom_id IN {in_sql}
+        ORDER BY id
+        FOR UPDATE
+    """, [project_id, billing_start] + in_params)
+    existing_rows = cur.fetchall() or []
+
+    user_keys = sorted({_allocation_user_key(it.get("user_ldap")) for it in items
+                        if it.get("iom_id") and _allocation_user_key(it.get("user_ldap"))})
+    legacy_rows = []
+    if user_keys:
+        key_sql, key_params = _sql_in_clause(user_keys)
+        cur.execute(f"""
+            SELECT id, user_key, total_hours
+            FROM monthly_allocation_entries
+            WHERE project_id=%s AND month_start=%s AND iom_id IS NULL
+              AND legacy_item_id IS NOT NULL AND user_key IN {key_sql}
+            ORDER BY id
+            FOR UPDATE
+        """, [project_id, billing_start] + key_params)
+        legacy_rows = cur.fetchall() or []
+    diff = _diff_allocation_entries(existing_rows, items, legacy_rows)
+
+    # rows whose ids are known and locked: one UPDATE .. CASE id, since an
+    # INSERT .. ON DUPLICATE KEY UPDATE would reserve an auto-increment id per row
+    changed = [(row_id, hours) for row_id, _iom_id, _user_ldap, _old, hours in diff["updates"] + diff["adopts"]]
+    if changed:
+        sets = ["total_hours = CASE id " + " ".join(["WHEN %s THEN %s"] * len(changed)) + " END"]
+        params = [v for pair in changed for v in pair]
+        if diff["adopts"]:
+            adopt_case = " ".join(["WHEN %s THEN %s"] * len(diff["adopts"]))
+            sets.append(f"iom_id = CASE id {adopt_case} ELSE iom_id END")
+            sets.append(f"user_ldap = CASE id {adopt_case} ELSE user_ldap END")
+            params += [v for legacy_id, iom_id, _user, _old, _new in diff["adopts"] for v in (legacy_id, iom_id)]
+            params += [v for legacy_id, _iom, user_ldap, _old, _new in diff["adopts"] for v in (legacy_id, user_ldap)]
+        id_sql, id_params = _sql_in_clause([row_id for row_id, _hours in changed])
+        cur.execute(f"UPDATE monthly_allocation_entries SET {', '.join(sets)} WHERE id IN {id_sql}",
+                    params + id_params)
+
+    if diff["retires"]:
+        for legacy_id, into_id, _key, _old in diff["retires"]:
+            merge_allocation_children(cur, legacy_id, into_id)
+        ret_sql, ret_params = _sql_in_clause([r[0] for r in diff["retires"]])
+        cur.execute(f"DELETE FROM {TOTALS_TABLE} WHERE allocation_id IN {ret_sql}", ret_params)
+        cur.execute(f"DELETE FROM monthly_allocation_entries WHERE id IN {ret_sql}", ret_params)
+        refresh_week_totals(cur, sorted({r[1] for r in diff["retires"]}))
+
+    if diff["inserts"]:
+        params = []
+        for iom_id, user_ldap, hours in diff["inserts"]:
+            params.extend([project_id, iom_id, billing_start, user_ldap, hours])
+        cur.execute(
+            "INSERT INTO monthly_allocation_entries (project_id, iom_id, month_start, user_ldap, total_hours) VALUES "
+            + ",".join(["(%s, %s, %s, %s, %s)"] * len(diff["inserts"])),
+            params,
+        )
+
+    if diff["deletes"]:
+        del_sql, del_params = _sql_in_clause([d[0] for d in diff["deletes"]])
+        cur.execute(f"DELETE FROM monthly_allocation_entries WHERE id IN {del_sql}", del_params)
+
+    return diff
+
+
 @require_POST
 def save_monthly_allocations(request):
     # (existing parsing code for JSON/form remains — I'm showing the core saving + response part)
@@ -1743,34 +1892,13 @@ def save_monthly_allocations(request):
         if not project_id or items is None:
             return JsonResponse({"ok": False, "error": "project_id and items required"}, status=400)
 
-        # persist: delete/replace existing rows for this project+iom+month_start then upsert
-        # we will group by iom_id to minimize DB roundtrips
+        # persist as a diff against the current rows: unchanged rows (and their
+        # weekly_allocations / user_punches children) are left untouched
         with transaction.atomic():
             with connection.cursor() as cur:
-                # for simplicity: delete entries for each involved iom_id for given project and month_start,
-                # then insert provided items anew
-                iom_ids = sorted(set([it.get("iom_id") for it in items if it.get("iom_id")]))
-                if iom_ids:
-                    for iom_id in iom_ids:
-                        cur.execute("""
-                            DELETE FROM monthly_allocation_entries
-                            WHERE project_id=%s AND iom_id=%s AND month_start=%s
-                        """, [project_id, iom_id, billing_start])
-
-                # insert each item
-                for it in items:
-                    iom_id = it.get("iom_id")
-                    user_ldap = (it.get("user_ldap") or "").strip()
-                    try:
-                        total_hours = float(it.get("total_hours") or 0.0)
-                    except Exception:
-                        total_hours = 0.0
-                    if not iom_id or not user_ldap:
-                        continue
-                    cur.execute("""
-                        INSERT INTO monthly_allocation_entries (project_id, iom_id, month_start, user_ldap, total_hours, created_at)
-                        VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-                    """, [project_id, iom_id, billing_start, user_ldap, total_hours])
+                changes = _save_allocation_diff(cur, project_id, billing_start, items)
+                apply_allocation_deltas(cur, billing_start, allocation_deltas(changes))
+                apply_iom_deltas(cur, billing_start, iom_allocation_deltas(changes))
 
         # after commit, read back saved rows for the canonical billing_start and compute fte
         saved_items = []
@@ -1797,7 +1925,12 @@ def save_monthly_allocations(request):
             fte = round(float(fte), 4)
             saved_items.append({"user_ldap": user_ldap, "total_hours": total_hours, "fte": fte})
 
-        return JsonResponse({"ok": True, "saved_items": saved_items, "billing_start": billing_start.strftime("%Y-%m-%d")})
+        return JsonResponse({
+            "ok": True,
+            "saved_items": saved_items,
+            "billing_start": billing_start.strftime("%Y-%m-%d"),
+            "changes": {k: len(v) for k, v in changes.items()},
+        })
 
     except Exception as exc:
         logger.exception("save_monthly_allocations failed: %s", exc)
@@ -1865,45 +1998,17 @@ def is_pdl_user(ldap_entry):
 
 # ---- Main view ---------------------------------------------------------
 
-def team_allocations(request):
+def _team_reportee_ldaps(session_ldap, creds):
     """
-    Team Allocation page (billing-period aware). Uses get_billing_period(year, month)
-    when `month` query param provided (YYYY-MM). If no monthly_hours_limit entry exists
-    it falls back to calendar month. Builds rows from monthly_allocation_entries where
-    mae.month_start = billing_start (canonical).
+    Reportee identities (userPrincipalName/mail/sAMAccountName) of the session user
+    from LDAP, plus the user themselves when they are a PDL. None when the user's
+    own LDAP entry cannot be found.
     """
-    # SINGLE source of truth for LDAP username/password from session
-    session_ldap = request.session.get("ldap_username")
-    session_pwd = request.session.get("ldap_password")
-    print("team_allocations - session_ldap: ", session_ldap)
-    logger.debug("team_allocations - session_ldap: %s", session_ldap)
-
-    # require login
-    if not request.session.get("is_authenticated"):
-        return redirect("accounts:login")
-    creds = (session_ldap, session_pwd)
-
-    # --- month param parsing (use YYYY-MM) ---
-    month_str = request.GET.get("month")
-    if month_str:
-        try:
-            year, mon = map(int, month_str.split("-"))
-            month_start, month_end = get_billing_period(year, mon)
-        except Exception:
-            logger.exception("team_allocations: invalid month param '%s'", month_str)
-            today = date.today()
-            month_start, month_end = get_billing_period(today.year, today.month)
-
-    else:
-        # default - current month billing period fallback
-        today = date.today()
-        month_start, month_end = get_billing_period(today.year, today.month)
-
     # --- get LDAP user entry -----------------------------------------------------
     user_entry = get_user_entry_by_username(session_ldap, username_password_for_conn=creds)
     if not user_entry:
         logger.warning("team_allocations: user_entry not found for %s", session_ldap)
-        return redirect("accounts:login")
+        return None
 
     # --- get reportees via LDAP --------------------------------------------------
     reportees_entries = get_reportees_for_user_dn(getattr(user_entry, "entry_dn", None),
@@ -1927,125 +2032,225 @@ def team_allocations(request):
                 logger.debug("team_allocations: user is PDL, added own ldap to reportees list")
     except Exception:
         logger.exception("team_allocations: error checking PDL role for %s", session_ldap)
+    return reportees_ldaps
 
-    rows = []
-    if reportees_ldaps:
-        in_clause, in_params = _sql_in_clause(reportees_ldaps)
-        sql = f"""
-            SELECT mae.id AS item_id,
-                   mae.id AS allocation_id,
-                   mae.user_ldap,
-                   u.username, u.email,
-                   p.name AS project_name,
-                   pw.department AS domain_name,
-                   COALESCE(mae.total_hours, 0.00) AS total_hours
-            FROM monthly_allocation_entries mae
-            LEFT JOIN users u ON u.email = mae.user_ldap
-            LEFT JOIN projects p ON mae.project_id = p.id
-            LEFT JOIN prism_wbs pw ON mae.iom_id = pw.iom_id
-            WHERE mae.month_start = %s
-              AND mae.user_ldap IN {in_clause}
-            ORDER BY u.username, p.name
-        """
-        params = [month_start] + in_params
-        try:
-            with connection.cursor() as cur:
-                cur.execute(sql, params)
-                rows = dictfetchall(cur) or []
-                logger.debug("team_allocations: fetched %d allocation rows", len(rows))
-        except Exception as exc:
-            logger.exception("team_allocations: DB query failed: %s", exc)
-            rows = []
-    else:
-        logger.debug("team_allocations: no reportees to fetch for %s", session_ldap)
 
-    # deduplicate and attach weekly allocations as before (existing code)
-    dedup = {}
-    for r in rows:
-        key = r.get("item_id") or (r.get("allocation_id"), r.get("user_ldap"), r.get("project_name"))
-        if key not in dedup:
-            dedup[key] = r
-    all_rows = list(dedup.values())
+TEAM_REPORTEES_SESSION_KEY = "team_reportees"
+TEAM_API_MAX_PAGE_SIZE = 200
 
-    allocation_ids = list({r["allocation_id"] for r in all_rows if r.get("allocation_id")})
-    weekly_map = {}
-    if allocation_ids:
-        in_clause, in_params = _sql_in_clause(allocation_ids)
-        sql = f"""
-            SELECT allocation_id, week_number, percent, hours, status
-            FROM weekly_allocations
-            WHERE allocation_id IN {in_clause}
-        """
-        try:
-            with connection.cursor() as cur:
-                cur.execute(sql, in_params)
-                for r in dictfetchall(cur) or []:
-                    try:
-                        alloc = r.get("allocation_id")
-                        wk = int(r.get("week_number") or 0)
-                        pct = float(r.get("percent") or 0.0)
-                        hrs_raw = r.get("hours") or 0.0
-                        try:
-                            hrs = float(hrs_raw)
-                        except Exception:
-                            hrs = 0.0
-                        status = r.get("status") or ""
-                        if alloc is None or wk <= 0:
-                            continue
-                        weekly_map.setdefault(alloc, {})[wk] = {"percent": pct, "hours": hrs, "status": status}
-                    except Exception:
-                        logger.exception("team_allocations: bad weekly row %r", r)
-        except Exception as exc:
-            logger.exception("team_allocations: weekly allocations query failed: %s", exc)
-            weekly_map = {}
-
-    # attach weekly attrs and compute display_name
-    for r in all_rows:
-        aid = r.get("allocation_id")
-        wk = weekly_map.get(aid, {})
-        r["w1"] = wk.get(1, {}).get("percent", 0)
-        r["w2"] = wk.get(2, {}).get("percent", 0)
-        r["w3"] = wk.get(3, {}).get("percent", 0)
-        r["w4"] = wk.get(4, {}).get("percent", 0)
-        r["s1"] = wk.get(1, {}).get("status", "")
-        r["s2"] = wk.get(2, {}).get("status", "")
-        r["s3"] = wk.get(3, {}).get("status", "")
-        r["s4"] = wk.get(4, {}).get("status", "")
-
-        display = (r.get("username") or r.get("user_ldap") or "")
-        if r.get("email"):
-            display += f" <{r['email']}>"
-        r["display_name"] = display
-
-    # Determine reportees with no allocations
-    allocated_ldaps = {(r.get("user_ldap") or "").strip().lower() for r in all_rows if (r.get("user_ldap") or "").strip()}
-    reportees_no_alloc = []
-    try:
-        for ld in reportees_ldaps:
-            key = (ld or "").strip()
-            if not key:
-                continue
-            if key.lower() not in allocated_ldaps:
-                local = _get_local_ldap_entry(key)
-                display_name = local.get("cn") if local and local.get("cn") else (local.get("username") if local else "")
-                email_val = local.get("email") if local and local.get("email") else (key if "@" in key else "")
-                reportees_no_alloc.append({
-                    "ldap": key,
-                    "display": display_name,
-                    "email": email_val
-                })
+# sort name -> SQL expression; every order ends with mae.id so the keyset is unique
+_TEAM_SORTS = {
+    "person": "mae.user_key",
+    "project": "COALESCE(p.name, '')",
+    "hours": "mae.total_hours",
+}
+
+
+def _session_team_reportees(request, session_ldap, creds):
+    """
+    _team_reportee_ldaps cached in the session for TEAM_REPORTEES_CACHE_TTL
+    seconds, so paging and filtering the team view does not repeat the LDAP walk.
+    """
+    try:
+        ttl = float(getattr(settings, "TEAM_REPORTEES_CACHE_TTL", 900))
+    except (TypeError, ValueError):
+        ttl = 900.0
+    cached = request.session.get(TEAM_REPORTEES_SESSION_KEY)
+    now = time.time()
+    if cached and cached.get("for") == session_ldap and now - float(cached.get("at") or 0) < ttl:
+        return list(cached.get("ldaps") or [])
+    reportees = _team_reportee_ldaps(session_ldap, creds)
+    if reportees is not None:
+        request.session[TEAM_REPORTEES_SESSION_KEY] = {"for": session_ldap, "at": now, "ldaps": reportees}
+    return reportees
+
+
+def _encode_team_cursor(sort_value, row_id):
+    raw = json.dumps([sort_value, row_id], default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_team_cursor(cursor):
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        return sort_value, int(row_id)
     except Exception:
-        logger.exception("team_allocations: error building reportees_no_alloc")
-        reportees_no_alloc = []
+        return None
 
+
+def team_allocations(request):
+    """
+    Team Allocation page (billing-period aware). Renders the page shell for the
+    billing period of ?month=YYYY-MM; rows are loaded page by page from
+    team_allocations_api, so the first screen does not wait for the whole team.
+    """
+    if not request.session.get("is_authenticated"):
+        return redirect("accounts:login")
+    month_start, _month_end = _resolve_export_period(request.GET.get("month"), None)
     return render(request, "projects/team_allocations.html", {
-        "rows": all_rows,
-        "weekly_map": weekly_map,
         "month_start": month_start,
-        "reportees": reportees_ldaps,
-        "reportees_no_alloc": reportees_no_alloc,
+        "page_size": int(getattr(settings, "TEAM_API_PAGE_SIZE", 50)),
     })
 
+
+@require_GET
+def team_allocations_api(request):
+    """
+    JSON page of the team's allocations for a billing period.
+
+    Query params:
+        month        YYYY-MM (current billing period by default)
+        person       substring of the reportee identity
+        project      project id, or substring of the project name
+        week, status weekly_allocations filter (status in any week when week is omitted;
+                     week alone keeps rows with hours in that week)
+        sort         person | project | hours (default person), dir asc | desc
+        limit        page size (TEAM_API_PAGE_SIZE default, at most TEAM_API_MAX_PAGE_SIZE)
+        cursor       next_cursor of the previous page
+
+    Pages are keyset-paginated on (sort column, mae.id). The reportee list is
+    cached in the session; names are read with one batched ldap_directory query
+    per page. The first page also lists reportees without allocations.
+    """
+    session_ldap = request.session.get("ldap_username")
+    if not request.session.get("is_authenticated") or not session_ldap:
+        return JsonResponse({"ok": False, "error": "Not authenticated"}, status=403)
+    creds = (session_ldap, request.session.get("ldap_password"))
+
+    month_start, _month_end = _resolve_export_period(request.GET.get("month"), None)
+    reportees = _session_team_reportees(request, session_ldap, creds)
+    if reportees is None:
+        return JsonResponse({"ok": False, "error": "LDAP entry not found"}, status=403)
+    keys = sorted({_allocation_user_key(r) for r in reportees if _allocation_user_key(r)})
+
+    sort = request.GET.get("sort") or "person"
+    if sort not in _TEAM_SORTS:
+        return JsonResponse({"ok": False, "error": "sort must be one of " + ", ".join(_TEAM_SORTS)}, status=400)
+    descending = (request.GET.get("dir") or "asc").lower() == "desc"
+    try:
+        limit = int(request.GET.get("limit") or getattr(settings, "TEAM_API_PAGE_SIZE", 50))
+        week = int(request.GET["week"]) if request.GET.get("week") else None
+    except ValueError:
+        return JsonResponse({"ok": False, "error": "limit and week must be integers"}, status=400)
+    limit = max(1, min(limit, TEAM_API_MAX_PAGE_SIZE))
+    if week is not None and week not in (1, 2, 3, 4):
+        return JsonResponse({"ok": False, "error": "week must be 1-4"}, status=400)
+    status_filter = (request.GET.get("status") or "").strip().upper()
+    status_filter = _WEEK_STATUS_ALIASES.get(status_filter, status_filter)
+    person = (request.GET.get("person") or "").strip().lower()
+    project = (request.GET.get("project") or "").strip()
+    cursor = request.GET.get("cursor")
+    after = _decode_team_cursor(cursor) if cursor else None
+    if cursor and after is None:
+        return JsonResponse({"ok": False, "error": "Invalid cursor"}, status=400)
+
+    payload = {"ok": True, "month_start": month_start.isoformat(), "rows": [], "next_cursor": None,
+               "total_reportees": len(keys)}
+    if not keys:
+        return JsonResponse(payload)
+
+    in_sql, in_params = _sql_in_clause(keys)
+    where, params = ["mae.month_start = %s", f"mae.user_key IN {in_sql}"], [month_start] + in_params
+    if person:
+        where.append("mae.user_key LIKE %s")
+        params.append(f"%{person}%")
+    if project:
+        if project.isdigit():
+            where.append("mae.project_id = %s")
+            params.append(int(project))
+        else:
+            where.append("p.name LIKE %s")
+            params.append(f"%{project}%")
+    if status_filter or week is not None:
+        cond, cond_params = ["wf.allocation_id = mae.id"], []
+        if week is not None:
+            cond.append("wf.week_number = %s")
+            cond_params.append(week)
+        if status_filter:
+            cond.append("wf.status = %s")
+            cond_params.append(status_filter)
+        else:
+            cond.append("wf.hours > 0")
+        where.append(f"EXISTS (SELECT 1 FROM weekly_allocations wf WHERE {' AND '.join(cond)})")
+        params += cond_params
+
+    sort_sql = _TEAM_SORTS[sort]
+    op, direction = ("<", "DESC") if descending else (">", "ASC")
+    if after:
+        where.append(f"({sort_sql} {op} %s OR ({sort_sql} = %s AND mae.id {op} %s))")
+        params += [after[0], after[0], after[1]]
+
+    sql = f"""
+        SELECT mae.id AS allocation_id, mae.user_ldap, mae.user_key, mae.project_id,
+               p.name AS project_name, mae.iom_id, pw.department AS domain_name,
+               COALESCE(mae.total_hours, 0.00) AS total_hours, {sort_sql} AS sort_value
+        FROM monthly_allocation_entries mae
+        LEFT JOIN projects p ON mae.project_id = p.id
+        LEFT JOIN prism_wbs pw ON mae.iom_id = pw.iom_id
+        WHERE {' AND '.join(where)}
+        ORDER BY {sort_sql} {direction}, mae.id {direction}
+        LIMIT %s
+    """
+    try:
+        with connection.cursor() as cur:
+            cur.execute(sql, params + [limit + 1])
+            rows = dictfetchall(cur)
+
+            page, more = rows[:limit], len(rows) > limit
+            weekly = {}
+            if page:
+                id_sql, id_params = _sql_in_clause([r["allocation_id"] for r in page])
+                cur.execute(f"""
+                    SELECT allocation_id, week_number, percent, hours, status
+                    FROM weekly_allocations
+                    WHERE allocation_id IN {id_sql}
+                """, id_params)
+                for aid, wk, pct, hrs, st in cur.fetchall():
+                    weekly.setdefault(aid, {})[int(wk)] = {
+                        "percent": format(Decimal(str(pct or "0.00")), "0.2f"),
+                        "hours": format(Decimal(str(hrs or "0.00")), "0.2f"),
+                        "status": st or "",
+                    }
+
+            unallocated = []
+            if not cursor:
+                cur.execute(f"""
+                    SELECT DISTINCT user_key FROM monthly_allocation_entries
+                    WHERE month_start = %s AND user_key IN {in_sql}
+                """, [month_start] + in_params)
+                allocated = {r[0] for r in cur.fetchall()}
+                unallocated = [k for k in keys if k not in allocated]
+    except Exception as exc:
+        logger.exception("team_allocations_api: query failed: %s", exc)
+        return JsonResponse({"ok": False, "error": str(exc)}, status=500)
+
+    directory = _ldap_directory_entries([r["user_key"] for r in page] + unallocated)
+    for r in page:
+        entry = directory.get(r["user_key"]) or {}
+        payload["rows"].append({
+            "allocation_id": r["allocation_id"],
+            "user_ldap": r["user_ldap"],
+            "display_name": entry.get("cn") or entry.get("username") or r["user_ldap"],
+            "email": entry.get("email") or "",
+            "project_id": r["project_id"],
+            "project_name": r["project_name"],
+            "iom_id": r["iom_id"],
+            "domain_name": r["domain_name"],
+            "total_hours": format(Decimal(str(r["total_hours"])), "0.2f"),
+            "weeks": {str(wk): weekly.get(r["allocation_id"], {}).get(wk, {"percent": "0.00", "hours": "0.00", "status": ""})
+                      for wk in (1, 2, 3, 4)},
+        })
+    if more:
+        last = page[-1]
+        payload["next_cursor"] = _encode_team_cursor(last["sort_value"], last["allocation_id"])
+    if not cursor:
+        payload["unallocated"] = [{
+            "ldap": k,
+            "display": (directory.get(k) or {}).get("cn") or (directory.get(k) or {}).get("username") or "",
+            "email": (directory.get(k) or {}).get("email") or (k if "@" in k else ""),
+        } for k in unallocated]
+    return JsonResponse(payload)
+
 # -------------------------
 # save_team_allocation
 # -------------------------
@@ -2140,6 +2345,165 @@ def save_team_allocation(request):
 
     return JsonResponse({"ok": True, "allocation_id": allocation_id, "weeks": result_weeks})
 
+
+BULK_WEEK_MAX_CHANGES = 2000
+_WEEK_STATUS_ALIASES = {
+    "PENDING": "PENDING",
+    "ACCEPT": "ACCEPTED", "ACCEPTED": "ACCEPTED",
+    "REJECT": "REJECTED", "REJECTED": "REJECTED",
+}
+
+
+def _parse_bulk_week_changes(changes):
+    """
+    {(allocation_id, week): {"percent": Decimal?, "status": str?}} from the request
+    list (later entries for the same cell win), or an error string.
+    """
+    if not isinstance(changes, list) or not changes:
+        return "changes must be a non-empty list"
+    if len(changes) > BULK_WEEK_MAX_CHANGES:
+        return f"at most {BULK_WEEK_MAX_CHANGES} changes per request"
+    cells = {}
+    for ch in changes:
+        if not isinstance(ch, dict):
+            return "each change must be an object"
+        try:
+            allocation_id = int(ch.get("allocation_id"))
+            week = int(ch.get("week", ch.get("week_number")))
+        except Exception:
+            return "allocation_id and week are required integers"
+        if allocation_id <= 0 or week not in (1, 2, 3, 4):
+            return "invalid allocation_id or week"
+        cell = cells.setdefault((allocation_id, week), {})
+        if ch.get("percent") is not None:
+            try:
+                pct = Decimal(str(ch["percent"]))
+            except Exception:
+                return f"invalid percent for allocation {allocation_id} week {week}"
+            cell["percent"] = min(max(pct, Decimal("0.00")), Decimal("100.00")).quantize(Decimal("0.01"), ROUND_HALF_UP)
+        if ch.get("status") is not None:
+            status_val = _WEEK_STATUS_ALIASES.get(str(ch["status"]).strip().upper())
+            if not status_val:
+                return f"invalid status for allocation {allocation_id} week {week}"
+            cell["status"] = status_val
+        if not cell:
+            return f"nothing to change for allocation {allocation_id} week {week}"
+    return cells
+
+
+@require_POST
+def bulk_update_weekly(request):
+    """
+    Bulk weekly percent/status changes for many allocation cells.
+    Expects JSON: { "changes": [ {"allocation_id": 1, "week": 2, "percent": 25, "status": "ACCEPTED"}, ... ] }
+    (percent and status are each optional per change).
+
+    Ownership of every allocation is checked with one query: status may be set by
+    the allocated user, a project owner (project_ownership), the user's direct
+    manager (ldap_directory.manager_dn) or, when the session holds the team view's
+    reportee list, a viewer whose reportee set contains the user (the same set
+    team_allocations_api lists); percent only by the non-self roles.
+    All cells are then written with one multi-row INSERT ... ON DUPLICATE KEY UPDATE,
+    in the same transaction as the locking read (SELECT ... FOR UPDATE) they are computed from.
+    Returns JSON: { ok: True, cells: [ {allocation_id, week, percent, hours, status}, ... ] }
+    """
+    session_ldap = request.session.get("ldap_username")
+    if not session_ldap:
+        return HttpResponseForbidden("Missing LDAP session username")
+    try:
+        payload = json.loads(request.body.decode("utf-8"))
+    except Exception:
+        return HttpResponseBadRequest("Invalid JSON")
+
+    cells = _parse_bulk_week_changes((payload or {}).get("changes") if isinstance(payload, dict) else None)
+    if isinstance(cells, str):
+        return JsonResponse({"ok": False, "error": cells}, status=400)
+
+    allocation_ids = sorted({aid for aid, _wk in cells})
+    id_sql, id_params = _sql_in_clause(allocation_ids)
+    owned_sql, owned_params = owned_subquery(session_owner_keys(request.session), "project_id")
+    team_keys = set()
+    if request.session.get(TEAM_REPORTEES_SESSION_KEY):
+        creds = (session_ldap, request.session.get("ldap_password"))
+        team_keys = {_allocation_user_key(r) for r in (_session_team_reportees(request, session_ldap, creds) or [])
+                     if _allocation_user_key(r)}
+    sql = f"""
+        SELECT mae.id, COALESCE(mae.total_hours, 0.00), mae.user_key,
+               mae.user_key = %s AS is_self,
+               (mae.project_id IN ({owned_sql})) AS is_owner,
+               EXISTS (
+                   SELECT 1 FROM ldap_directory e
+                   WHERE (e.email = mae.user_ldap OR e.username = mae.user_ldap)
+                     AND e.manager_dn IN (SELECT m.ldap_dn FROM ldap_directory m WHERE m.username = %s OR m.email = %s)
+               ) AS is_manager,
+               wa.week_number, wa.percent, wa.hours, wa.status
+        FROM monthly_allocation_entries mae
+        LEFT JOIN weekly_allocations wa ON wa.allocation_id = mae.id
+        WHERE mae.id IN {id_sql}
+        FOR UPDATE OF mae, wa
+    """
+    params = [_allocation_user_key(session_ldap)] + owned_params + [session_ldap, session_ldap] + id_params
+
+    # read, check and write in one transaction: the allocation rows (and existing
+    # week rows) stay locked, so a concurrent save of the same cells cannot be
+    # overwritten with the percent/hours/total read here
+    try:
+        with transaction.atomic():
+            with connection.cursor() as cur:
+                cur.execute(sql, params)
+                allocations, existing = {}, {}
+                for aid, total, user_key, is_self, is_owner, is_manager, wk, pct, hrs, status_val in cur.fetchall():
+                    allocations[aid] = {
+                        "total": Decimal(str(total or "0.00")),
+                        "self": bool(is_self),
+                        "manage": bool(is_owner) or bool(is_manager) or _allocation_user_key(user_key) in team_keys,
+                    }
+                    if wk is not None:
+                        existing[(aid, int(wk))] = (Decimal(str(pct or "0.00")), Decimal(str(hrs or "0.00")),
+                                                    status_val or "PENDING")
+
+                missing = [aid for aid in allocation_ids if aid not in allocations]
+                if missing:
+                    return JsonResponse({"ok": False, "error": "Allocation not found", "allocation_ids": missing},
+                                        status=400)
+                denied = sorted({
+                    aid for (aid, _wk), change in cells.items()
+                    if not allocations[aid]["manage"] and ("percent" in change or not allocations[aid]["self"])
+                })
+                if denied:
+                    return JsonResponse({"ok": False, "error": "You are not authorized to update these allocations",
+                                         "allocation_ids": denied}, status=403)
+
+                values, out = [], []
+                for (aid, wk), change in sorted(cells.items()):
+                    pct, hrs, status_val = existing.get((aid, wk), (Decimal("0.00"), Decimal("0.00"), "PENDING"))
+                    if "percent" in change:
+                        pct = change["percent"]
+                        hrs = (allocations[aid]["total"] * (pct / Decimal("100.00"))).quantize(
+                            Decimal("0.01"), rounding=ROUND_HALF_UP)
+                    status_val = change.get("status", status_val)
+                    values.extend([aid, wk, str(pct), str(hrs), status_val])
+                    out.append({"allocation_id": aid, "week": wk, "percent": format(pct, "0.2f"),
+                                "hours": format(hrs, "0.2f"), "status": status_val})
+
+                cur.execute(
+                    "INSERT INTO weekly_allocations (allocation_id, week_number, percent, hours, status) VALUES "
+                    + ",".join(["(%s, %s, %s, %s, %s)"] * len(out))
+                    + """
+                    ON DUPLICATE KEY UPDATE
+                      percent = VALUES(percent),
+                      hours = VALUES(hours),
+                      status = VALUES(status),
+                      updated_at = CURRENT_TIMESTAMP
+                    """,
+                    values,
+                )
+    except Exception as exc:
+        logger.exception("bulk_update_weekly failed: %s", exc)
+        return JsonResponse({"ok": False, "error": str(exc)}, status=500)
+
+    return JsonResponse({"ok": True, "cells": out})
+
 # -------------------------------------------------------------------
 # 3. MY ALLOCATIONS (VIEW)
 # -------------------------------------------------------------------
@@ -2220,6 +2584,12 @@ def my_allocations(request):
                 iso = d.strftime("%Y-%m-%d")
                 user_punch_map_daily.setdefault(aid, {})[iso] = Decimal(str(r['actual_hours'] or '0.00'))
 
+    # Weekly punched totals for these allocations (primary-key reads)
+    punched_weeks = {}
+    if allocation_ids:
+        with connection.cursor() as cur:
+            punched_weeks = week_totals(cur, allocation_ids)
+
     # Build daily_dates list for billing period and compute week_number relative to billing_start
     daily_dates = []
     cur_day = billing_start
@@ -2265,19 +2635,8 @@ def my_allocations(request):
         # Compute which weeks to show as 'present' (if week alloc >0 or total_hours >0 show them)
         weeks_present = [wk for wk,h in weeks.items() if h > 0] or [1,2,3,4]
 
-        # Compute punched per week (sum of daily punches within week range)
-        punched_per_week = {}
-        for wk in range(1,5):
-            # week start and end relative to billing_start
-            wk_start = billing_start + timedelta(days=(wk-1)*7)
-            wk_end = min(wk_start + timedelta(days=6), billing_end)
-            s = Decimal('0.00')
-            # sum daily punches in the map for this allocation
-            for iso, hrs in (user_punch_map_daily.get(aid) or {}).items():
-                d = datetime.strptime(iso, "%Y-%m-%d").date()
-                if wk_start <= d <= wk_end:
-                    s += Decimal(str(hrs or '0.00'))
-            punched_per_week[wk] = s
+        # Punched per week from the maintained totals (user_punch_week_totals)
+        punched_per_week = punched_weeks.get(aid, {})
 
         # Prepare final row (hours as strings for template)
         row = {
@@ -2373,6 +2732,21 @@ def save_my_alloc_weekly(request):
         logger.exception("save_my_alloc_weekly failed: %s", e)
         return JsonResponse({"ok": False, "error": str(e)}, status=500)
 
+
+def _record_daily_punch(user_ldap, allocation_id, punch_date, actual_hours, wbs=None):
+    """
+    Save one day's punch in its billing week under the weekly cap. The
+    allocation week's row is locked for the duration of the transaction, so
+    concurrent saves for that week queue while other weeks proceed.
+    Raises PunchRejected when the cap or the weekly allocation is missing.
+    """
+    billing_start, _billing_end = get_billing_period_for_date(punch_date)
+    week_number = ((punch_date - billing_start).days // 7) + 1
+    with transaction.atomic():
+        with connection.cursor() as cur:
+            return record_daily_punch(cur, user_ldap, allocation_id, punch_date, week_number, actual_hours, wbs)
+
+
 # save_daily endpoint (modified to use billing period lookup for punch_date)
 # -------------------------
 @require_POST
@@ -2387,57 +2761,11 @@ def save_my_alloc_daily(request):
 
         user_ldap = request.session.get("ldap_username")
 
-        billing_start, billing_end = get_billing_period_for_date(punch_date)
-        week_number = ((punch_date - billing_start).days // 7) + 1
-
-        # get weekly allocation
-        with connection.cursor() as cur:
-            cur.execute("""
-                SELECT hours FROM weekly_allocations
-                WHERE allocation_id=%s AND week_number=%s
-            """, [allocation_id, week_number])
-            rec = cur.fetchone()
-        if not rec:
-            return JsonResponse({"ok": False, "error": "No weekly allocation found"}, status=400)
-
-        alloc_hours = Decimal(str(rec[0] or "0.00"))
-        wk_start = billing_start + timedelta(days=(week_number - 1) * 7)
-        wk_end = min(wk_start + timedelta(days=6), billing_end)
-
-        # validate total within week
-        with connection.cursor() as cur:
-            cur.execute("""
-                SELECT COALESCE(SUM(actual_hours),0)
-                FROM user_punches
-                WHERE user_ldap=%s AND allocation_id=%s AND punch_date BETWEEN %s AND %s
-            """, [user_ldap, allocation_id, wk_start, wk_end])
-            sum_existing = Decimal(str(cur.fetchone()[0] or "0.00"))
-
-            cur.execute("""
-                SELECT actual_hours FROM user_punches
-                WHERE user_ldap=%s AND allocation_id=%s AND punch_date=%s
-            """, [user_ldap, allocation_id, punch_date])
-            existing_same = cur.fetchone()
-            existing_same_val = Decimal(str(existing_same[0])) if existing_same else Decimal("0.00")
-
-        total_after = (sum_existing - existing_same_val) + actual_hours
-        if total_after > alloc_hours:
-            return JsonResponse({"ok": False, "error": f"Exceeds weekly allocation {alloc_hours:.2f}"}, status=400)
-
-        with transaction.atomic():
-            with connection.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO user_punches
-                    (user_ldap, allocation_id, punch_date, week_number, actual_hours, wbs, updated_at)
-                    VALUES (%s,%s,%s,%s,%s,%s,CURRENT_TIMESTAMP)
-                    ON DUPLICATE KEY UPDATE
-                      actual_hours=VALUES(actual_hours),
-                      wbs=VALUES(wbs),
-                      updated_at=CURRENT_TIMESTAMP
-                """, [user_ldap, allocation_id, punch_date, week_number, str(actual_hours), wbs])
-
-        return JsonResponse({"ok": True, "allocation_id": allocation_id})
+        _record_daily_punch(user_ldap, allocation_id, punch_date, actual_hours, wbs)
+        return JsonResponse({"ok": True, "allocation_id": allocation_id})
 
+    except PunchRejected as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
     except Exception as e:
         logger.exception("save_my_alloc_daily failed: %s", e)
         return JsonResponse({"ok": False, "error": str(e)}, status=500)
@@ -2464,20 +2792,19 @@ def my_allocations_update_status(request):
     if not allocation_id or not isinstance(updates, dict):
         return HttpResponseBadRequest("allocation_id and updates required")
 
-    # verify allocation belongs to logged in user
+    # verify allocation belongs to logged in user (primary-key read on the canonical row)
     with connection.cursor() as cur:
         cur.execute("""
-            SELECT a.id, ai.user_ldap, a.total_hours
-            FROM allocations a
-            JOIN allocation_items ai ON ai.allocation_id = a.id
-            WHERE a.id = %s LIMIT 1
+            SELECT id, user_key, total_hours
+            FROM monthly_allocation_entries
+            WHERE id = %s
         """, [allocation_id])
         rec = cur.fetchone()
         if not rec:
             return HttpResponseBadRequest("Invalid allocation_id")
-        db_alloc_id, db_user_ldap, total_hours = rec
+        db_alloc_id, db_user_key, total_hours = rec
 
-    if (db_user_ldap or "").strip() != (session_ldap or "").strip():
+    if (db_user_key or "") != _allocation_user_key(session_ldap):
         return HttpResponseForbidden("You are not authorized to update this allocation")
 
     try:
@@ -2510,50 +2837,20 @@ def my_allocations_update_status(request):
 
 # Replace existing _get_user_projects_for_allocations and monthly_allocations with these:
 
-def _cn_to_creator(cn: str):
-    """
-    Convert "LASTNAME FirstName ..." -> "FirstName ... LASTNAME"
-    (same conversion used in edit_project() so creator matching is consistent)
-    """
-    if not cn:
-        return ""
-    parts = str(cn).strip().split()
-    if len(parts) >= 2:
-        # put the first token (last name) at the end
-        return " ".join(parts[1:]) + " " + parts[0]
-    return str(cn).strip()
-
-
 def _get_user_projects_for_allocations(request):
     """
     Return list of projects (dicts with id,name) where session user is:
-      - PDL (projects.pdl_user_id == session ldap identifier string)
-      - OR creator of any prism_wbs rows (prism_wbs.creator matches converted CN or ldap username)
-    This aligns with project_list / edit_project logic (pdl_user_id stored as email/username string).
+      - PDL (projects.pdl_user_id)
+      - OR creator of any prism_wbs rows
+    Resolved through project_ownership, same as project_list / edit_project.
     """
-    session_ldap = request.session.get("ldap_username")
-    session_cn = request.session.get("cn", "")
-    creator_name = _cn_to_creator(session_cn) if session_cn else ""
-
-    sql = """
-        SELECT DISTINCT p.id, p.name
+    owned_sql, params = owned_subquery(session_owner_keys(request.session), "project_id")
+    sql = f"""
+        SELECT p.id, p.name
         FROM projects p
-        LEFT JOIN prism_wbs pw ON pw.project_id = p.id
-        WHERE 1=0
+        WHERE p.id IN ({owned_sql})
+        ORDER BY p.name
     """
-    params = []
-
-    # match pdl_user_id string directly (projects.pdl_user_id is stored as email/username)
-    if session_ldap:
-        sql += " OR p.pdl_user_id = %s"
-        params.append(session_ldap)
-
-    # match prism_wbs.creator converted CN (or other creators if you need to add more)
-    if creator_name:
-        sql += " OR TRIM(pw.creator) = %s"
-        params.append(creator_name)
-
-    sql += " ORDER BY p.name"
 
     try:
         with connection.cursor() as cur:
@@ -2617,140 +2914,100 @@ def monthly_allocations(request):
             "now": datetime.now(),
         })
 
-    # Fetch COEs and domains
+    # COEs and domains come from the reference-data cache
     try:
-        with connection.cursor() as cur:
-            cur.execute("SELECT id, name FROM coes ORDER BY name")
-            coes = dictfetchall(cur)
+        coes = get_coes()
+        domains_map = get_domains_by_coe()
     except Exception:
-        logger.exception("Error fetching COEs")
-        coes = []
-    coe_ids = [c["id"] for c in coes] if coes else []
+        logger.exception("Error fetching COEs/domains")
+        coes, domains_map = (), {}
 
-    domains_map = {}
-    if coe_ids:
-        try:
-            with connection.cursor() as cur:
-                cur.execute("SELECT id, name, coe_id FROM domains WHERE coe_id IN %s ORDER BY name", [tuple(coe_ids)])
-                doms = dictfetchall(cur)
-            for d in doms:
-                domains_map.setdefault(d["coe_id"], []).append({"id": d["id"], "name": d["name"]})
-        except Exception:
-            logger.exception("Error fetching domains")
-            domains_map = {}
-
-    # fetch allocation_items for this project/billing_start (canonical)
+    # one indexed read (idx_proj_month) of the canonical rows with their user, COE and week cells
     allocation_map = {}
     capacity_accumulator = {}
-    allocation_ids = []
+    weekly_map = {}
     try:
         with connection.cursor() as cur:
             cur.execute("""
-                SELECT ai.id AS item_id,
-                       ai.allocation_id,
-                       ai.coe_id,
-                       ai.domain_id,
-                       ai.user_ldap,
-                       u.username AS username,
-                       u.email AS email,
-                       COALESCE(ai.total_hours,0) as total_hours
-                FROM allocation_items ai
-                JOIN allocations a ON ai.allocation_id = a.id
-                LEFT JOIN users u ON ai.user_id = u.id
-                WHERE ai.project_id = %s
-                  AND a.month_start = %s
-                ORDER BY ai.coe_id
+                SELECT mae.id AS allocation_id,
+                       mae.iom_id,
+                       mae.coe_id,
+                       MAX(c.name) AS coe_name,
+                       mae.domain_id,
+                       mae.user_ldap,
+                       MAX(u.username) AS username,
+                       MAX(u.email) AS email,
+                       COALESCE(mae.total_hours, 0) AS total_hours,
+                       MAX(CASE WHEN wa.week_number = 1 THEN wa.percent END) AS w1,
+                       MAX(CASE WHEN wa.week_number = 2 THEN wa.percent END) AS w2,
+                       MAX(CASE WHEN wa.week_number = 3 THEN wa.percent END) AS w3,
+                       MAX(CASE WHEN wa.week_number = 4 THEN wa.percent END) AS w4,
+                       MAX(CASE WHEN wa.week_number = 1 THEN wa.status END) AS s1,
+                       MAX(CASE WHEN wa.week_number = 2 THEN wa.status END) AS s2,
+                       MAX(CASE WHEN wa.week_number = 3 THEN wa.status END) AS s3,
+                       MAX(CASE WHEN wa.week_number = 4 THEN wa.status END) AS s4
+                FROM monthly_allocation_entries mae
+                LEFT JOIN users u ON u.email = mae.user_ldap
+                LEFT JOIN coes c ON c.id = mae.coe_id
+                LEFT JOIN weekly_allocations wa ON wa.allocation_id = mae.id
+                WHERE mae.project_id = %s
+                  AND mae.month_start = %s
+                GROUP BY mae.id
+                ORDER BY mae.coe_id, mae.user_key
             """, [active_project_id, month_start])
             items = dictfetchall(cur)
 
         for it in items:
             coe_id = it.get("coe_id") or 0
+            aid = it.get("allocation_id")
             ldap_val = (it.get("user_ldap") or "").strip()
             try:
                 total_hours = round(float(it.get("total_hours") or 0.0), 2)
             except Exception:
                 total_hours = 0.0
 
-            allocation_map.setdefault(coe_id, []).append({
-                "item_id": it.get("item_id"),
-                "allocation_id": it.get("allocation_id"),
+            row = {
+                "item_id": aid,
+                "allocation_id": aid,
+                "iom_id": it.get("iom_id"),
                 "coe_id": coe_id,
+                "coe_name": it.get("coe_name"),
                 "domain_id": it.get("domain_id"),
                 "user_ldap": ldap_val,
                 "username": it.get("username"),
                 "email": it.get("email"),
                 "total_hours": total_hours,
-                "w1": 0, "w2": 0, "w3": 0, "w4": 0,
-                "s1": "", "s2": "", "s3": "", "s4": ""
-            })
+            }
+            for wk in (1, 2, 3, 4):
+                pct = it.get(f"w{wk}")
+                row[f"w{wk}"] = float(pct) if pct is not None else 0
+                row[f"s{wk}"] = it.get(f"s{wk}") or ""
+                if pct is not None:
+                    weekly_map.setdefault(aid, {})[wk] = {"percent": float(pct), "status": row[f"s{wk}"]}
+            allocation_map.setdefault(coe_id, []).append(row)
+
             if ldap_val:
                 key = ldap_val.lower()
                 capacity_accumulator[key] = round(capacity_accumulator.get(key, 0.0) + total_hours, 2)
-            aid = it.get("allocation_id")
-            if aid and aid not in allocation_ids:
-                allocation_ids.append(aid)
 
     except Exception:
-        logger.exception("Error fetching allocation_items")
+        logger.exception("Error fetching monthly_allocation_entries")
         allocation_map = {}
         capacity_accumulator = {}
-        allocation_ids = []
-
-    # weekly allocations attach (unchanged)
-    weekly_map = {}
-    if allocation_ids:
-        try:
-            with connection.cursor() as cur:
-                cur.execute("""
-                    SELECT allocation_id, week_number, percent, status
-                    FROM weekly_allocations
-                    WHERE allocation_id IN %s
-                """, [tuple(allocation_ids)])
-                for r in dictfetchall(cur):
-                    alloc = r["allocation_id"]
-                    wk = int(r["week_number"])
-                    weekly_map.setdefault(alloc, {})[wk] = {
-                        "percent": float(r["percent"] or 0.0),
-                        "status": (r.get("status") or "")
-                    }
-        except Exception:
-            logger.exception("Error fetching weekly_allocations")
-            weekly_map = {}
-
-        for coe_id, items in allocation_map.items():
-            for it in items:
-                aid = it["allocation_id"]
-                wk = weekly_map.get(aid, {})
-                it["w1"] = wk.get(1, {}).get("percent", 0)
-                it["w2"] = wk.get(2, {}).get("percent", 0)
-                it["w3"] = wk.get(3, {}).get("percent", 0)
-                it["w4"] = wk.get(4, {}).get("percent", 0)
-                it["s1"] = wk.get(1, {}).get("status", "")
-                it["s2"] = wk.get(2, {}).get("status", "")
-                it["s3"] = wk.get(3, {}).get("status", "")
-                it["s4"] = wk.get(4, {}).get("status", "")
+        weekly_map = {}
 
+    # true remaining capacity across all projects, from the capacity ledger (one query)
     capacity_map = {}
-    for ldap_key, allocated in capacity_accumulator.items():
-        remaining = round(max(0.0, float(HOURS_AVAILABLE_PER_MONTH) - float(allocated)), 2)
-        capacity_map[ldap_key] = {"allocated": round(float(allocated), 2), "remaining": remaining}
-
-    # ensure every user in allocation_items has an entry in capacity_map
+    hours_available = HOURS_AVAILABLE_PER_MONTH
     try:
         with connection.cursor() as cur:
-            cur.execute("""
-                SELECT DISTINCT COALESCE(ai.user_ldap, '') as user_ldap
-                FROM allocation_items ai
-                JOIN allocations a ON ai.allocation_id = a.id
-                WHERE ai.project_id = %s AND a.month_start = %s
-            """, [active_project_id, month_start])
-            for row in cur.fetchall():
-                val = row[0] or ""
-                key = val.strip().lower()
-                if key and key not in capacity_map:
-                    capacity_map[key] = {"allocated": 0, "remaining": HOURS_AVAILABLE_PER_MONTH}
+            capacity_map = get_capacity(cur, capacity_accumulator.keys(), month_start)
+            hours_available = period_available_hours(cur, month_start)
     except Exception:
-        pass
+        logger.exception("Error reading capacity ledger")
+        for ldap_key, allocated in capacity_accumulator.items():
+            remaining = round(max(0.0, float(HOURS_AVAILABLE_PER_MONTH) - float(allocated)), 2)
+            capacity_map[ldap_key] = {"allocated": round(float(allocated), 2), "remaining": remaining}
 
     return render(request, "projects/monthly_allocations.html", {
         "projects": projects,
@@ -2760,7 +3017,7 @@ def monthly_allocations(request):
         "domains_map": domains_map,
         "allocation_map": allocation_map,
         "capacity_map": capacity_map,
-        "hours_available": HOURS_AVAILABLE_PER_MONTH,
+        "hours_available": hours_available,
         "weekly_map": weekly_map,
         "now": datetime.now(),
     })
@@ -2780,29 +3037,7 @@ def _get_month_hours_limit(year, month):
 
 @require_GET
 def get_applicable_ioms(request):
-    session_ldap = request.session.get("ldap_username")
-    session_cn = request.session.get("cn")
-
-    def _cn_to_creator(cn):
-        if not cn: return ""
-        parts = str(cn).strip().split()
-        if len(parts) >= 2:
-            return " ".join(parts[1:]) + " " + parts[0]
-        return str(cn).strip()
-
-    creator_candidates = []
-    if session_cn:
-        conv = _cn_to_creator(session_cn).strip()
-        if conv and conv.lower() not in [c.lower() for c in creator_candidates]:
-            creator_candidates.append(conv)
-        s = session_cn.strip()
-        if s and s.lower() not in [c.lower() for c in creator_candidates]:
-            creator_candidates.append(s)
-    if session_ldap:
-        sld = session_ldap.strip()
-        if sld and sld.lower() not in [c.lower() for c in creator_candidates]:
-            creator_candidates.append(sld)
-    creator_lower_vals = [c.lower() for c in creator_candidates]
+    owner_keys = session_owner_keys(request.session)
 
     project_id = request.GET.get("project_id")
     try:
@@ -2811,40 +3046,29 @@ def get_applicable_ioms(request):
     except Exception:
         return HttpResponseBadRequest("Invalid year/month")
 
-    _MONTH_MAP = {
-        1: ("jan_fte", "jan_hours"),
-        2: ("feb_fte", "feb_hours"),
-        3: ("mar_fte", "mar_hours"),
-        4: ("apr_fte", "apr_hours"),
-        5: ("may_fte", "may_hours"),
-        6: ("jun_fte", "jun_hours"),
-        7: ("jul_fte", "jul_hours"),
-        8: ("aug_fte", "aug_hours"),
-        9: ("sep_fte", "sep_hours"),
-        10: ("oct_fte", "oct_hours"),
-        11: ("nov_fte", "nov_hours"),
-        12: ("dec_fte", "dec_hours"),
-    }
-    fte_col, hrs_col = _MONTH_MAP.get(month, ("jan_fte", "jan_hours"))
-
-    sql = f"""
-        SELECT id, iom_id, department, site, `function`,
-               {fte_col} as month_fte, {hrs_col} as month_hours,
-               buyer_wbs_cc, seller_wbs_cc
-        FROM prism_wbs
-        WHERE year = %s
-          AND ( ({fte_col} IS NOT NULL AND {fte_col} > 0) OR ({hrs_col} IS NOT NULL AND {hrs_col} > 0) )
-    """
-    params = [str(year)]
+    # prism_wbs_monthly: (year, month, planned) index range instead of a per-month column filter
+    # iom_month_consumption: hours already allocated to each IOM in this billing month
+    billing_start, _ = get_billing_period(year, month)
+    sql = """
+        SELECT pw.id, pw.iom_id, pw.department, pw.site, pw.`function`,
+               m.fte as month_fte, m.hours as month_hours,
+               COALESCE(c.allocated_hours, 0) as allocated_hours,
+               pw.buyer_wbs_cc, pw.seller_wbs_cc
+        FROM prism_wbs_monthly m
+        JOIN prism_wbs pw ON pw.iom_id = m.iom_id
+        LEFT JOIN iom_month_consumption c ON c.iom_id = m.iom_id AND c.month_start = %s
+        WHERE m.year = %s AND m.month = %s AND m.planned = 1
+    """
+    params = [billing_start, year, month]
     if project_id:
-        sql += " AND project_id = %s"
+        sql += " AND pw.project_id = %s"
         params.append(project_id)
-    if creator_lower_vals:
-        placeholders = ",".join(["%s"] * len(creator_lower_vals))
-        sql += f" AND LOWER(TRIM(creator)) IN ({placeholders})"
-        params.extend(creator_lower_vals)
+    if owner_keys:
+        owned_sql, owned_params = owned_subquery(owner_keys, "iom_id", roles=[ROLE_CREATOR])
+        sql += f" AND m.iom_id IN ({owned_sql})"
+        params.extend(owned_params)
 
-    sql += " ORDER BY iom_id LIMIT 500"
+    sql += " ORDER BY m.iom_id LIMIT 500"
 
     try:
         with connection.cursor() as cur:
@@ -2860,6 +3084,8 @@ def get_applicable_ioms(request):
     month_limit = _get_month_hours_limit(year, month)
     for r in rows:
         rec = dict(zip(cols, r))
+        month_hours = float(rec.get("month_hours") or 0)
+        allocated_hours = float(rec.get("allocated_hours") or 0)
         ioms.append({
             "id": rec.get("id"),
             "iom_id": rec.get("iom_id"),
@@ -2867,12 +3093,14 @@ def get_applicable_ioms(request):
             "site": rec.get("site"),
             "function": rec.get("function"),
             "month_fte": float(rec.get("month_fte") or 0),
-            "month_hours": float(rec.get("month_hours") or 0),
+            "month_hours": month_hours,
+            "allocated_hours": round(allocated_hours, 2),
+            "remaining_hours": round(max(0.0, month_hours - allocated_hours), 2),
             "buyer_wbs_cc": rec.get("buyer_wbs_cc"),
             "seller_wbs_cc": rec.get("seller_wbs_cc"),
             "month_limit": float(month_limit),
         })
-    return JsonResponse({"ok": True, "ioms": ioms})
+    return JsonResponse({"ok": True, "ioms": ioms, "billing_start": billing_start.strftime("%Y-%m-%d")})
 
 
 # --- get_iom_details: fetch by id OR iom_id, compute remaining hours (from monthly_allocation_entries),
@@ -2889,32 +3117,18 @@ def get_iom_details(request):
     if not iom_row_id:
         return HttpResponseBadRequest("iom_row_id required")
 
-    _MONTH_MAP = {
-        1: ("jan_fte", "jan_hours"),
-        2: ("feb_fte", "feb_hours"),
-        3: ("mar_fte", "mar_hours"),
-        4: ("apr_fte", "apr_hours"),
-        5: ("may_fte", "may_hours"),
-        6: ("jun_fte", "jun_hours"),
-        7: ("jul_fte", "jul_hours"),
-        8: ("aug_fte", "aug_hours"),
-        9: ("sep_fte", "sep_hours"),
-        10: ("oct_fte", "oct_hours"),
-        11: ("nov_fte", "nov_hours"),
-        12: ("dec_fte", "dec_hours"),
-    }
-    fte_col, hrs_col = _MONTH_MAP.get(month, ("jan_fte", "jan_hours"))
-
     try:
         with connection.cursor() as cur:
-            cur.execute(f"""
-                SELECT id, iom_id, project_id, department, site, `function`,
-                       {fte_col} as month_fte, {hrs_col} as month_hours,
-                       buyer_wbs_cc, seller_wbs_cc
-                FROM prism_wbs
-                WHERE id = %s OR iom_id = %s
+            # an IOM has a single prism_wbs row, hence one prism_wbs_monthly row per month
+            cur.execute("""
+                SELECT pw.id, pw.iom_id, pw.project_id, pw.department, pw.site, pw.`function`,
+                       m.fte as month_fte, m.hours as month_hours,
+                       pw.buyer_wbs_cc, pw.seller_wbs_cc
+                FROM prism_wbs pw
+                LEFT JOIN prism_wbs_monthly m ON m.iom_id = pw.iom_id AND m.month = %s
+                WHERE pw.id = %s OR pw.iom_id = %s
                 LIMIT 1
-            """, [iom_row_id, iom_row_id])
+            """, [month, iom_row_id, iom_row_id])
             row = cur.fetchone()
             if not row:
                 return JsonResponse({"ok": False, "error": "IOM not found"}, status=404)
@@ -2967,42 +3181,180 @@ def get_iom_details(request):
 
     return JsonResponse(resp)
 
-def export_allocations(request):
+# --- get_iom_batch: details + saved allocations for many IOMs of one month in two queries ---
+IOM_BATCH_LIMIT = 500
+
+
+@require_POST
+def get_iom_batch(request):
     """
-    Export allocations for an IOM and billing month. Accepts:
-      - project_id, iom_id, and either month=YYYY-MM (preferred) OR month_start=YYYY-MM-DD
+    JSON body: {"project_id": .., "month": "YYYY-MM" (or "year"/"month" numbers),
+                "iom_row_ids": [prism_wbs.id or iom_id, ...]}
+
+    Returns, grouped per IOM, what get_iom_details and get_allocations_for_iom return
+    one IOM at a time:
+      {"ok": true, "billing_start": .., "billing_end": .., "month_limit": ..,
+       "ioms": {iom_id: {"iom": {...}, "saved_items": [{user_ldap, total_hours, fte}]}},
+       "missing": [requested ids not found]}
+    The billing period and month limit are resolved once; IOM details (with the
+    month's planned hours) and saved allocations are read with one query each.
     """
-    project_id = request.GET.get("project_id")
-    iom_id = request.GET.get("iom_id")
-    month_param = request.GET.get("month")  # YYYY-MM
-    month_start_param = request.GET.get("month_start")
+    try:
+        data = json.loads(request.body.decode("utf-8") or "{}")
+    except Exception:
+        return JsonResponse({"ok": False, "error": "invalid JSON"}, status=400)
+
+    project_id = data.get("project_id")
+    raw_ids = data.get("iom_row_ids") or []
+    if not isinstance(raw_ids, list):
+        return JsonResponse({"ok": False, "error": "iom_row_ids must be a list"}, status=400)
+    ids = []
+    for v in raw_ids:
+        v = str(v).strip()
+        if v and v not in ids:
+            ids.append(v)
+    if not ids:
+        return JsonResponse({"ok": False, "error": "iom_row_ids required"}, status=400)
+    if len(ids) > IOM_BATCH_LIMIT:
+        return JsonResponse({"ok": False, "error": f"at most {IOM_BATCH_LIMIT} IOMs per request"}, status=400)
 
-    if not (project_id and iom_id):
-        return HttpResponseBadRequest("project_id and iom_id required")
+    try:
+        month_param = data.get("month")
+        if isinstance(month_param, str) and "-" in month_param:
+            year, month = map(int, month_param.split("-"))
+        else:
+            year = int(data.get("year") or datetime.now().year)
+            month = int(month_param or datetime.now().month)
+        billing_start, billing_end = get_billing_period(year, month)
+    except Exception:
+        return JsonResponse({"ok": False, "error": "Invalid month parameter"}, status=400)
 
-    # resolve canonical billing_start based on month param or month_start
-    billing_start = None
-    if month_param:
-        try:
-            year, mon = map(int, month_param.split("-"))
-            billing_start, billing_end = get_billing_period(year, mon)
-        except Exception:
-            logger.exception("export_allocations: invalid month param %s", month_param)
-            from datetime import date
-            billing_start = date.today().replace(day=1)
-    elif month_start_param:
-        try:
+    month_limit = _get_month_hours_limit(year, month)
+    in_sql, in_params = _sql_in_clause(ids)
+
+    try:
+        with connection.cursor() as cur:
+            cur.execute(f"""
+                SELECT pw.id, pw.iom_id, pw.project_id, pw.department, pw.site, pw.`function`,
+                       m.hours AS month_hours, pw.total_hours, pw.total_fte,
+                       pw.buyer_wbs_cc, pw.seller_wbs_cc
+                FROM prism_wbs pw
+                LEFT JOIN prism_wbs_monthly m ON m.iom_id = pw.iom_id AND m.month = %s
+                WHERE pw.id IN {in_sql} OR pw.iom_id IN {in_sql}
+            """, [month] + in_params + in_params)
+            details = dictfetchall(cur)
+
+            iom_ids = [d["iom_id"] for d in details]
+            saved_rows = []
+            if iom_ids:
+                iom_in_sql, iom_in_params = _sql_in_clause(iom_ids)
+                sql = f"""
+                    SELECT iom_id, user_ldap, total_hours
+                    FROM monthly_allocation_entries
+                    WHERE month_start = %s AND iom_id IN {iom_in_sql}
+                """
+                params = [billing_start] + iom_in_params
+                if project_id:
+                    sql += " AND project_id = %s"
+                    params.append(project_id)
+                cur.execute(sql + " ORDER BY iom_id, id", params)
+                saved_rows = cur.fetchall() or []
+    except Exception as ex:
+        logger.exception("get_iom_batch failed: %s", ex)
+        return JsonResponse({"ok": False, "error": str(ex)}, status=500)
+
+    # iom_id collation is case-insensitive, so group on the folded value
+    saved_by_iom = {}
+    for iom_id, user_ldap, total_hours in saved_rows:
+        hours = float(total_hours or 0.0)
+        fte = round((hours / month_limit) if month_limit > 0 else 0.0, 4)
+        saved_by_iom.setdefault(str(iom_id).lower(), []).append(
+            {"user_ldap": user_ldap or "", "total_hours": hours, "fte": fte})
+
+    result = {}
+    found = set()
+    for rec in details:
+        found.update({str(rec["id"]), str(rec["iom_id"]).lower()})
+        saved = saved_by_iom.get(str(rec["iom_id"]).lower(), [])
+        month_hours = float(rec.get("month_hours") or 0.0)
+        used_hours = sum(item["total_hours"] for item in saved)
+        remaining_hours = round(max(0.0, month_hours - used_hours), 2)
+        result[rec["iom_id"]] = {
+            "iom": {
+                "id": rec.get("id"),
+                "iom_id": rec.get("iom_id"),
+                "department": rec.get("department"),
+                "site": rec.get("site"),
+                "function": rec.get("function"),
+                "month_fte": round((month_hours / month_limit) if month_limit > 0 else 0.0, 2),
+                "month_hours": round(month_hours, 2),
+                "total_fte": float(rec.get("total_fte") or 0),
+                "total_hours": float(rec.get("total_hours") or 0),
+                "buyer_wbs_cc": rec.get("buyer_wbs_cc"),
+                "seller_wbs_cc": rec.get("seller_wbs_cc"),
+                "remaining_hours": remaining_hours,
+                "remaining_fte": round((remaining_hours / month_limit) if month_limit > 0 else 0.0, 2),
+                "month_limit": float(month_limit),
+                "billing_start": billing_start,
+                "billing_end": billing_end,
+            },
+            "saved_items": saved,
+        }
+
+    return JsonResponse({
+        "ok": True,
+        "billing_start": billing_start.strftime("%Y-%m-%d"),
+        "billing_end": billing_end.strftime("%Y-%m-%d"),
+        "month_limit": float(month_limit),
+        "ioms": result,
+        "missing": [i for i in ids if i not in found and i.lower() not in found],
+    })
+
+
+# ---------- Exports ----------
+# Each export is a builder(params) -> (filename, bytes) plus a version(cur, params)
+# used by projects/exports.py to key cached artifacts. The GET endpoints below
+# serve the stored artifact when the data is unchanged and otherwise queue the
+# build and render a status page that polls export_job_status; the pages call
+# export_job_start directly. Nothing is built on the request thread.
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _export_session_ldap(request):
+    return (request.session.get("ldap_username")
+            or request.session.get("user_email")
+            or request.session.get("user_ldap")
+            or getattr(request.user, "email", None)
+            or getattr(request.user, "username", None))
+
+
+def _resolve_export_period(month_param, month_start_param):
+    """(billing_start, billing_end) from ?month=YYYY-MM or ?month_start=YYYY-MM-DD; current month otherwise."""
+    try:
+        if month_start_param:
             dt = datetime.strptime(month_start_param, "%Y-%m-%d").date()
-            # find billing period containing dt; if not found fallback to dt.replace(day=1)
-            try:
-                billing_start, billing_end = get_billing_period_for_date(dt)
-            except Exception:
-                billing_start = dt.replace(day=1)
-        except Exception:
-            billing_start = date.today().replace(day=1)
-    else:
-        today = date.today()
-        billing_start, billing_end = get_billing_period(today.year, today.month)
+            return get_billing_period_for_date(dt)
+        if month_param:
+            y, m = map(int, month_param.split("-"))
+            return get_billing_period(y, m)
+    except Exception as ex:
+        logger.exception("export: invalid month param: %s", ex)
+    today = date.today()
+    return get_billing_period(today.year, today.month)
+
+
+def _allocations_export_version(cur, params):
+    cur.execute("""
+        SELECT COUNT(*), COALESCE(SUM(total_hours), 0), MAX(updated_at)
+        FROM monthly_allocation_entries
+        WHERE project_id=%s AND iom_id=%s AND month_start=%s
+    """, [params["project_id"], params["iom_id"], params["billing_start"]])
+    count, hours, updated = cur.fetchone()
+    return [int(count or 0), str(hours), str(updated)]
+
+
+def _build_allocations_xlsx(params):
+    project_id, iom_id, billing_start = params["project_id"], params["iom_id"], params["billing_start"]
 
     # fetch iom basic details
     iom = None
@@ -3105,234 +3457,106 @@ def export_allocations(request):
                     pass
         ws.column_dimensions[col_letter].width = max_length + 4
 
-    response = HttpResponse(content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    filename = f"allocations_{iom_id}_{billing_start}.xlsx"
-    response["Content-Disposition"] = f'attachment; filename="{filename}"'
-    wb.save(response)
-    return response
+    output = io.BytesIO()
+    wb.save(output)
+    return f"allocations_{iom_id}_{billing_start}.xlsx", output.getvalue()
 
 
-def export_my_punches_pdf(request):
+PUNCH_IDENTITY_SESSION_KEY = "punch_identity_keys"
+
+
+def _punch_identity_keys(request, session_ldap):
     """
-    Export punches PDF for the logged-in user for the canonical billing cycle for the requested month.
-    Accepts ?month=YYYY-MM (preferred) or ?month_start=YYYY-MM-DD.
-    Tries multiple session_ldap variants if direct match returns no rows.
+    Normalized user_punches.user_key values that belong to the session identity:
+    the identity itself plus the username and email of its ldap_directory row
+    (the email local part when there is no row). Resolved with one indexed
+    ldap_directory read and cached in the session for that identity.
     """
-    import io
-    from django.template.loader import render_to_string
-    from xhtml2pdf import pisa
+    value = str(session_ldap or "").strip()
+    cached = request.session.get(PUNCH_IDENTITY_SESSION_KEY)
+    if cached and cached.get("for") == value and cached.get("keys"):
+        return list(cached["keys"])
 
-    session_ldap = (request.session.get("ldap_username")
-                    or request.session.get("user_email")
-                    or request.session.get("user_ldap")
-                    or getattr(request.user, "email", None)
-                    or getattr(request.user, "username", None))
-    if not session_ldap:
-        return HttpResponseBadRequest("Not authenticated")
+    keys = [_allocation_user_key(value)]
+    with connection.cursor() as cur:
+        cur.execute("""
+            SELECT username, email
+            FROM ldap_directory
+            WHERE email = %s OR username = %s
+            LIMIT 1
+        """, [value, value])
+        entry = cur.fetchone()
+    if entry:
+        keys += [_allocation_user_key(v) for v in entry if v]
+    elif "@" in value:
+        keys.append(_allocation_user_key(value.split("@", 1)[0]))
+    keys = [k for i, k in enumerate(keys) if k and k not in keys[:i]]
+
+    request.session[PUNCH_IDENTITY_SESSION_KEY] = {"for": value, "keys": keys}
+    return keys
+
+
+_PUNCH_EXPORT_SELECT = """
+    SELECT up.allocation_id, mae.project_id, p.name as project_name, mae.iom_id, pw.department AS department,
+           up.punch_date, up.week_number, up.actual_hours, up.wbs
+    FROM user_punches up
+    LEFT JOIN monthly_allocation_entries mae ON mae.id = up.allocation_id
+    LEFT JOIN projects p ON mae.project_id = p.id
+    LEFT JOIN prism_wbs pw ON mae.iom_id = pw.iom_id
+"""
 
-    # determine billing period
-    month_param = request.GET.get("month")
-    month_start_param = request.GET.get("month_start")
-    try:
-        if month_start_param:
-            dt = datetime.strptime(month_start_param, "%Y-%m-%d").date()
-            billing_start, billing_end = get_billing_period_for_date(dt)
-        elif month_param:
-            y, m = map(int, month_param.split("-"))
-            billing_start, billing_end = get_billing_period(y, m)
-        else:
-            # fallback to current month billing
-            today = date.today()
-            billing_start, billing_end = get_billing_period(today.year, today.month)
-    except Exception as ex:
-        logger.exception("export_my_punches_pdf: invalid month param: %s", ex)
-        today = date.today()
-        billing_start, billing_end = get_billing_period(today.year, today.month)
 
-    rows = []
-    tried = []
+def _fetch_punch_export_rows(user_keys, billing_start, billing_end):
+    """Punch rows for the billing window: one query on (user_key, punch_date)."""
+    in_sql, in_params = _sql_in_clause(user_keys)
+    with connection.cursor() as cur:
+        cur.execute(_PUNCH_EXPORT_SELECT + f"""
+            WHERE up.user_key IN {in_sql}
+              AND up.punch_date BETWEEN %s AND %s
+            ORDER BY up.punch_date, p.name
+        """, in_params + [billing_start, billing_end])
+        return dictfetchall(cur)
 
-    def fetch_for_ldap(ldap_val):
-        with connection.cursor() as cur:
-            cur.execute("""
-                SELECT up.allocation_id, mae.project_id, p.name as project_name, mae.iom_id, pw.department AS department,
-                       up.punch_date, up.week_number, up.actual_hours, up.wbs
-                FROM user_punches up
-                LEFT JOIN monthly_allocation_entries mae ON mae.id = up.allocation_id
-                LEFT JOIN projects p ON mae.project_id = p.id
-                LEFT JOIN prism_wbs pw ON mae.iom_id = pw.iom_id
-                WHERE up.user_ldap = %s
-                  AND up.punch_date BETWEEN %s AND %s
-                ORDER BY up.punch_date, p.name
-            """, [ldap_val, billing_start, billing_end])
-            return dictfetchall(cur)
-
-    # 1) try with exact session_ldap
-    rows = fetch_for_ldap(session_ldap)
-    tried.append(("exact", session_ldap, len(rows)))
-
-    # 2) try with lowercase email
-    if not rows and "@" in str(session_ldap):
-        alt = session_ldap.lower()
-        rows = fetch_for_ldap(alt)
-        tried.append(("lower", alt, len(rows)))
-
-    # 3) try using only local-part (before @)
-    if not rows and "@" in str(session_ldap):
-        local = session_ldap.split("@", 1)[0]
-        rows = fetch_for_ldap(local)
-        tried.append(("localpart", local, len(rows)))
-
-    # 4) try wildcard LIKE search on email / ldap values
-    if not rows:
-        # attempt wildcard searches using parts of username
-        candidates = []
-        if "@" in str(session_ldap):
-            candidates.append("%" + session_ldap.split("@", 1)[0] + "%")
-            candidates.append("%" + session_ldap + "%")
-        else:
-            candidates.append("%" + session_ldap + "%")
-        # also try replacing dots with underscores and vice-versa
-        srep = str(session_ldap).replace(".", "_")
-        candidates.append("%" + srep + "%")
-        # run attempts
-        for pattern in candidates:
-            with connection.cursor() as cur:
-                cur.execute("""
-                    SELECT up.allocation_id, mae.project_id, p.name as project_name, mae.iom_id, pw.department AS department,
-                           up.punch_date, up.week_number, up.actual_hours, up.wbs
-                    FROM user_punches up
-                    LEFT JOIN monthly_allocation_entries mae ON mae.id = up.allocation_id
-                    LEFT JOIN projects p ON mae.project_id = p.id
-                    LEFT JOIN prism_wbs pw ON mae.iom_id = pw.iom_id
-                    WHERE up.user_ldap LIKE %s
-                      AND up.punch_date BETWEEN %s AND %s
-                    ORDER BY up.punch_date, p.name
-                """, [pattern, billing_start, billing_end])
-                tmp = dictfetchall(cur)
-            tried.append(("wildcard", pattern, len(tmp)))
-            if tmp:
-                rows = tmp
-                break
 
-    logger.debug("export_my_punches_pdf tried patterns: %r", tried)
+def _punches_export_version(cur, params):
+    in_sql, in_params = _sql_in_clause(params["user_keys"])
+    cur.execute(f"""
+        SELECT COUNT(*), COALESCE(SUM(actual_hours), 0), MAX(updated_at)
+        FROM user_punches
+        WHERE user_key IN {in_sql} AND punch_date BETWEEN %s AND %s
+    """, in_params + [params["billing_start"], params["billing_end"]])
+    count, hours, updated = cur.fetchone()
+    return [int(count or 0), str(hours), str(updated)]
 
-    # Render PDF (allow empty rows but show message)
-    html = render_to_string("projects/punches_pdf.html", {
-        "rows": rows,
-        "month": month_param or billing_start.strftime("%Y-%m"),
-        "user": session_ldap,
-        "billing_start": billing_start, "billing_end": billing_end,
-        "tried": tried
-    })
-    result = io.BytesIO()
-    pisa_status = pisa.CreatePDF(io.BytesIO(html.encode("utf-8")), dest=result)
-    if pisa_status.err:
-        logger.exception("pisa create pdf failed")
-        return HttpResponse("Error generating PDF", status=500)
-    result.seek(0)
-    safe_user = str(session_ldap).replace("@", "_at_").replace(".", "_")
-    filename = f"punches_{safe_user}_{(month_param or billing_start.strftime('%Y-%m'))}.pdf"
-    response = HttpResponse(result.read(), content_type="application/pdf")
-    response["Content-Disposition"] = f'attachment; filename="{filename}"'
-    return response
 
+def _punch_export_filename(params, extension):
+    safe_user = str(params["user"]).replace("@", "_at_").replace(".", "_")
+    return f"punches_{safe_user}_{params['month']}.{extension}"
 
-def export_my_punches_excel(request):
-    """
-    Export punches for logged-in user to Excel for the canonical billing period.
-    Same input options and LDAP fallback logic as export_my_punches_pdf.
-    """
-    import io
-    import openpyxl
-    from openpyxl.utils import get_column_letter
 
-    session_ldap = (request.session.get("ldap_username")
-                    or request.session.get("user_email")
-                    or request.session.get("user_ldap")
-                    or getattr(request.user, "email", None)
-                    or getattr(request.user, "username", None))
-    if not session_ldap:
-        return HttpResponseBadRequest("Not authenticated")
+def _build_punches_pdf(params):
+    billing_start, billing_end = params["billing_start"], params["billing_end"]
+    rows = _fetch_punch_export_rows(params["user_keys"], billing_start, billing_end)
 
-    # determine billing period
-    month_param = request.GET.get("month")
-    month_start_param = request.GET.get("month_start")
-    try:
-        if month_start_param:
-            dt = datetime.strptime(month_start_param, "%Y-%m-%d").date()
-            billing_start, billing_end = get_billing_period_for_date(dt)
-        elif month_param:
-            y, m = map(int, month_param.split("-"))
-            billing_start, billing_end = get_billing_period(y, m)
-        else:
-            today = date.today()
-            billing_start, billing_end = get_billing_period(today.year, today.month)
-    except Exception as ex:
-        logger.exception("export_my_punches_excel: invalid month param: %s", ex)
-        today = date.today()
-        billing_start, billing_end = get_billing_period(today.year, today.month)
+    # Render PDF in the process pool (allow empty rows but show message)
+    pdf = render_punches_pdf({
+        "rows": rows,
+        "month": params["month"],
+        "user": params["user"],
+        "billing_start": billing_start, "billing_end": billing_end,
+    })
+    return _punch_export_filename(params, "pdf"), pdf
 
-    rows = []
-    tried = []
 
-    def fetch_for_ldap(ldap_val):
-        with connection.cursor() as cur:
-            cur.execute("""
-                SELECT up.allocation_id, mae.project_id, p.name as project_name, mae.iom_id, pw.department AS department,
-                       up.punch_date, up.week_number, up.actual_hours, up.wbs
-                FROM user_punches up
-                LEFT JOIN monthly_allocation_entries mae ON mae.id = up.allocation_id
-                LEFT JOIN projects p ON mae.project_id = p.id
-                LEFT JOIN prism_wbs pw ON mae.iom_id = pw.iom_id
-                WHERE up.user_ldap = %s
-                  AND up.punch_date BETWEEN %s AND %s
-                ORDER BY up.punch_date, p.name
-            """, [ldap_val, billing_start, billing_end])
-            return dictfetchall(cur)
-
-    # Try exact and fallback variants
-    rows = fetch_for_ldap(session_ldap)
-    tried.append(("exact", session_ldap, len(rows)))
-    if not rows and "@" in str(session_ldap):
-        rows = fetch_for_ldap(session_ldap.lower())
-        tried.append(("lower", session_ldap.lower(), len(rows)))
-    if not rows and "@" in str(session_ldap):
-        local = session_ldap.split("@", 1)[0]
-        rows = fetch_for_ldap(local)
-        tried.append(("localpart", local, len(rows)))
-    if not rows:
-        candidates = []
-        if "@" in str(session_ldap):
-            candidates.append("%" + session_ldap.split("@", 1)[0] + "%")
-            candidates.append("%" + session_ldap + "%")
-        else:
-            candidates.append("%" + session_ldap + "%")
-        for pattern in candidates:
-            with connection.cursor() as cur:
-                cur.execute("""
-                    SELECT up.allocation_id, mae.project_id, p.name as project_name, mae.iom_id, pw.department AS department,
-                           up.punch_date, up.week_number, up.actual_hours, up.wbs
-                    FROM user_punches up
-                    LEFT JOIN monthly_allocation_entries mae ON mae.id = up.allocation_id
-                    LEFT JOIN projects p ON mae.project_id = p.id
-                    LEFT JOIN prism_wbs pw ON mae.iom_id = pw.iom_id
-                    WHERE up.user_ldap LIKE %s
-                      AND up.punch_date BETWEEN %s AND %s
-                    ORDER BY up.punch_date, p.name
-                """, [pattern, billing_start, billing_end])
-                tmp = dictfetchall(cur)
-            tried.append(("wildcard", pattern, len(tmp)))
-            if tmp:
-                rows = tmp
-                break
-
-    logger.debug("export_my_punches_excel tried patterns: %r", tried)
+def _build_punches_xlsx(params):
+    billing_start, billing_end = params["billing_start"], params["billing_end"]
+    month_label = params["month"]
+    rows = _fetch_punch_export_rows(params["user_keys"], billing_start, billing_end)
 
     # Build Excel
     wb = openpyxl.Workbook()
     ws = wb.active
-    ws.title = f"Punches {month_param or billing_start.strftime('%Y-%m')}"
+    ws.title = f"Punches {month_label}"
 
     headers = ["Date", "Project", "IOM", "Dept", "Week#", "Hours", "WBS"]
     for i, h in enumerate(headers, start=1):
@@ -3357,10 +3581,344 @@ def export_my_punches_excel(request):
 
     output = io.BytesIO()
     wb.save(output)
-    output.seek(0)
-    safe_user = str(session_ldap).replace("@", "_at_").replace(".", "_")
-    filename = f"punches_{safe_user}_{(month_param or billing_start.strftime('%Y-%m'))}.xlsx"
-    response = HttpResponse(output.read(), content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    return _punch_export_filename(params, "xlsx"), output.getvalue()
+
+
+export_jobs.register("allocations_xlsx", _build_allocations_xlsx, _allocations_export_version,
+                     "xlsx", XLSX_CONTENT_TYPE)
+export_jobs.register("punches_pdf", _build_punches_pdf, _punches_export_version,
+                     "pdf", "application/pdf")
+export_jobs.register("punches_xlsx", _build_punches_xlsx, _punches_export_version,
+                     "xlsx", XLSX_CONTENT_TYPE)
+
+
+def _export_request(request, export_type, data):
+    """(requested_by, period, params) for an export type, or an error response."""
+    session_ldap = _export_session_ldap(request)
+    if not session_ldap:
+        return HttpResponseBadRequest("Not authenticated")
+    billing_start, billing_end = _resolve_export_period(data.get("month"), data.get("month_start"))
+
+    if export_type == "allocations_xlsx":
+        project_id, iom_id = data.get("project_id"), data.get("iom_id")
+        if not (project_id and iom_id):
+            return HttpResponseBadRequest("project_id and iom_id required")
+        params = {"project_id": project_id, "iom_id": iom_id, "billing_start": billing_start}
+        return session_ldap, f"{project_id}:{iom_id}:{billing_start}", params
+
+    if export_type in ("punches_pdf", "punches_xlsx"):
+        params = {
+            "user": session_ldap,
+            "user_keys": _punch_identity_keys(request, session_ldap),
+            "billing_start": billing_start,
+            "billing_end": billing_end,
+            "month": data.get("month") or billing_start.strftime("%Y-%m"),
+        }
+        return session_ldap, f"{billing_start}:{billing_end}", params
+
+    return HttpResponseBadRequest("Unknown export type")
+
+
+def _serve_export(request, export_type):
+    """Serve a cached artifact for unchanged data, otherwise queue the build and show its status page."""
+    prepared = _export_request(request, export_type, request.GET)
+    if isinstance(prepared, HttpResponse):
+        return prepared
+    requested_by, period, params = prepared
+    try:
+        job = export_jobs.enqueue(export_type, requested_by, period, params)
+    except Exception:
+        logger.exception("%s export failed", export_type)
+        return HttpResponse("Error generating export", status=500)
+    if job["status"] != export_jobs.STATUS_COMPLETED:
+        return render(request, "projects/export_status.html", {"job": _export_job_payload(job)}, status=202)
+    return FileResponse(open(job["artifact_path"], "rb"), as_attachment=True,
+                        filename=job["filename"], content_type=job["content_type"])
+
+
+def export_allocations(request):
+    """
+    Export allocations for an IOM and billing month. Accepts:
+      - project_id, iom_id, and either month=YYYY-MM (preferred) OR month_start=YYYY-MM-DD
+    """
+    return _serve_export(request, "allocations_xlsx")
+
+
+def export_my_punches_pdf(request):
+    """
+    Export punches PDF for the logged-in user for the canonical billing cycle for the requested month.
+    Accepts ?month=YYYY-MM (preferred) or ?month_start=YYYY-MM-DD.
+    The user's punch keys are resolved once by _punch_identity_keys and read
+    with a single user_key IN (...) query.
+    """
+    return _serve_export(request, "punches_pdf")
+
+
+def export_my_punches_excel(request):
+    """
+    Export punches for logged-in user to Excel for the canonical billing period.
+    Same input options and identity resolution (_punch_identity_keys, one
+    user_key query) as export_my_punches_pdf.
+    """
+    return _serve_export(request, "punches_xlsx")
+
+
+@require_POST
+def export_job_start(request):
+    """
+    Queue an export and return its job. POST (form or JSON): type = allocations_xlsx |
+    punches_pdf | punches_xlsx, plus that export's month/month_start/project_id/iom_id.
+    Unchanged data resolves to the already finished job, whose download_url is set.
+    """
+    try:
+        data = json.loads(request.body.decode("utf-8")) if request.content_type == "application/json" else request.POST
+    except Exception:
+        return JsonResponse({"ok": False, "error": "Invalid JSON"}, status=400)
+    export_type = (data.get("type") or "").strip()
+    prepared = _export_request(request, export_type, data)
+    if isinstance(prepared, HttpResponse):
+        return JsonResponse({"ok": False, "error": prepared.content.decode("utf-8")}, status=prepared.status_code)
+    requested_by, period, params = prepared
+    try:
+        job = export_jobs.enqueue(export_type, requested_by, period, params)
+    except Exception as exc:
+        logger.exception("export_job_start failed")
+        return JsonResponse({"ok": False, "error": str(exc)}, status=500)
+    return JsonResponse({"ok": True, "job": _export_job_payload(job)}, status=202)
+
+
+def _export_job_payload(job):
+    return export_jobs.job_payload(
+        job,
+        reverse("projects:export_job_status", args=[job["id"]]),
+        reverse("projects:export_job_download", args=[job["id"]]),
+    )
+
+
+def _own_export_job(request, job_id):
+    job = export_jobs.get_job(job_id)
+    if not job:
+        return None, JsonResponse({"ok": False, "error": "job not found"}, status=404)
+    if (job["requested_by"] or "").strip().lower() != (_export_session_ldap(request) or "").strip().lower():
+        return None, HttpResponseForbidden("Not your export")
+    return job, None
+
+
+@require_GET
+def export_job_status(request, job_id):
+    job, error = _own_export_job(request, job_id)
+    if error:
+        return error
+    return JsonResponse({"ok": True, "job": _export_job_payload(job)})
+
+
+@require_GET
+def export_job_download(request, job_id):
+    job, error = _own_export_job(request, job_id)
+    if error:
+        return error
+    if job["status"] != export_jobs.STATUS_COMPLETED or not os.path.exists(job["artifact_path"] or ""):
+        return JsonResponse({"ok": False, "error": "export not ready", "status": job["status"]}, status=409)
+    return FileResponse(open(job["artifact_path"], "rb"), as_attachment=True,
+                        filename=job["filename"], content_type=job["content_type"])
+
+
+# ---------- Team workbook (managers) ----------
+TEAM_EXPORT_FETCH = 1000
+_SHEET_TITLE_BAD = str.maketrans({c: "_" for c in '[]:*?/\\'})
+
+
+def _sheet_title(name, used):
+    """Excel-safe, unique sheet title (max 31 chars)."""
+    base = (str(name or "").translate(_SHEET_TITLE_BAD).strip() or "Sheet")[:31]
+    title, n = base, 2
+    while title.lower() in used:
+        suffix = f" ({n})"
+        title = base[:31 - len(suffix)] + suffix
+        n += 1
+    used.add(title.lower())
+    return title
+
+
+def _ldap_directory_entries(ldaps):
+    """{lower(identity): {username, email, cn}} for emails/usernames in one ldap_directory query."""
+    keys = sorted({(v or "").strip().lower() for v in ldaps if (v or "").strip()})
+    if not keys:
+        return {}
+    in_sql, in_params = _sql_in_clause(keys)
+    with connection.cursor() as cur:
+        cur.execute(f"""
+            SELECT username, email, cn
+            FROM ldap_directory
+            WHERE email IN {in_sql} OR username IN {in_sql}
+        """, in_params + in_params)
+        entries = {}
+        for username, email, cn in cur.fetchall():
+            entry = {"username": username, "email": email, "cn": cn}
+            for k in (email, username):
+                if k:
+                    entries.setdefault(k.strip().lower(), entry)
+    return entries
+
+
+def _ldap_display_names(ldaps):
+    """{lower(identity): cn} for emails/usernames in one ldap_directory query."""
+    return {k: e["cn"] for k, e in _ldap_directory_entries(ldaps).items() if e.get("cn")}
+
+
+@require_GET
+def export_team_workbook(request):
+    """
+    One workbook for the manager's team (same reportee set as team_allocations):
+    a Summary sheet plus one sheet per person with their allocations and punches
+    for the billing period. Rows come from a single UNION query ordered by person
+    and are streamed with fetchmany into a write-only workbook, so memory stays
+    bounded by one fetch batch; the file is spooled to a temp file and streamed back.
+    """
+    session_ldap = request.session.get("ldap_username")
+    if not request.session.get("is_authenticated") or not session_ldap:
+        return redirect("accounts:login")
+    creds = (session_ldap, request.session.get("ldap_password"))
+
+    billing_start, billing_end = _resolve_export_period(request.GET.get("month"), None)
+    reportees = _session_team_reportees(request, session_ldap, creds)
+    if reportees is None:
+        return redirect("accounts:login")
+    keys = sorted({_allocation_user_key(r) for r in reportees if _allocation_user_key(r)})
+    if not keys:
+        return HttpResponseBadRequest("No reportees found")
+    names = _ldap_display_names(keys)
+
+    in_sql, in_params = _sql_in_clause(keys)
+    sql = f"""
+        SELECT 'A' AS kind, mae.user_key AS person, mae.user_ldap, p.name AS project_name, mae.iom_id,
+               pw.department, NULL AS punch_date, NULL AS week_number, mae.total_hours AS hours, NULL AS wbs
+        FROM monthly_allocation_entries mae
+        LEFT JOIN projects p ON mae.project_id = p.id
+        LEFT JOIN prism_wbs pw ON mae.iom_id = pw.iom_id
+        WHERE mae.month_start = %s AND mae.user_key IN {in_sql}
+        UNION ALL
+        SELECT 'P', up.user_key, up.user_ldap, p.name, mae.iom_id,
+               pw.department, up.punch_date, up.week_number, up.actual_hours, up.wbs
+        FROM user_punches up
+        LEFT JOIN monthly_allocation_entries mae ON mae.id = up.allocation_id
+        LEFT JOIN projects p ON mae.project_id = p.id
+        LEFT JOIN prism_wbs pw ON mae.iom_id = pw.iom_id
+        WHERE up.user_key IN {in_sql} AND up.punch_date BETWEEN %s AND %s
+        ORDER BY person, kind, punch_date, project_name
+    """
+    params = [billing_start] + in_params + in_params + [billing_start, billing_end]
+
+    wb = Workbook(write_only=True)
+    bold = Font(name="Calibri", bold=True)
+
+    def header(ws, values):
+        cells = []
+        for v in values:
+            c = WriteOnlyCell(ws, value=v)
+            c.font = bold
+            cells.append(c)
+        ws.append(cells)
+
+    summary = wb.create_sheet("Summary")
+    header(summary, ["Person", "Identity", "Allocated Hours", "Punched Hours", "Punch Days"])
+    used_titles = {"summary"}
+    totals = {}
+
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, params)
+        person, ws = None, None
+        while True:
+            batch = cur.fetchmany(TEAM_EXPORT_FETCH)
+            if not batch:
+                break
+            for kind, key, user_ldap, project_name, iom_id, dept, punch_date, week_number, hours, wbs in batch:
+                if key != person:
+                    person = key
+                    totals[key] = {"identity": user_ldap, "allocated": 0.0, "punched": 0.0, "days": set()}
+                    ws = wb.create_sheet(_sheet_title(names.get(key) or key, used_titles))
+                    header(ws, ["Type", "Project", "IOM", "Dept", "Date", "Week#", "Hours", "WBS"])
+                hrs = float(hours or 0)
+                if kind == "A":
+                    totals[key]["allocated"] += hrs
+                    ws.append(["Allocation", project_name, iom_id, dept, None, None, hrs, None])
+                else:
+                    totals[key]["punched"] += hrs
+                    totals[key]["days"].add(punch_date)
+                    ws.append(["Punch", project_name, iom_id, dept,
+                               punch_date.strftime("%Y-%m-%d") if hasattr(punch_date, "strftime") else punch_date,
+                               week_number, hrs, wbs or ""])
+    finally:
+        cur.close(); conn.close()
+
+    for key in keys:
+        t = totals.get(key, {"identity": key, "allocated": 0.0, "punched": 0.0, "days": ()})
+        summary.append([names.get(key) or key, t["identity"], round(t["allocated"], 2),
+                        round(t["punched"], 2), len(t["days"])])
+
+    tmp = tempfile.TemporaryFile(suffix=".xlsx")
+    wb.save(tmp)
+    tmp.seek(0)
+    filename = f"team_allocations_{billing_start.strftime('%Y-%m-%d')}.xlsx"
+    return FileResponse(tmp, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
+
+
+# ---------- Bulk export API (BI) ----------
+def _bulk_export_authorized(request):
+    """Bearer BULK_EXPORT_TOKEN, or a logged-in session whose role is in BULK_EXPORT_SESSION_ROLES."""
+    if request.session.get("is_authenticated"):
+        role = str(request.session.get("role", "EMPLOYEE") or "EMPLOYEE").upper()
+        if role in {str(r).upper() for r in getattr(settings, "BULK_EXPORT_SESSION_ROLES", ["ADMIN", "PDL"])}:
+            return True
+    token = getattr(settings, "BULK_EXPORT_TOKEN", "") or ""
+    auth = request.headers.get("Authorization", "")
+    return bool(token) and auth.startswith("Bearer ") and hmac.compare_digest(auth[7:].strip(), token)
+
+
+@require_GET
+def bulk_export(request, dataset):
+    """
+    Stream a whole dataset (allocations | weekly_allocations | punches | wbs) as CSV
+    or JSON lines, optionally gzip-compressed, in constant memory.
+
+    Query params: format=csv|jsonl, gzip=1, start/end=YYYY-MM-DD, project_id,
+    updated_since=YYYY-MM-DD[THH:MM:SS], after_id (resume). Auth: a logged-in session
+    with a BULK_EXPORT_SESSION_ROLES role, or "Authorization: Bearer <BULK_EXPORT_TOKEN>".
+    """
+    if not _bulk_export_authorized(request):
+        return HttpResponseForbidden("Not authorized")
+    if dataset not in bulk_export_data.DATASETS:
+        return HttpResponseBadRequest(f"Unknown dataset; use one of {', '.join(sorted(bulk_export_data.DATASETS))}")
+
+    fmt = (request.GET.get("format") or "csv").lower()
+    if fmt not in ("csv", "jsonl"):
+        return HttpResponseBadRequest("format must be csv or jsonl")
+    try:
+        start = datetime.strptime(request.GET["start"], "%Y-%m-%d").date() if request.GET.get("start") else None
+        end = datetime.strptime(request.GET["end"], "%Y-%m-%d").date() if request.GET.get("end") else None
+        updated_since = datetime.fromisoformat(request.GET["updated_since"]) if request.GET.get("updated_since") else None
+        project_id = int(request.GET["project_id"]) if request.GET.get("project_id") else None
+        after_id = int(request.GET.get("after_id") or 0)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid filter value")
+
+    page_size = int(getattr(settings, "BULK_EXPORT_PAGE_SIZE", bulk_export_data.DEFAULT_PAGE_SIZE))
+    columns = bulk_export_data.column_names(dataset)
+    rows = bulk_export_data.iter_rows(dataset, start=start, end=end, project_id=project_id,
+                                      updated_since=updated_since, after_id=after_id, page_size=page_size)
+    encode = bulk_export_data.encode_csv if fmt == "csv" else bulk_export_data.encode_jsonl
+    chunks = encode(columns, rows)
+
+    filename = f"{dataset}.{fmt}"
+    content_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    if request.GET.get("gzip") in ("1", "true", "yes"):
+        chunks = bulk_export_data.gzip_stream(chunks)
+        filename += ".gz"
+        content_type = "application/gzip"
+
+    response = StreamingHttpResponse(chunks, content_type=content_type)
     response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    response["X-Accel-Buffering"] = "no"
     return response
-
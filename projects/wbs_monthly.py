@@ -0,0 +1,81 @@
+"""
+projects/wbs_monthly.py
+
+Long-format companion of prism_wbs' twelve {mon}_hours / {mon}_fte columns.
+
+`prism_wbs_monthly` holds one row per (iom_id, year, month) with that month's
+planned hours and FTE, plus a stored `planned` flag (hours > 0 OR fte > 0).
+The (year, month, planned, iom_id) index turns "IOMs planned for a month"
+into an index range scan, and multi-month series into a single GROUP BY month,
+instead of interpolating a month column name into the SQL.
+
+prism_wbs stays the source of truth: the master importer calls
+`refresh_wbs_monthly` after upserting prism_wbs. Each IOM has exactly one
+prism_wbs row (uq_prism_wbs_iom), so its monthly rows are replaced as a set.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+MONTHLY_TABLE = "prism_wbs_monthly"
+MONTH_ABBRS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+REFRESH_BATCH = 500
+
+_MONTHS_TABLE = " UNION ALL ".join(f"SELECT {i} AS m" for i in range(1, 13))
+_HOURS_CASE = "CASE mm.m " + " ".join(
+    f"WHEN {i} THEN w.`{abbr}_hours`" for i, abbr in enumerate(MONTH_ABBRS, start=1)) + " END"
+_FTE_CASE = "CASE mm.m " + " ".join(
+    f"WHEN {i} THEN w.`{abbr}_fte`" for i, abbr in enumerate(MONTH_ABBRS, start=1)) + " END"
+
+# prism_wbs.year is free text from the master sheet ("2025", "2025.0", ...)
+_REFRESH_SELECT = f"""
+    INSERT INTO {MONTHLY_TABLE} (iom_id, year, month, hours, fte)
+    SELECT w.iom_id, CAST(LEFT(TRIM(w.year), 4) AS UNSIGNED), mm.m,
+           COALESCE({_HOURS_CASE}, 0), COALESCE({_FTE_CASE}, 0)
+    FROM prism_wbs w
+    CROSS JOIN ({_MONTHS_TABLE}) mm
+    WHERE TRIM(w.year) REGEXP '^[0-9]{{4}}'
+"""
+
+
+def refresh_wbs_monthly(cur, iom_ids=None):
+    """
+    Rebuild the monthly rows of the given IOMs (every IOM when None) from prism_wbs
+    inside the caller's transaction. Returns the number of rows written.
+    """
+    if iom_ids is None:
+        cur.execute(f"DELETE FROM {MONTHLY_TABLE}")
+        cur.execute(_REFRESH_SELECT)
+        return cur.rowcount
+
+    ids = sorted({str(i).strip() for i in iom_ids if i is not None and str(i).strip()})
+    written = 0
+    for i in range(0, len(ids), REFRESH_BATCH):
+        chunk = ids[i:i + REFRESH_BATCH]
+        placeholders = ",".join(["%s"] * len(chunk))
+        cur.execute(f"DELETE FROM {MONTHLY_TABLE} WHERE iom_id IN ({placeholders})", chunk)
+        cur.execute(_REFRESH_SELECT + f" AND w.iom_id IN ({placeholders})", chunk)
+        written += cur.rowcount
+    return written
+
+
+def monthly_series(cur, year, iom_subquery, params):
+    """
+    Planned hours and FTE per month of `year` summed over the IOMs selected by
+    `iom_subquery` (a SELECT returning iom_id) in one GROUP BY.
+    Returns ([hours x12], [fte x12]).
+    """
+    hours = [0.0] * 12
+    fte = [0.0] * 12
+    cur.execute(f"""
+        SELECT m.month, COALESCE(SUM(m.hours), 0), COALESCE(SUM(m.fte), 0)
+        FROM {MONTHLY_TABLE} m
+        WHERE m.year = %s AND m.planned = 1 AND m.iom_id IN ({iom_subquery})
+        GROUP BY m.month
+    """, [int(year)] + list(params))
+    for month, h, f in cur.fetchall():
+        if 1 <= int(month) <= 12:
+            hours[int(month) - 1] = float(h or 0)
+            fte[int(month) - 1] = float(f or 0)
+    return hours, fte
@@ -23,6 +23,8 @@ _PROGRESS_UPDATE_EVERY = getattr(settings, "LDAP_SYNC_PROGRESS_BATCH", 25)  # up
 
 from accounts.ldap_utils import _get_ldap_connection  # binds with credentials if provided
 from accounts.ldap_utils import get_reportees_for_user_dn, get_user_entry_by_username
+from projects.ownership import rebuild_project_ownership
+from projects.user_provisioning import provision_users_from_directory
 
 # ---------------------------
 # Helpers
@@ -114,6 +116,31 @@ def _upsert_ldap_user_row(attrs):
         raise
 
 
+def _provision_users(job_id):
+    """Bulk-provision users rows from the refreshed ldap_directory; failures do not fail the sync."""
+    try:
+        with connection.cursor() as cur:
+            provisioned = provision_users_from_directory(cur)
+        print(f"Provisioned users from {provisioned} directory entries for job {job_id}")
+        return provisioned
+    except Exception as ex:
+        logger.exception("Provisioning users for ldap sync job %s failed: %s", job_id, ex)
+        return None
+
+
+def _rebuild_ownership(job_id):
+    """Rebuild project_ownership from the refreshed directory/users rows; failures do not fail the sync."""
+    try:
+        with transaction.atomic():
+            with connection.cursor() as cur:
+                rows = rebuild_project_ownership(cur)
+        print(f"Rebuilt {rows} project_ownership rows for job {job_id}")
+        return rows
+    except Exception as ex:
+        logger.exception("Rebuilding project_ownership for ldap sync job %s failed: %s", job_id, ex)
+        return None
+
+
 # ---------------------------
 # LDAP sync worker (runs in a background thread)
 # ---------------------------
@@ -228,6 +255,8 @@ def _full_ldap_sync_worker(job_id, ldap_username, ldap_password):
                             _update_sync_job(job_id, errors_count=errors)
                         print(f"Error processing LDAP entry during job {job_id}: {entry_ex}")
                 print(f"Paged_search complete. Processed={processed}, Errors={errors}")
+                _provision_users(job_id)
+                _rebuild_ownership(job_id)
                 _update_sync_job(job_id, processed_count=processed, errors_count=errors, status="COMPLETED", finished_at=datetime.utcnow())
                 try:
                     conn.unbind()
@@ -290,6 +319,8 @@ def _full_ldap_sync_worker(job_id, ldap_username, ldap_password):
                     print(f"Error processing LDAP entry in fallback loop for job {job_id}: {entry_ex}")
 
             print(f"Fallback search complete. Processed={processed}, Errors={errors}")
+            _provision_users(job_id)
+            _rebuild_ownership(job_id)
             _update_sync_job(job_id, processed_count=processed, errors_count=errors, status="COMPLETED", finished_at=datetime.utcnow())
             try:
                 conn.unbind()
@@ -1,25 +1,47 @@
 # settings/views.py
+import os
 import re
 import json
+import time
+import zlib
+import random
+import shutil
 import datetime
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
 from typing import List, Tuple, Dict, Any, Optional
 
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.urls import reverse
-from django.db import connection
+from django.conf import settings
+from django.db import connection, transaction
 from django.views.decorators.http import require_http_methods
 from django.http import HttpResponseBadRequest, JsonResponse
 from django.views.decorators.http import require_GET, require_POST
 
+import mysql.connector
 import pandas as pd
 
+from projects.capacity import refresh_capacity_limits
+from projects.ownership import rebuild_project_ownership
+from projects.refdata import bump_refdata_version
+from projects.wbs_monthly import refresh_wbs_monthly
+
 # ---------- Configuration ----------
 MASTER_TABLE = "prism_master_wor"
 META_TABLE = "prism_master_wor_meta"
 IMPORT_HISTORY = "import_history"
 BATCH_SIZE = 500
 DROP_IF_EXISTS = True
+# "insert": always batched INSERTs; "auto": try LOAD DATA LOCAL INFILE and fall back
+# to batched INSERTs when the server (or client) disallows local infile.
+MASTER_LOAD_ENGINE = getattr(settings, "MASTER_IMPORT_LOAD_ENGINE", "insert")
+# parallel prism_wbs upsert: worker threads (one DB connection each) and retries
+WBS_UPSERT_WORKERS = int(getattr(settings, "MASTER_IMPORT_WBS_WORKERS", 4))
+WBS_UPSERT_RETRIES = 3
+RETRYABLE_DB_ERRORS = {1205, 1213}  # lock wait timeout, deadlock
 
 # reserved internal names we won't allow as sanitized columns
 RESERVED_COLS = {"id", "created_at"}
@@ -99,6 +121,393 @@ def _param_safe(v: Any) -> Any:
     return str(v)
 
 
+def _chunked(seq, size: int = BATCH_SIZE):
+    """Yield consecutive slices of `seq` with at most `size` items."""
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+# ---------- Master column type inference ----------
+MONTH_ABBRS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+
+# Preferred types for well-known PRISM headers (keyed by sanitized column name).
+# Inference still falls back to a wider type when the data does not fit the hint.
+MASTER_TYPE_HINTS: Dict[str, str] = {
+    "year": "INT",
+    "creator": "VARCHAR",
+    "program": "VARCHAR",
+    "department": "VARCHAR",
+    "status": "VARCHAR",
+    "total_hours": "DECIMAL",
+    "total_fte": "DECIMAL",
+    "total_hour_costs_local": "DECIMAL",
+    "date_created": "DATETIME",
+}
+for _m in MONTH_ABBRS:
+    MASTER_TYPE_HINTS[_m] = "DECIMAL"
+    MASTER_TYPE_HINTS[f"{_m}_hours"] = "DECIMAL"
+    MASTER_TYPE_HINTS[f"{_m}_fte"] = "DECIMAL"
+
+# Columns the dashboard filters/groups on; indexed when their inferred type allows it.
+MASTER_INDEXED_COLS = ["year", "creator", "program"]
+
+VARCHAR_MAX_LEN = 1024
+INDEXABLE_VARCHAR_LEN = 768  # 768 * 4 bytes (utf8mb4) = InnoDB 3072-byte key limit
+_INT_STR_RE = re.compile(r'^[+-]?(0|[1-9]\d*)$')
+_DEC_STR_RE = re.compile(r'^[+-]?(\d+\.\d*|\.\d+|\d+)$')
+
+
+def _classify_value(v: Any) -> Tuple[str, Any]:
+    """
+    Classify a raw cell value for type inference.
+    Returns (kind, normalized) where kind is one of
+    'null', 'int', 'decimal', 'date', 'datetime', 'str'.
+    Strings are only treated as numbers when they are plainly numeric
+    (codes with leading zeros such as '00123' stay strings).
+    """
+    try:
+        if v is pd.NA or v is pd.NaT:
+            return "null", None
+    except Exception:
+        pass
+    if v is None:
+        return "null", None
+    if isinstance(v, bool):
+        return "int", int(v)
+    if isinstance(v, float):
+        if v != v or v in (float("inf"), float("-inf")):
+            return "null", None
+        if v.is_integer():
+            return "int", int(v)
+        return "decimal", Decimal(repr(v))
+    if isinstance(v, int):
+        return "int", v
+    if isinstance(v, Decimal):
+        if v == v.to_integral_value():
+            return "int", int(v)
+        return "decimal", v
+    if isinstance(v, pd.Timestamp):
+        v = v.to_pydatetime()
+    if isinstance(v, datetime.datetime):
+        if v.hour == 0 and v.minute == 0 and v.second == 0 and v.microsecond == 0:
+            return "date", v.date()
+        return "datetime", v
+    if isinstance(v, datetime.date):
+        return "date", v
+    s = str(v).strip()
+    if s == "":
+        return "null", None
+    if _INT_STR_RE.match(s):
+        return "int", int(s)
+    if _DEC_STR_RE.match(s):
+        try:
+            return "decimal", Decimal(s)
+        except InvalidOperation:
+            pass
+    return "str", s
+
+
+def _varchar_len_for(max_len: int) -> int:
+    """Round a max observed length up to a stable VARCHAR bucket."""
+    for bucket in (32, 64, 128, 255, 512, VARCHAR_MAX_LEN):
+        if max_len <= bucket:
+            return bucket
+    return 0  # too long -> TEXT
+
+
+def _infer_column_type(col: str, values) -> str:
+    """
+    Infer a MySQL column type for a master sheet column from its values and
+    the optional MASTER_TYPE_HINTS entry. The chosen type holds every observed
+    value (fractions beyond 6 decimal places are rounded by MySQL).
+    """
+    hint = MASTER_TYPE_HINTS.get(col)
+    kinds = set()
+    max_len = 0
+    max_int_digits = 0
+    max_scale = 0
+    int_min, int_max = 0, 0
+    for raw in values:
+        kind, norm = _classify_value(raw)
+        if kind == "null":
+            continue
+        kinds.add(kind)
+        if kind == "int":
+            int_min, int_max = min(int_min, norm), max(int_max, norm)
+            max_int_digits = max(max_int_digits, len(str(abs(norm))))
+            max_len = max(max_len, len(str(norm)))
+        elif kind == "decimal":
+            sign, digits, exp = norm.as_tuple()
+            scale = max(0, -exp)
+            max_scale = max(max_scale, scale)
+            max_int_digits = max(max_int_digits, max(1, len(digits) - scale))
+            max_len = max(max_len, len(str(norm)))
+        elif kind in ("date", "datetime"):
+            max_len = max(max_len, 19)
+        else:
+            max_len = max(max_len, len(norm))
+
+    if not kinds:
+        # empty column: honour the hint, otherwise keep a small nullable text column
+        if hint == "DECIMAL":
+            return "DECIMAL(18,4)"
+        if hint in ("INT", "DATETIME"):
+            return hint
+        return "VARCHAR(255)"
+
+    if kinds <= {"int"} and hint != "DECIMAL":
+        if -2147483648 <= int_min and int_max <= 2147483647:
+            return "INT"
+        if -9223372036854775808 <= int_min and int_max <= 9223372036854775807:
+            return "BIGINT"
+
+    if kinds <= {"int", "decimal"} and (kinds != {"int"} or hint == "DECIMAL"):
+        scale = min(max(max_scale, 2 if hint == "DECIMAL" else 0), 6)
+        precision = max(18, max_int_digits + scale)
+        if precision <= 65:
+            return f"DECIMAL({precision},{scale})"
+
+    if kinds <= {"date"}:
+        return "DATE"
+    if kinds <= {"date", "datetime"}:
+        return "DATETIME"
+
+    if hint == "VARCHAR":
+        max_len = max(max_len, 255)
+    limit = INDEXABLE_VARCHAR_LEN if col in MASTER_INDEXED_COLS else VARCHAR_MAX_LEN
+    length = _varchar_len_for(max_len)
+    if length and length <= limit:
+        return f"VARCHAR({length})"
+    if col in MASTER_INDEXED_COLS and max_len <= INDEXABLE_VARCHAR_LEN:
+        return f"VARCHAR({INDEXABLE_VARCHAR_LEN})"
+    return "TEXT"
+
+
+def _coerce_for_type(v: Any, sql_type: str) -> Any:
+    """Convert a raw cell value into a parameter matching the inferred column type."""
+    kind, norm = _classify_value(v)
+    if kind == "null":
+        return None
+    base = sql_type.split("(")[0]
+    if base in ("INT", "BIGINT"):
+        return int(norm)
+    if base == "DECIMAL":
+        return Decimal(norm) if kind == "int" else norm
+    if base == "DATE":
+        return norm.strftime("%Y-%m-%d")
+    if base == "DATETIME":
+        return norm.strftime("%Y-%m-%d %H:%M:%S")
+    if kind in ("date", "datetime"):
+        return _param_safe(norm)
+    if kind in ("int", "decimal"):
+        return str(norm)
+    return _param_safe(v)
+
+
+def _master_index_ddl(col_types: Dict[str, str]) -> List[str]:
+    """KEY clauses for the dashboard filter columns whose types are indexable."""
+    indexable = [c for c in MASTER_INDEXED_COLS if c in col_types and col_types[c] != "TEXT"]
+    keys = []
+    if "year" in indexable and "creator" in indexable:
+        keys.append(f"KEY `idx_{MASTER_TABLE}_year_creator` (`year`,`creator`)")
+    elif "year" in indexable:
+        keys.append(f"KEY `idx_{MASTER_TABLE}_year` (`year`)")
+    if "creator" in indexable:
+        keys.append(f"KEY `idx_{MASTER_TABLE}_creator` (`creator`)")
+    if "program" in indexable:
+        keys.append(f"KEY `idx_{MASTER_TABLE}_program` (`program`)")
+    return keys
+
+
+# ---------- Header detection ----------
+# Header variants (first match wins) for the PRISM columns that feed projects/prism_wbs.
+MASTER_COLUMN_VARIANTS: Dict[str, List[str]] = {
+    "program": ["Program", "program", "Program "],
+    "buyer_oem": ["Buyer OEM", "Buyer_OEM", "BuyerOEM"],
+    "id": ["ID", "Id", "id"],
+    "buyer_wbs_cc": ["Buyer WBS/CC", "Buyer WBS", "Buyer_WBS_CC", "Buyer_WBS"],
+    "seller_wbs_cc": ["Seller WBS/CC", "Seller WBS", "Seller_WBS_CC", "Seller_WBS"],
+    "total_hours": ["Total Hours", "TotalHours"],
+    "total_fte": ["Total FTE", "TotalFTE"],
+    "status": ["Status", "status", "Request Status"],
+    "bg_code": ["BG Code", "BG_Code", "bg_code", "bg code"],
+    "year": ["Year", "year"],
+    "seller_country": ["Seller Country", "seller_country", "seller country", "Country"],
+    "creator": ["Creator", "creator", "Requesting Manager", "Requested By"],
+    "date_created": ["Date Created", "date_created", "datecreated", "Created At"],
+    "comment_of_creator": ["Comment of Creator", "comment_of_creator", "Comment", "Comments", "comment"],
+    "buyer_bau": ["Buyer BAU", "buyer_bau", "Buyer_BAU"],
+    "seller_bau": ["Seller BAU", "seller_bau", "Seller_BAU"],
+    "site": ["Site", "site", "Location"],
+    "function": ["Function", "function"],
+    "department": ["Department", "department"],
+}
+for _m in MONTH_ABBRS:
+    MASTER_COLUMN_VARIANTS[f"{_m}_hours"] = [
+        f"{_m}_hours", f"{_m.title()} Hours", f"{_m.title()}_Hours", f"{_m}", f"{_m.upper()}"]
+    MASTER_COLUMN_VARIANTS[f"{_m}_fte"] = [f"{_m}_fte", f"{_m.title()} FTE", f"{_m.title()}_FTE"]
+
+FCE_PROJECT_CANDIDATES = [
+    "project name", "project", "project name/description", "project name from", "project name in promise", "name in promise", "project name/description from region"
+]
+FCE_CODE_CANDIDATES = [
+    "mdm code", "mdm", "bg code", "bg", "bg_code", "mdm_code", "mdm/bgc", "mdm/bg"
+]
+
+
+def _sanitize_mapping(orig_headers) -> List[Tuple[Any, str]]:
+    """[(original header, sanitized column)] in sheet order."""
+    used = set()
+    return [(h, _sanitize_column(h, used, i)) for i, h in enumerate(orig_headers)]
+
+
+def _detect_master_columns(mapping: List[Tuple[Any, str]]) -> Dict[str, Optional[str]]:
+    """Map each MASTER_COLUMN_VARIANTS role to the sanitized column that holds it (or None)."""
+    mapping_lookup: Dict[str, str] = {}
+    for orig, col in mapping:
+        if orig is None:
+            continue
+        mapping_lookup[str(orig).strip().lower()] = col
+
+    def find_col_by_variants(variants: List[str]) -> Optional[str]:
+        for v in variants:
+            c = mapping_lookup.get(v.strip().lower())
+            if c:
+                return c
+        return None
+
+    return {role: find_col_by_variants(variants) for role, variants in MASTER_COLUMN_VARIANTS.items()}
+
+
+def _detect_fce_columns(orig_headers) -> Tuple[Any, Any]:
+    """Detect the (project name, MDM/BG code) headers of an FCE sheet."""
+    headers_norm = [(str(h).strip().lower() if h is not None else "") for h in orig_headers]
+
+    def find_column_by_candidates(candidates):
+        for cand in candidates:
+            cand_l = cand.lower()
+            for i, h in enumerate(headers_norm):
+                if cand_l in h:
+                    return orig_headers[i]
+        return None
+
+    proj_col = find_column_by_candidates(FCE_PROJECT_CANDIDATES)
+    code_col = find_column_by_candidates(FCE_CODE_CANDIDATES)
+
+    # Fallback heuristics if not found
+    if proj_col is None:
+        # pick the first header containing 'name' or 'project'
+        for i, h in enumerate(headers_norm):
+            if "project" in h or "name" in h:
+                proj_col = orig_headers[i]
+                break
+    if code_col is None:
+        for i, h in enumerate(headers_norm):
+            if "mdm" in h or "bg" in h:
+                code_col = orig_headers[i]
+                break
+
+    # Final fallback: use first two columns
+    if proj_col is None and len(orig_headers) >= 1:
+        proj_col = orig_headers[0]
+    if code_col is None and len(orig_headers) >= 2:
+        code_col = orig_headers[1]
+    return proj_col, code_col
+
+
+# ---------- Preview / dry-run ----------
+PREVIEW_ROWS = int(getattr(settings, "IMPORT_PREVIEW_ROWS", 50))
+IMPORT_STAGING_DIR = getattr(
+    settings, "IMPORT_STAGING_DIR", os.path.join(tempfile.gettempdir(), "feas_import_staging"))
+
+
+def _read_sheet_sample(source, sheet_index: int, header: int, nrows: int = PREVIEW_ROWS):
+    """
+    Read only the header and the first `nrows` data rows of one sheet.
+    Returns (sample_df, sheet_name, estimated_rows). The estimate comes from the
+    sheet's dimension record, so the rest of the sheet is never parsed; it is
+    None when the writing application did not store one.
+    """
+    xls = pd.ExcelFile(source)
+    try:
+        idx = sheet_index if len(xls.sheet_names) > sheet_index else 0
+        sheet_name = xls.sheet_names[idx]
+        # read the dimension before pandas touches the sheet (it resets read-only dimensions)
+        estimated = None
+        try:
+            max_row = xls.book[sheet_name].max_row
+            if max_row:
+                estimated = max(int(max_row) - (header + 1), 0)
+        except Exception:
+            pass
+        df = pd.read_excel(xls, sheet_name=sheet_name, header=header, nrows=nrows, dtype=object)
+    finally:
+        xls.close()
+    return df, sheet_name, estimated
+
+
+def _prune_staged_uploads(max_age: Optional[float] = None) -> int:
+    """
+    Delete staged files older than the session lifetime: their session (the only
+    reference to them) has expired, so a preview that was never confirmed would
+    otherwise stay on disk for good.
+    """
+    if max_age is None:
+        max_age = float(getattr(settings, "IMPORT_STAGING_MAX_AGE", settings.SESSION_COOKIE_AGE))
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        names = os.listdir(IMPORT_STAGING_DIR)
+    except OSError:
+        return 0
+    for name in names:
+        path = os.path.join(IMPORT_STAGING_DIR, name)
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+def _stage_upload(request, kind: str, uploaded_file) -> str:
+    """Keep a previewed upload on disk (path in the session) until the user confirms."""
+    _discard_staged_upload(request, kind)
+    _prune_staged_uploads()
+    os.makedirs(IMPORT_STAGING_DIR, exist_ok=True)
+    suffix = os.path.splitext(getattr(uploaded_file, "name", "") or "")[1] or ".xlsx"
+    fd, path = tempfile.mkstemp(prefix=f"{kind}_", suffix=suffix, dir=IMPORT_STAGING_DIR)
+    with os.fdopen(fd, "wb") as fh:
+        for chunk in uploaded_file.chunks():
+            fh.write(chunk)
+    request.session[f"import_staged_{kind}"] = {"path": path, "name": getattr(uploaded_file, "name", "")}
+    return path
+
+
+def _get_staged_upload(request, kind: str) -> Optional[Dict[str, str]]:
+    info = request.session.get(f"import_staged_{kind}")
+    if info and os.path.exists(info.get("path", "")):
+        return info
+    return None
+
+
+def _discard_staged_upload(request, kind: str):
+    info = request.session.pop(f"import_staged_{kind}", None)
+    if info and info.get("path"):
+        try:
+            os.remove(info["path"])
+        except OSError:
+            pass
+
+
+def _preview_cells(df, headers, limit=6) -> List[List[str]]:
+    rows = []
+    for _, row in df.head(limit).iterrows():
+        rows.append([str(row.get(h, "")) if not pd.isna(row.get(h, "")) else "" for h in headers])
+    return rows
+
+
 # ---------- Ensure meta & history tables ----------
 def _ensure_meta_table(cursor):
     cursor.execute(f"""
@@ -130,11 +539,188 @@ def _ensure_import_history_table(cursor):
             `wbs_failed` INT,
             `errors` LONGTEXT,
             `meta_map` LONGTEXT,
+            `load_engine` VARCHAR(32),
+            `load_rows_per_sec` DECIMAL(14,2),
             `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
     """)
 
 
+# columns added to import_history after its first release
+IMPORT_HISTORY_ADDED_COLS = [
+    ("load_engine", "VARCHAR(32) NULL"),
+    ("load_rows_per_sec", "DECIMAL(14,2) NULL"),
+]
+
+
+def _ensure_import_history_columns(cursor):
+    """Add columns introduced after the first release to an existing import_history."""
+    cursor.execute("""
+        SELECT COLUMN_NAME FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, [IMPORT_HISTORY])
+    present = {str(r[0]).lower() for r in cursor.fetchall()}
+    for col, ddl in IMPORT_HISTORY_ADDED_COLS:
+        if col not in present:
+            cursor.execute(f"ALTER TABLE `{IMPORT_HISTORY}` ADD COLUMN `{col}` {ddl}")
+
+
+# ---------- LOAD DATA fast path ----------
+# MySQL's default LOAD DATA format: tab separated, backslash escaped, \N for NULL
+_LOAD_DATA_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"})
+
+
+def _load_data_field(v: Any) -> str:
+    if v is None:
+        return "\\N"
+    if isinstance(v, Decimal):
+        return format(v, "f")
+    return str(v).translate(_LOAD_DATA_ESCAPES)
+
+
+def _infile_connection(infile_dir: str):
+    """
+    Dedicated mysql.connector connection for LOAD DATA LOCAL INFILE. Local
+    infile stays off on Django's connections; here the client may only read
+    files under `infile_dir`.
+    """
+    dbs = settings.DATABASES.get("default", {})
+    return mysql.connector.connect(
+        host=dbs.get("HOST", "127.0.0.1") or "127.0.0.1",
+        port=int(dbs.get("PORT", 3306) or 3306),
+        user=dbs.get("USER", "root") or "",
+        password=dbs.get("PASSWORD", "root") or "",
+        database=dbs.get("NAME", "feasdb") or "",
+        charset="utf8mb4",
+        use_unicode=True,
+        allow_local_infile_in_path=infile_dir,
+    )
+
+
+def _load_master_via_infile(cols: List[str], rows_values: List[tuple]) -> Tuple[int, List[str]]:
+    """
+    Write the coerced rows to a temporary TSV file and bulk-load it into
+    MASTER_TABLE with LOAD DATA LOCAL INFILE over a dedicated connection.
+    Returns (rows_loaded, warnings). Raises when local infile is disallowed.
+    """
+    infile_dir = tempfile.mkdtemp(prefix=f"{MASTER_TABLE}_")
+    path = os.path.join(infile_dir, "rows.tsv")
+    conn = None
+    try:
+        with open(path, "w", encoding="utf-8", newline="\n") as fh:
+            for r in rows_values:
+                fh.write("\t".join(_load_data_field(v) for v in r))
+                fh.write("\n")
+        cols_clause = ", ".join([f"`{c}`" for c in cols])
+        conn = _infile_connection(infile_dir)
+        cursor = conn.cursor()
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE `{MASTER_TABLE}` CHARACTER SET utf8mb4 ({cols_clause})",
+            [path])
+        loaded = cursor.rowcount
+        # with LOCAL, bad values become warnings instead of errors; surface a few of them
+        cursor.execute("SHOW WARNINGS LIMIT 20")
+        warnings = [f"{w[0]} {w[1]}: {w[2]}" for w in cursor.fetchall()]
+        conn.commit()
+        cursor.close()
+        return loaded, warnings
+    finally:
+        if conn is not None:
+            conn.close()
+        shutil.rmtree(infile_dir, ignore_errors=True)
+
+
+# ---------- Parallel prism_wbs upsert ----------
+def _db_error_code(exc: Exception) -> Optional[int]:
+    """MySQL error number of a (Django-wrapped) driver exception, if any."""
+    for e in (exc, getattr(exc, "__cause__", None)):
+        args = getattr(e, "args", None) or ()
+        if args and isinstance(args[0], int):
+            return args[0]
+    return None
+
+
+def _wbs_partition_key(iom_id: Any) -> str:
+    # uq_prism_wbs_iom uses a case-insensitive collation, so partition on the folded value
+    return str(iom_id).strip().lower()
+
+
+def _upsert_wbs_partition(upsert_sql: str, rows: List[tuple]) -> Tuple[int, int, List[str]]:
+    """
+    Upsert one partition of prism_wbs rows in BATCH_SIZE transactions.
+    Runs in a worker thread, so it uses (and finally closes) that thread's own
+    DB connection. Deadlocks/lock timeouts are retried with jittered backoff;
+    a batch that still fails is replayed row by row to pinpoint bad IOMs.
+    """
+    inserted = 0
+    failed = 0
+    errors: List[str] = []
+    try:
+        with connection.cursor() as cursor:
+            for batch in _chunked(rows):
+                for attempt in range(1, WBS_UPSERT_RETRIES + 1):
+                    try:
+                        with transaction.atomic():
+                            cursor.executemany(upsert_sql, batch)
+                        inserted += len(batch)
+                        break
+                    except Exception as e:
+                        if _db_error_code(e) in RETRYABLE_DB_ERRORS and attempt < WBS_UPSERT_RETRIES:
+                            time.sleep(0.05 * attempt + random.random() * 0.05)
+                            continue
+                        for r in batch:
+                            try:
+                                cursor.execute(upsert_sql, r)
+                                inserted += 1
+                            except Exception as row_e:
+                                failed += 1
+                                errors.append(f"IOM {r[0]} upsert failed: {row_e}")
+                        break
+    except Exception as e:
+        failed += len(rows) - inserted
+        errors.append(f"WBS upsert worker failed: {e}")
+    finally:
+        connection.close()
+    return inserted, failed, errors
+
+
+def _parallel_upsert_prism_wbs(insert_cols: List[str], rows: List[tuple]) -> Tuple[int, int, List[str]]:
+    """
+    Upsert prepared prism_wbs rows (iom_id first) across WBS_UPSERT_WORKERS threads.
+    Rows are hash-partitioned by iom_id so no two workers touch the same key, and
+    each partition is sorted by iom_id (stable, so repeated IOMs keep file order)
+    so batches take index locks in a deterministic order.
+    Returns (inserted_or_updated, failed, errors).
+    """
+    if not rows:
+        return 0, 0, []
+    cols_clause = ", ".join([f"`{c}`" for c in insert_cols])
+    placeholders = ", ".join(["%s"] * len(insert_cols))
+    update_clause = ", ".join([f"`{c}`=VALUES(`{c}`)" for c in insert_cols if c != "iom_id"])
+    upsert_sql = (f"INSERT INTO prism_wbs ({cols_clause}) VALUES ({placeholders}) "
+                  f"ON DUPLICATE KEY UPDATE {update_clause}")
+
+    workers = max(1, min(WBS_UPSERT_WORKERS, -(-len(rows) // BATCH_SIZE)))
+    partitions: List[List[tuple]] = [[] for _ in range(workers)]
+    for r in rows:
+        key = _wbs_partition_key(r[0])
+        partitions[zlib.crc32(key.encode("utf-8")) % workers].append(r)
+    for part in partitions:
+        part.sort(key=lambda r: _wbs_partition_key(r[0]))
+
+    inserted = 0
+    failed = 0
+    errors: List[str] = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="wbs-upsert") as pool:
+        futures = [pool.submit(_upsert_wbs_partition, upsert_sql, part) for part in partitions if part]
+        for fut in futures:
+            ok, bad, errs = fut.result()
+            inserted += ok
+            failed += bad
+            errors.extend(errs)
+    return inserted, failed, errors
+
+
 # ---------- Create application tables ----------
 def _create_projects_table(cursor):
     cursor.execute("""
@@ -228,17 +814,29 @@ def import_master(request):
         return render(request, "settings/import_master.html", {"preview_rows": None})
 
     if "reset" in request.POST:
+        _discard_staged_upload(request, "master")
         messages.info(request, "Import reset.")
         return redirect(reverse("settings:import_master"))
 
-    uploaded_file = request.FILES.get("file")
-    if not uploaded_file:
-        messages.error(request, "No file uploaded.")
-        return redirect(reverse("settings:import_master"))
+    if "confirm" in request.POST:
+        staged = _get_staged_upload(request, "master")
+        if not staged:
+            messages.error(request, "The previewed file is no longer available; please upload it again.")
+            return redirect(reverse("settings:import_master"))
+        uploaded_file = staged["path"]
+        filename = staged["name"] or "uploaded.xlsx"
+    else:
+        uploaded_file = request.FILES.get("file")
+        if not uploaded_file:
+            messages.error(request, "No file uploaded.")
+            return redirect(reverse("settings:import_master"))
+        filename = getattr(uploaded_file, "name", "uploaded.xlsx")
+
+    if "preview" in request.POST:
+        return _import_master_preview(request, uploaded_file)
 
     started_at = datetime.datetime.now()
     importer = getattr(request.user, "username", None) or "anonymous"
-    filename = getattr(uploaded_file, "name", "uploaded.xlsx")
 
     # Read first sheet into pandas
     try:
@@ -248,27 +846,32 @@ def import_master(request):
     except Exception as e:
         messages.error(request, f"Failed to read Excel first sheet: {e}")
         return redirect(reverse("settings:import_master"))
+    _discard_staged_upload(request, "master")
 
     if df.shape[0] == 0:
         messages.error(request, "Uploaded sheet is empty.")
         return redirect(reverse("settings:import_master"))
 
     orig_headers = list(df.columns)
-    used = set()
-    mapping: List[Tuple[str, str]] = []
-    for i, h in enumerate(orig_headers):
-        col = _sanitize_column(h, used, i)
-        mapping.append((h, col))
+    mapping = _sanitize_mapping(orig_headers)
     sanitized_cols = [col for (_orig, col) in mapping]
 
-    # Step A: create master table (all TEXT) and persist mapping
+    # Infer a native column type per sheet column (DECIMAL/INT/DATE/VARCHAR/TEXT)
+    col_types: Dict[str, str] = {}
+    for orig, col in mapping:
+        col_types[col] = _infer_column_type(col, df[orig].tolist())
+
+    # Step A: create typed master table and persist mapping
     ddl_warnings: List[str] = []
     master_inserted = 0
     master_failed = 0
+    load_engine = None
+    load_rows_per_sec = None
     try:
         with connection.cursor() as cursor:
             _ensure_meta_table(cursor)
             _ensure_import_history_table(cursor)
+            _ensure_import_history_columns(cursor)
 
             if DROP_IF_EXISTS:
                 try:
@@ -276,12 +879,13 @@ def import_master(request):
                 except Exception as e:
                     ddl_warnings.append(f"DROP master table warning: {e}")
 
-            cols_def = ",\n  ".join([f"`{c}` TEXT NULL" for _, c in mapping])
+            cols_def = ",\n  ".join([f"`{c}` {col_types[c]} NULL" for _, c in mapping])
+            index_def = "".join([f",\n  {k}" for k in _master_index_ddl(col_types)])
             create_sql = f"""
                 CREATE TABLE `{MASTER_TABLE}` (
                     `id` BIGINT AUTO_INCREMENT PRIMARY KEY,
                     `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    {cols_def}
+                    {cols_def}{index_def}
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
             """
             cursor.execute(create_sql)
@@ -303,30 +907,49 @@ def import_master(request):
                 vals = []
                 for orig, col in mapping:
                     raw = row.get(orig, None)
-                    safe_val = _param_safe(raw)
-                    vals.append(safe_val)
+                    vals.append(_coerce_for_type(raw, col_types[col]))
                 rows_values.append(tuple(vals))
 
-            # batch insert
-            for i in range(0, len(rows_values), BATCH_SIZE):
-                batch = rows_values[i:i + BATCH_SIZE]
+            load_started = time.perf_counter()
+            if MASTER_LOAD_ENGINE == "auto" and rows_values:
                 try:
-                    cursor.executemany(insert_sql, batch)
-                    master_inserted += len(batch)
-                except Exception:
-                    # fallback to row-by-row to capture faults precisely
-                    for j, r in enumerate(batch):
-                        try:
-                            cursor.execute(insert_sql, r)
-                            master_inserted += 1
-                        except Exception as e:
-                            master_failed += 1
-                            messages.warning(request, f"Master insert row {i + j + 1} failed: {e}")
+                    master_inserted, load_warnings = _load_master_via_infile(sanitized_cols, rows_values)
+                    master_failed = len(rows_values) - master_inserted
+                    load_engine = "load_data_infile"
+                    for w in load_warnings:
+                        messages.warning(request, f"Master load: {w}")
+                except Exception as e:
+                    ddl_warnings.append(f"LOAD DATA LOCAL INFILE unavailable, using batched inserts: {e}")
+                    cursor.execute(f"DELETE FROM `{MASTER_TABLE}`")
+                    master_inserted = 0
+
+            # batch insert
+            if load_engine != "load_data_infile":
+                load_engine = "batched_insert"
+                for i in range(0, len(rows_values), BATCH_SIZE):
+                    batch = rows_values[i:i + BATCH_SIZE]
+                    try:
+                        cursor.executemany(insert_sql, batch)
+                        master_inserted += len(batch)
+                    except Exception:
+                        # fallback to row-by-row to capture faults precisely
+                        for j, r in enumerate(batch):
+                            try:
+                                cursor.execute(insert_sql, r)
+                                master_inserted += 1
+                            except Exception as e:
+                                master_failed += 1
+                                messages.warning(request, f"Master insert row {i + j + 1} failed: {e}")
+            load_seconds = time.perf_counter() - load_started
+            load_rows_per_sec = round(master_inserted / load_seconds, 2) if load_seconds > 0 else None
     except Exception as e:
         messages.error(request, f"Failed to create/populate master table: {e}")
         return redirect(reverse("settings:import_master"))
 
-    messages.success(request, f"Master import: {master_inserted} rows inserted, {master_failed} failed.")
+    messages.success(request, f"Master import: {master_inserted} rows inserted, {master_failed} failed "
+                              f"({load_engine}, {load_rows_per_sec or 0} rows/sec).")
+    typed = sum(1 for t in col_types.values() if not t.startswith(("VARCHAR", "TEXT")))
+    messages.info(request, f"Column types inferred: {typed} numeric/date, {len(col_types) - typed} text.")
     for w in ddl_warnings:
         messages.warning(request, w)
 
@@ -341,28 +964,20 @@ def import_master(request):
         return redirect(reverse("settings:import_master"))
 
     # Step C: populate projects and prism_wbs (kept same as previously)
-    mapping_lookup: Dict[str, str] = {}
     col_to_orig = {}
     for orig, col in mapping:
         if orig is None:
             continue
-        mapping_lookup[str(orig).strip().lower()] = col
         col_to_orig[col] = orig
 
-    def find_col_by_variants(variants: List[str]) -> Optional[str]:
-        for v in variants:
-            c = mapping_lookup.get(v.strip().lower())
-            if c:
-                return c
-        return None
-
-    prog_col = find_col_by_variants(["Program", "program", "Program "])
-    buyer_oem_col = find_col_by_variants(["Buyer OEM", "Buyer_OEM", "BuyerOEM"])
-    id_col = find_col_by_variants(["ID", "Id", "id"])
-    buyer_wbs_col = find_col_by_variants(["Buyer WBS/CC", "Buyer WBS", "Buyer_WBS_CC"])
-    seller_wbs_col = find_col_by_variants(["Seller WBS/CC", "Seller WBS", "Seller_WBS_CC"])
-    total_hours_col = find_col_by_variants(["Total Hours", "TotalHours"])
-    total_fte_col = find_col_by_variants(["Total FTE", "TotalFTE"])
+    detected = _detect_master_columns(mapping)
+    prog_col = detected["program"]
+    buyer_oem_col = detected["buyer_oem"]
+    id_col = detected["id"]
+    buyer_wbs_col = detected["buyer_wbs_cc"]
+    seller_wbs_col = detected["seller_wbs_cc"]
+    total_hours_col = detected["total_hours"]
+    total_fte_col = detected["total_fte"]
 
     projects_created = 0
     wbs_inserted = 0
@@ -421,33 +1036,36 @@ def import_master(request):
                         errors.append(f"Failed to insert project '{p}': {e}")
 
             # Populate prism_wbs using ON DUPLICATE KEY UPDATE
-            def _find(orig_variants):
-                return find_col_by_variants(orig_variants)
-
-            status_col = _find(["Status", "status", "Request Status"])
-            bg_code_col = _find(["BG Code", "BG_Code", "bg_code", "bg code"])
-            year_col = _find(["Year", "year"])
-            seller_country_col = _find(["Seller Country", "seller_country", "seller country", "Country"])
-            creator_col = _find(["Creator", "creator", "Requesting Manager", "Requested By"])
-            date_created_col = _find(["Date Created", "date_created", "datecreated", "Created At"])
-            comment_col = _find(["Comment of Creator", "comment_of_creator", "Comment", "Comments", "comment"])
-            buyer_bau_col = _find(["Buyer BAU", "buyer_bau", "Buyer_BAU"])
-            seller_bau_col = _find(["Seller BAU", "seller_bau", "Seller_BAU"])
-            site_col = _find(["Site", "site", "Location"])
-            function_col = _find(["Function", "function"])
-            department_col = _find(["Department", "department"])
-            buyer_wbs_col = buyer_wbs_col or _find(["Buyer WBS/CC", "Buyer WBS", "Buyer_WBS_CC", "Buyer_WBS"])
-            seller_wbs_col = seller_wbs_col or _find(["Seller WBS/CC", "Seller WBS", "Seller_WBS_CC", "Seller_WBS"])
-
-            months = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
-            month_hours_cols = {}
-            month_fte_cols = {}
-            for m in months:
-                month_hours_cols[m] = _find(
-                    [f"{m}_hours", f"{m.title()} Hours", f"{m.title()}_Hours", f"{m}", f"{m.upper()}"])
-                month_fte_cols[m] = _find([f"{m}_fte", f"{m.title()} FTE", f"{m.title()}_FTE"])
-
-            # iterate rows and upsert
+            status_col = detected["status"]
+            bg_code_col = detected["bg_code"]
+            year_col = detected["year"]
+            seller_country_col = detected["seller_country"]
+            creator_col = detected["creator"]
+            date_created_col = detected["date_created"]
+            comment_col = detected["comment_of_creator"]
+            buyer_bau_col = detected["buyer_bau"]
+            seller_bau_col = detected["seller_bau"]
+            site_col = detected["site"]
+            function_col = detected["function"]
+            department_col = detected["department"]
+
+            months = MONTH_ABBRS
+            month_hours_cols = {m: detected[f"{m}_hours"] for m in months}
+            month_fte_cols = {m: detected[f"{m}_fte"] for m in months}
+
+            insert_cols = [
+                "iom_id", "status", "project_id", "bg_code", "year", "seller_country",
+                "creator", "date_created", "comment_of_creator",
+                "buyer_bau", "buyer_wbs_cc", "seller_bau", "seller_wbs_cc",
+                "site", "function", "department"
+            ]
+            insert_cols += [f"{m}_hours" for m in months]
+            insert_cols += ["total_hours"]
+            insert_cols += [f"{m}_fte" for m in months]
+            insert_cols += ["total_fte"]
+
+            # iterate rows and prepare upsert params (iom_id first)
+            wbs_rows: List[tuple] = []
             for _, row in df.iterrows():
                 iom_val = None
                 if id_col:
@@ -497,17 +1115,6 @@ def import_master(request):
                 months_hours_vals = {m: (read_val(month_hours_cols[m]) or 0) for m in months}
                 months_fte_vals = {m: (read_val(month_fte_cols[m]) or 0) for m in months}
 
-                insert_cols = [
-                    "iom_id", "status", "project_id", "bg_code", "year", "seller_country",
-                    "creator", "date_created", "comment_of_creator",
-                    "buyer_bau", "buyer_wbs_cc", "seller_bau", "seller_wbs_cc",
-                    "site", "function", "department"
-                ]
-                insert_cols += [f"{m}_hours" for m in months]
-                insert_cols += ["total_hours"]
-                insert_cols += [f"{m}_fte" for m in months]
-                insert_cols += ["total_fte"]
-
                 params = []
                 params.append(_param_safe(iom_val))
                 params.append(status_val)
@@ -533,23 +1140,30 @@ def import_master(request):
                     params.append(months_fte_vals.get(m, 0))
                 params.append(total_fte_val or 0)
 
-                cols_clause = ", ".join([f"`{c}`" for c in insert_cols])
-                placeholders = ", ".join(["%s"] * len(insert_cols))
-                update_clause = ",\n                          ".join(
-                    [f"`{c}`=VALUES(`{c}`)" for c in insert_cols if c != "iom_id"])
+                wbs_rows.append(tuple(params))
 
-                try:
-                    cursor.execute(f"""
-                        INSERT INTO prism_wbs ({cols_clause})
-                        VALUES ({placeholders})
-                        ON DUPLICATE KEY UPDATE
-                          {update_clause}
-                    """, params)
-                    wbs_inserted += 1
-                except Exception as e:
-                    wbs_failed += 1
-                    errors.append(f"IOM {iom_val} upsert failed: {e}")
+        # upsert outside the request cursor: workers use their own connections
+        wbs_inserted, wbs_failed, wbs_errors = _parallel_upsert_prism_wbs(insert_cols, wbs_rows)
+        errors.extend(wbs_errors)
 
+        # creators may have changed: rebuild the visibility index in one transaction
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    rebuild_project_ownership(cursor)
+        except Exception as e:
+            errors.append(f"project_ownership rebuild failed: {e}")
+
+        # long-format month rows for the IOMs just upserted
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    refresh_wbs_monthly(cursor, [r[0] for r in wbs_rows])
+        except Exception as e:
+            errors.append(f"prism_wbs_monthly refresh failed: {e}")
+
+        # new projects from the Program column
+        bump_refdata_version()
 
     except Exception as e:
         messages.error(request, f"Failed during projects/WBS population: {e}")
@@ -561,8 +1175,9 @@ def import_master(request):
             cursor.execute(f"""
                 INSERT INTO `{IMPORT_HISTORY}`
                 (`imported_by`,`filename`,`started_at`,`finished_at`,`total_rows`,
-                 `master_inserted`,`master_failed`,`projects_created`,`wbs_inserted`,`wbs_failed`,`errors`,`meta_map`)
-                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                 `master_inserted`,`master_failed`,`projects_created`,`wbs_inserted`,`wbs_failed`,`errors`,`meta_map`,
+                 `load_engine`,`load_rows_per_sec`)
+                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
             """, [
                 importer,
                 filename,
@@ -575,7 +1190,9 @@ def import_master(request):
                 int(wbs_inserted),
                 int(wbs_failed),
                 json.dumps(errors[:2000]),
-                json.dumps({orig: col for orig, col in mapping})
+                json.dumps({orig: col for orig, col in mapping}),
+                load_engine,
+                load_rows_per_sec,
             ])
     except Exception as e:
         messages.warning(request, f"Failed to write import history: {e}")
@@ -586,9 +1203,7 @@ def import_master(request):
         messages.warning(request, f"{len(errors)} errors occurred during import. Check import_history table for details.")
 
     preview_headers = orig_headers
-    preview_rows = []
-    for _, row in df.head(6).iterrows():
-        preview_rows.append([str(row.get(h, "")) if not pd.isna(row.get(h, "")) else "" for h in orig_headers])
+    preview_rows = _preview_cells(df, orig_headers)
 
     return render(request, "settings/import_master.html", {
         "preview_headers": preview_headers,
@@ -596,6 +1211,51 @@ def import_master(request):
     })
 
 
+def _import_master_preview(request, uploaded_file):
+    """
+    Dry run of import_master: read the header and first PREVIEW_ROWS rows only,
+    show the sanitized column mapping, the detected PRISM roles, inferred types
+    and the estimated row count. The upload is staged until the user confirms.
+    """
+    t0 = time.perf_counter()
+    try:
+        _stage_upload(request, "master", uploaded_file)
+        staged = _get_staged_upload(request, "master")
+        df, sheet_name, estimated_rows = _read_sheet_sample(staged["path"], 0, 0)
+    except Exception as e:
+        _discard_staged_upload(request, "master")
+        messages.error(request, f"Failed to read Excel first sheet: {e}")
+        return redirect(reverse("settings:import_master"))
+
+    orig_headers = list(df.columns)
+    mapping = _sanitize_mapping(orig_headers)
+    detected = _detect_master_columns(mapping)
+    roles_by_col: Dict[str, List[str]] = {}
+    for role, col in detected.items():
+        if col:
+            roles_by_col.setdefault(col, []).append(role)
+    column_plan = [{
+        "header": str(orig),
+        "column": col,
+        "type": _infer_column_type(col, df[orig].tolist()),
+        "roles": ", ".join(roles_by_col.get(col, [])),
+    } for orig, col in mapping]
+    missing_roles = [r for r in ("id", "program", "creator", "year") if not detected.get(r)]
+
+    return render(request, "settings/import_master.html", {
+        "dry_run": True,
+        "sheet_name": sheet_name,
+        "staged_filename": getattr(uploaded_file, "name", ""),
+        "estimated_rows": estimated_rows,
+        "sampled_rows": int(len(df)),
+        "column_plan": column_plan,
+        "missing_roles": missing_roles,
+        "elapsed_ms": int((time.perf_counter() - t0) * 1000),
+        "preview_headers": orig_headers,
+        "preview_rows": _preview_cells(df, orig_headers),
+    })
+
+
 # ---------------------- Utilities & Settings endpoints ----------------------
 
 def dictfetchall(cursor):
@@ -623,6 +1283,7 @@ def holidays_add(request):
     with connection.cursor() as cur:
         cur.execute("INSERT INTO holidays (holiday_date, name, created_by) VALUES (%s,%s,%s)",
                     [d, name, request.user.email if request.user.is_authenticated else None])
+        refresh_capacity_limits(cur, covering_date=d)
     return redirect(reverse("settings:settings_holidays"))
 
 
@@ -771,6 +1432,7 @@ def save_monthly_hours(request):
                       max_hours = VALUES(max_hours),
                       updated_at = CURRENT_TIMESTAMP
                 """, [year, month, sd, ed, value])
+            refresh_capacity_limits(cur)
     except Exception as ex:
         return JsonResponse({"ok": False, "error": str(ex)})
 
@@ -840,6 +1502,8 @@ def _ensure_import_history_table(cur):
               wbs_failed INT DEFAULT 0,
               errors TEXT,
               meta_map TEXT,
+              load_engine VARCHAR(32),
+              load_rows_per_sec DECIMAL(14,2),
               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
         """)
@@ -859,20 +1523,32 @@ def import_fce_projects(request):
 
     # reset behavior
     if "reset" in request.POST:
+        _discard_staged_upload(request, "fce")
         messages.info(request, "FCE import reset.")
         return redirect(reverse("settings:import_fce_projects"))
 
-    uploaded_file = request.FILES.get("file")
-    if not uploaded_file:
-        messages.error(request, "No file uploaded.")
-        return redirect(reverse("settings:import_fce_projects"))
+    if "confirm" in request.POST:
+        staged = _get_staged_upload(request, "fce")
+        if not staged:
+            messages.error(request, "The previewed file is no longer available; please upload it again.")
+            return redirect(reverse("settings:import_fce_projects"))
+        uploaded_file = staged["path"]
+        filename = staged["name"] or "fce_uploaded.xlsx"
+    else:
+        uploaded_file = request.FILES.get("file")
+        if not uploaded_file:
+            messages.error(request, "No file uploaded.")
+            return redirect(reverse("settings:import_fce_projects"))
+        filename = getattr(uploaded_file, "name", "fce_uploaded.xlsx")
 
     create_projects = bool(request.POST.get("create_projects", None))
     update_existing = bool(request.POST.get("update_existing", None))
 
+    if "preview" in request.POST:
+        return _import_fce_preview(request, uploaded_file, create_projects, update_existing)
+
     started_at = datetime.datetime.now()
     importer = getattr(request.user, "username", None) or "anonymous"
-    filename = getattr(uploaded_file, "name", "fce_uploaded.xlsx")
 
     # --- Read the second sheet with header on row index 1 (second row) ---
     try:
@@ -891,6 +1567,7 @@ def import_fce_projects(request):
     except Exception as e:
         messages.error(request, f"Failed to read sheet '{chosen_sheet}': {e}")
         return redirect(reverse("settings:import_fce_projects"))
+    _discard_staged_upload(request, "fce")
 
     if df.shape[0] == 0:
         messages.error(request, "The selected sheet is empty.")
@@ -898,44 +1575,7 @@ def import_fce_projects(request):
 
     # Detect likely project-name column and mdm/bg code column
     orig_headers = list(df.columns)
-    headers_norm = [ (str(h).strip().lower() if h is not None else "") for h in orig_headers ]
-
-    def find_column_by_candidates(candidates):
-        for cand in candidates:
-            cand_l = cand.lower()
-            for i, h in enumerate(headers_norm):
-                if cand_l in h:
-                    return orig_headers[i]
-        return None
-
-    proj_candidates = [
-        "project name", "project", "project name/description", "project name from", "project name in promise", "name in promise", "project name/description from region"
-    ]
-    code_candidates = [
-        "mdm code", "mdm", "bg code", "bg", "bg_code", "mdm_code", "mdm/bgc", "mdm/bg"
-    ]
-
-    proj_col = find_column_by_candidates(proj_candidates)
-    code_col = find_column_by_candidates(code_candidates)
-
-    # Fallback heuristics if not found
-    if proj_col is None:
-        # pick the first header containing 'name' or 'project'
-        for i, h in enumerate(headers_norm):
-            if "project" in h or "name" in h:
-                proj_col = orig_headers[i]
-                break
-    if code_col is None:
-        for i, h in enumerate(headers_norm):
-            if "mdm" in h or "bg" in h:
-                code_col = orig_headers[i]
-                break
-
-    # Final fallback: use first two columns
-    if proj_col is None and len(orig_headers) >= 1:
-        proj_col = orig_headers[0]
-    if code_col is None and len(orig_headers) >= 2:
-        code_col = orig_headers[1]
+    proj_col, code_col = _detect_fce_columns(orig_headers)
 
     # Prepare working df: trim strings, drop completely empty project names
     working = df.copy()
@@ -992,67 +1632,99 @@ def import_fce_projects(request):
     subprojects_updated = 0
     errors = []
 
-    # Cache existing projects
-    with connection.cursor() as cur:
-        cur.execute("SELECT id, name FROM projects")
-        existing_projects = { (row[1] or "").strip(): row[0] for row in cur.fetchall() }
+    # Collapse pairs onto the subprojects unique key (project_id, name): with
+    # update_existing the last code seen for a name wins, otherwise the first.
+    desired: Dict[str, Tuple[int, str, Optional[str]]] = {}
+    for idx, row in unique_pairs.iterrows():
+        project_name = (row["project_name"] or "").strip()
+        mdm_code_raw = (row["mdm_code"] or "").strip()
+        mdm_code = mdm_code_raw if mdm_code_raw != "" else None
+        key = project_name.lower()
+        if key in desired and not update_existing:
+            continue
+        desired[key] = (idx, project_name, mdm_code)
 
-    # Use transaction.atomic to group the import operations (each row still uses DB cursor)
+    # Use transaction.atomic to group the import; every step below is set-based
+    # and issues one statement per chunk of BATCH_SIZE names.
     try:
         with transaction.atomic():
             with connection.cursor() as cur:
-                for idx, row in unique_pairs.iterrows():
-                    project_name = (row["project_name"] or "").strip()
-                    mdm_code_raw = (row["mdm_code"] or "").strip()
-                    mdm_code = mdm_code_raw if mdm_code_raw != "" else None
-
-                    # find or create parent project
-                    project_id = existing_projects.get(project_name)
-                    if project_id is None and create_projects:
-                        try:
-                            cur.execute("INSERT INTO projects (name) VALUES (%s)", [project_name])
-                            project_id = cur.lastrowid
-                            existing_projects[project_name] = project_id
-                            projects_created += 1
-                        except Exception:
-                            # race-safe fetch fallback
-                            cur.execute("SELECT id FROM projects WHERE name=%s LIMIT 1", [project_name])
-                            rr = cur.fetchone()
-                            if rr:
-                                project_id = rr[0]
-                                existing_projects[project_name] = project_id
-
+                names = [v[1] for v in desired.values()]
+
+                # 1) resolve parent projects already present
+                project_ids: Dict[str, int] = {}
+                for chunk in _chunked(names):
+                    cur.execute(
+                        f"SELECT id, name FROM projects WHERE name IN ({', '.join(['%s'] * len(chunk))})",
+                        chunk)
+                    for pid, pname in cur.fetchall():
+                        project_ids[(pname or "").strip().lower()] = pid
+
+                # 2) create the missing parents with multi-row INSERT IGNORE, then resolve their ids
+                missing = [n for n in names if n.lower() not in project_ids]
+                if missing and create_projects:
+                    for chunk in _chunked(missing):
+                        cur.execute(
+                            f"INSERT IGNORE INTO projects (name) VALUES {', '.join(['(%s)'] * len(chunk))}",
+                            chunk)
+                        projects_created += max(cur.rowcount, 0)
+                        cur.execute(
+                            f"SELECT id, name FROM projects WHERE name IN ({', '.join(['%s'] * len(chunk))})",
+                            chunk)
+                        for pid, pname in cur.fetchall():
+                            project_ids[(pname or "").strip().lower()] = pid
+
+                rows = []
+                for key, (idx, project_name, mdm_code) in desired.items():
+                    project_id = project_ids.get(key)
                     # If still no project_id, skip this row (user can enable create_projects or fix data)
                     if project_id is None:
                         errors.append(f"Row {idx+1}: missing parent project '{project_name}' (skipped)")
                         continue
-
-                    # Upsert into subprojects by (project_id, name)
+                    rows.append((project_id, project_name, mdm_code))
+
+                # 3) which (project_id, name) keys already exist -> created/updated counts
+                existing_keys = set()
+                for chunk in _chunked(sorted({r[0] for r in rows})):
+                    cur.execute(
+                        f"SELECT project_id, name FROM subprojects WHERE project_id IN ({', '.join(['%s'] * len(chunk))})",
+                        chunk)
+                    for pid, sname in cur.fetchall():
+                        existing_keys.add((pid, (sname or "").strip().lower()))
+
+                # 4) chunked upsert on uq_subproject_project_name
+                if update_existing:
+                    on_dup = ("mdm_code=VALUES(mdm_code), bg_code=VALUES(bg_code), "
+                              "updated_at=CURRENT_TIMESTAMP")
+                else:
+                    on_dup = "project_id=project_id"
+                for chunk in _chunked(rows):
+                    params = []
+                    for project_id, project_name, mdm_code in chunk:
+                        params.extend([project_id, project_name, mdm_code, mdm_code])
                     try:
-                        cur.execute("SELECT id FROM subprojects WHERE project_id=%s AND name=%s LIMIT 1", [project_id, project_name])
-                        ex = cur.fetchone()
-                        if ex:
-                            sub_id = ex[0]
+                        cur.execute(f"""
+                            INSERT INTO subprojects (project_id, name, mdm_code, bg_code)
+                            VALUES {', '.join(['(%s, %s, %s, %s)'] * len(chunk))}
+                            ON DUPLICATE KEY UPDATE {on_dup}
+                        """, params)
+                    except Exception as ex_up:
+                        errors.append(f"Subproject chunk of {len(chunk)} rows failed: {ex_up}")
+                        continue
+                    for project_id, project_name, _code in chunk:
+                        if (project_id, project_name.lower()) in existing_keys:
                             if update_existing:
-                                cur.execute("""
-                                    UPDATE subprojects
-                                       SET mdm_code=%s, bg_code=%s, updated_at=CURRENT_TIMESTAMP
-                                     WHERE id=%s
-                                """, [mdm_code, mdm_code, sub_id])
                                 subprojects_updated += 1
                         else:
-                            cur.execute("""
-                                INSERT INTO subprojects (project_id, name, mdm_code, bg_code)
-                                VALUES (%s, %s, %s, %s)
-                            """, [project_id, project_name, mdm_code, mdm_code])
                             subprojects_created += 1
-                    except Exception as ex_up:
-                        errors.append(f"Row {idx+1} failed: {ex_up}")
 
     except Exception as ex_all:
         messages.error(request, f"Transaction failed during import: {ex_all}")
         return redirect(reverse("settings:import_fce_projects"))
 
+    if projects_created:
+        bump_refdata_version()
+
     finished_at = datetime.datetime.now()
 
     # Write import_history (best-effort)
@@ -1109,3 +1781,50 @@ def import_fce_projects(request):
     return render(request, "settings/import_fce.html", context)
 
 
+def _import_fce_preview(request, uploaded_file, create_projects: bool, update_existing: bool):
+    """
+    Dry run of import_fce_projects: sample the header and first PREVIEW_ROWS rows
+    of the FCE sheet, show the detected project/code columns and estimated row
+    count with the inferred column types, and stage the upload until the user confirms.
+    """
+    t0 = time.perf_counter()
+    try:
+        _stage_upload(request, "fce", uploaded_file)
+        staged = _get_staged_upload(request, "fce")
+        # sheet index 1, header on the second row (falls back to the first sheet)
+        df, sheet_name, estimated_rows = _read_sheet_sample(staged["path"], 1, 1)
+    except Exception as e:
+        _discard_staged_upload(request, "fce")
+        messages.error(request, f"Failed to open Excel: {e}")
+        return redirect(reverse("settings:import_fce_projects"))
+
+    orig_headers = list(df.columns)
+    proj_col, code_col = _detect_fce_columns(orig_headers)
+    column_plan = [{
+        "header": str(h),
+        "column": "project_name" if h == proj_col else ("mdm_code / bg_code" if h == code_col else ""),
+        "type": _infer_column_type(str(h), df[h].tolist()),
+        "roles": "",
+    } for h in orig_headers]
+
+    sample = []
+    for _, r in df.iterrows():
+        name = "" if proj_col is None or pd.isna(r.get(proj_col)) else str(r.get(proj_col)).strip()
+        code = "" if code_col is None or pd.isna(r.get(code_col)) else str(r.get(code_col)).strip()
+        if name:
+            sample.append([name, code])
+
+    return render(request, "settings/import_fce.html", {
+        "dry_run": True,
+        "chosen_sheet": sheet_name,
+        "chosen_header_row": 1,
+        "staged_filename": getattr(uploaded_file, "name", ""),
+        "estimated_rows": estimated_rows,
+        "sampled_rows": int(len(df)),
+        "column_plan": column_plan,
+        "create_projects": create_projects,
+        "update_existing": update_existing,
+        "elapsed_ms": int((time.perf_counter() - t0) * 1000),
+        "preview_headers": ["project_name", "mdm_code"],
+        "preview_rows": sample[:10],
+    })